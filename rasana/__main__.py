@@ -22,21 +22,29 @@
 
 import os
 import re
+import sys
 import json
-import shutil
-from glob import glob
-from typing import Callable, Optional
-from bs4 import BeautifulSoup as bs4
-from .markdown import render as render_markdown, get_stylesheet as get_markdown_stylesheet
-from .js import minify_css, minify_js, compile_ejs_template
+import argparse
+from typing import Optional
+from .markdown import get_stylesheet as get_markdown_stylesheet
+from .js import minify_css
+from .incremental import hash_json, load_manifest, save_manifest, is_entry_up_to_date, remove_stale_outputs,\
+    relative_outputs
+from .pages import get_file_contents, copy_resources, get_resources_key, build_pages, extract_shared_assets
+from .resources import SYNC_MODES, COMPARE_MODES
+from .contents import scan_contents
+from .search import build_search_index
+from .images import is_image_processing_available, plan_images, prepare_images, describe_images,\
+    sync_image_variants
+from .compress import get_available_compressions, precompress_outputs
+from .output import write_output, get_output_signatures, compute_delta, save_delta
+from .serve import watch, serve
+from .js_runtime import JS_RUNTIME
+from .instrumentation import PROFILER
 
 HOME_DIRECTORY = os.path.expanduser("~")
 
-def get_file_contents(file_path: str) -> str:
-    with open(file_path) as f:
-        return f.read()
-
-def build(website_path: str, output_path: str, base_url: str) -> None:
+def build(website_path: str, output_path: str, base_url: str, incremental: bool = False, jobs: int = 1, html_processor: str = 'stream', resource_mode: str = 'copy', resource_compare: str = 'stat', template_engine: Optional[str] = None, inline_asset_threshold: Optional[int] = None, search_index: bool = False, image_widths: Optional[list] = None, image_quality: int = 80, precompress: Optional[list] = None, gzip_level: int = 9, brotli_quality: int = 11) -> dict:
     if base_url[-1] == '/':
         base_url = base_url[:-1]
     website_specs_json = os.path.join(website_path, 'website.json')
@@ -73,30 +81,10 @@ def build(website_path: str, output_path: str, base_url: str) -> None:
         raise Exception(f'Every theme must contain a 404 template')
     if 'contents' not in website_specs:
         raise Exception(f'No base path for contents were provided')
-    def gather_contents(base_path: str, parent_specs) -> dict:
-        items = {}
-        for child_path in glob(f'{base_path}/*/'):
-            child_path = child_path[:-1]
-            item = os.path.basename(child_path)
-            if 'resources' in parent_specs and\
-               os.path.basename(item) in parent_specs['resources']:
-                continue
-            items[item] = {}
-            item_specs = {}
-            item_specs_json = os.path.join(child_path, 'item.json')
-            if os.path.isfile(item_specs_json):
-                with open(item_specs_json) as f:
-                    items[item]['specs'] = item_specs = json.load(f)
-            children = gather_contents(child_path, item_specs)
-            if children is not None:
-                items[item]['children'] = children
-        return items or None
-    items = {
-        'children': gather_contents(
-            os.path.join(website_path, website_specs['contents']),
-            {}
-        )
-    }
+    with PROFILER.phase('scan contents'):
+        items = {
+            'children': scan_contents(os.path.join(website_path, website_specs['contents']))
+        }
     additional_stylesheets = {}
     if 'additionalStylesheets' in website_specs:
         additional_stylesheets = {\
@@ -104,153 +92,293 @@ def build(website_path: str, output_path: str, base_url: str) -> None:
             for var_name, file_path in\
             website_specs['additionalStylesheets'].items()\
         }
-    def get_template_renderer(template_name: str) -> Callable:
-        if template_name not in get_template_renderer.__templates:
-            with open(os.path.join(theme_specs['base_path'], theme_specs['templates'][template_name])) as f:
-                get_template_renderer.__templates[template_name] = compile_ejs_template(f.read())
-        return get_template_renderer.__templates[template_name]
-    get_template_renderer.__templates = {}
+    # Even full builds need the previous outputs, to remove the ones that are not produced anymore
+    previous_manifest = load_manifest(output_path)
+    manifest = {
+        'site': hash_json({
+            'websiteSpecs': website_specs,
+            'themeSpecs': theme_specs,
+            'baseURL': base_url,
+            # Pages only link to the stylesheets, their contents are written out on every build
+            'additionalStylesheets': sorted(additional_stylesheets),
+            'templateEngine': template_engine,
+            'inlineAssetThreshold': inline_asset_threshold,
+            'searchIndex': search_index,
+            'imageWidths': image_widths,
+            'imageQuality': image_quality if image_widths else None
+        }),
+        'entries': {}
+    }
+    previous_entries = {}
+    if incremental and previous_manifest.get('site') == manifest['site']:
+        previous_entries = previous_manifest.get('entries', {})
     def clean_posix_path(url: str) -> str:
         url = url.replace('/./', '/')
         url = re.sub(r'/[^\/]+/\.\.(?=/)', '/', url)
         url = re.sub('//+', '/', url)
         return url
-    def copy_resources(node: dict, base_path: str, node_output_path: str) -> None:
-        if 'resources' in node:
-            for r, rtype in node['resources'].items():
-                if os.path.isdir(os.path.join(base_path, r)):
-                    shutil.copytree(
-                        os.path.join(base_path, r),
-                        os.path.join(node_output_path, (rtype or r)),
-                        symlinks=True,
-                        dirs_exist_ok=True
-                    )
-                elif os.path.isfile(os.path.join(base_path, r)):
-                    if rtype not in ['css', 'font', 'img', 'js']:
-                        # TODO: Warn the inconsistency
-                        pass
-                    else:
-                        shutil.copy2(
-                            os.path.join(base_path, r),
-                            os.path.join(node_output_path, rtype, r)
-                        )
-    def build_node_contents(node: dict, base_path: str, node_output_path: str, relative_url: str, html_file_name: Optional[str] = 'index'):
-        # TODO: Warn the inconsistency if `relative_url` is not empty
-        if 'template' not in node:
-            node['template'] = 'default'
-        extra_stylesheets = []
-        if 'extraStylesheets' in node:
-            extra_stylesheets = node['extraStylesheets']
-        if 'markdowns' in node:
-            md_vars = {}
-            for var_name, file_name in node['markdowns'].items():
-                contents_markdown = os.path.join(website_path, base_path, file_name)
-                if os.path.isfile(contents_markdown):
-                    md_vars[var_name] = render_markdown(contents_markdown)
-                else:
-                    # TODO: Warn the inconsistency
-                    pass
-            if 'markdown' not in additional_stylesheets:
-                additional_stylesheets['markdown'] = get_markdown_stylesheet()
-            if 'variables' not in node:
-                node['variables'] = {}
-            node['variables'].update(md_vars)
-            extra_stylesheets.append('markdown')
-        html_renderer = get_template_renderer(node['template'])
-        html = html_renderer({
-            'websiteSpecs':website_specs,
-            'themeSpecs': theme_specs,
-            'items': items,
-            'baseURL': base_url,
-            'nodeSpecs': node,
-            'breadCrumb': [e for e in relative_url.split('/') if e]
-        })
-        html = bs4(html, features="html.parser")
-        for s in html.find_all('script'):
-            if not s.get('type') or s.get('type').lower() == 'javascript':
-                s.string = minify_js(s.string)['code']
-        for s in html.find_all('style'):
-            if not s.get('type') or s.get('type').lower() == 'javascript':
-                s.string = minify_css(s.string)['css']
-        for s in extra_stylesheets:
-            new_stylesheet_node = html.new_tag('link')
-            new_stylesheet_node['rel'] = 'stylesheet'
-            new_stylesheet_node['href'] = f'./css/{s[2:]}.css' if s.startswith('./') else f'/css/{s}.css'
-            html.find('head').append(new_stylesheet_node)
-        if 'inlineStyles' in node:
-            new_stylesheet_node = html.new_tag('style')
-            new_stylesheet_node.string = get_file_contents(
-                os.path.join(
-                    website_path, base_path,
-                    node['inlineStyles']
-                )
-            )
-            html.find('head').append(new_stylesheet_node)
-        html = html.encode(encoding='utf8', formatter='html5')
-        with open(os.path.join(node_output_path, f'{html_file_name}.html'), 'wb') as f:
-            f.write(html)
-        copy_resources(node, base_path, node_output_path)
-        return f'{base_url}/{relative_url}'
-
-    def build_contents(node: dict, base_path: str, relative_url: str) -> None:
-        built_urls = []
+    site = {
+        'website_path': website_path,
+        'output_path': output_path,
+        'base_url': base_url,
+        'website_specs': website_specs,
+        'theme_specs': theme_specs,
+        'items': items,
+        'items_key': hash_json(items),
+        'previous_entries': previous_entries,
+        'html_processor': html_processor,
+        'resource_mode': resource_mode,
+        'resource_compare': resource_compare,
+        'template_engine': template_engine,
+        'inline_asset_threshold': inline_asset_threshold,
+        'search_index': search_index,
+        'image_widths': image_widths if image_widths and is_image_processing_available() else None,
+        'image_quality': image_quality,
+        'profile': PROFILER.enabled
+    }
+    site['shared_key'] = hash_json([manifest['site'], site['items_key']])
+    def collect_contents(node: dict, base_path: str, relative_url: str) -> list:
+        tasks = []
         relative_url = clean_posix_path(relative_url)
         node_output_path = os.path.join(output_path, relative_url)
         os.makedirs(node_output_path, exist_ok=True)
         if 'specs' in node:
-            built_urls.append(
-                build_node_contents(
-                    node['specs'],
-                    base_path,
-                    node_output_path,
-                    relative_url
-                )
-            )
+            tasks.append((node['specs'], base_path, node_output_path, relative_url))
         if 'children' in node:
             for child in node['children']:
-                child_built_urls = build_contents(
-                    node['children'][child],
-                    os.path.join(base_path, child),
-                    os.path.join(relative_url, child)
+                tasks.extend(
+                    collect_contents(
+                        node['children'][child],
+                        os.path.join(base_path, child),
+                        os.path.join(relative_url, child)
+                    )
                 )
-                built_urls.extend(child_built_urls)
-        return built_urls
-    built_urls = build_contents(items, website_specs['contents'], '')
-    copy_resources(theme_specs, website_path, output_path)
-    copy_resources(website_specs, website_path, output_path)
+        return tasks
+    def build_site_resources(entry_id: str, node: dict) -> None:
+        entry_key = get_resources_key(node, website_path)
+        if is_entry_up_to_date(output_path, previous_entries.get(entry_id), entry_key):
+            manifest['entries'][entry_id] = previous_entries[entry_id]
+            return
+        resource_files = copy_resources(
+            node, website_path, output_path,
+            mode=resource_mode,
+            compare=resource_compare
+        )
+        resource_files += sync_image_variants(
+            site.get('images', {}), plan_images(node, website_path, output_path),
+            mode=resource_mode,
+            compare=resource_compare
+        )
+        manifest['entries'][entry_id] = {
+            'key': entry_key,
+            'outputs': relative_outputs(output_path, resource_files),
+            'digests': get_output_signatures(output_path, resource_files)
+        }
+    tasks = collect_contents(items, website_specs['contents'], '')
+    contents_count = len(tasks)
+    os.makedirs(output_path, exist_ok=True)
+    tasks.append((website_specs['mainPage'], website_specs['mainPage']['basePath'], output_path, 'index'))
+    tasks.append((website_specs['404'], website_specs['404']['basePath'], output_path, '', '404'))
+    if any('markdowns' in task[0] for task in tasks) and 'markdown' not in additional_stylesheets:
+        additional_stylesheets['markdown'] = get_markdown_stylesheet()
+    if site['image_widths']:
+        with PROFILER.phase('images'):
+            site_image_pairs = [p for node in [theme_specs, website_specs] for p in plan_images(node, website_path, output_path)]
+            site['images'] = prepare_images(
+                [src for src, _ in site_image_pairs] +
+                [src for task in tasks for src, _ in plan_images(task[0], task[1], task[2])],
+                image_widths, image_quality, jobs
+            )
+            # Templates find the variants of site images in `websiteSpecs.images`, and the ones of their node in `nodeSpecs.images`
+            site_images = describe_images(site['images'], site_image_pairs, output_path, '/')
+            site['website_specs'] = dict(website_specs, images=site_images)
+            site['site_images_key'] = hash_json(site_images)
+            site['shared_key'] = hash_json([manifest['site'], site['items_key'], site['site_images_key']])
+    built_urls = []
+    with PROFILER.phase('render pages'):
+        for i, (url, entry_id, entry) in enumerate(build_pages(site, tasks, jobs)):
+            if i < contents_count:
+                built_urls.append(url)
+            manifest['entries'][entry_id] = entry
+        if inline_asset_threshold is not None:
+            extract_shared_assets(site, tasks, manifest['entries'], jobs)
+    with PROFILER.phase('site resources'):
+        build_site_resources('resources:theme', theme_specs)
+        build_site_resources('resources:website', website_specs)
+    site_outputs = {}
+    def write_site_output(relative_path: str, contents: str) -> None:
+        site_outputs[relative_path] = write_output(os.path.join(output_path, relative_path), contents.encode('utf8'))
     if additional_stylesheets:
         os.makedirs(os.path.join(output_path, 'css'), exist_ok=True)
         for name, value in additional_stylesheets.items():
-            with open(os.path.join(output_path, 'css', f'{name}.css'), 'w') as f:
-                f.write(minify_css(value)['css'])
-    with open(os.path.join(output_path, 'sitemap.txt'), 'w') as f:
-        f.writelines(e + '\n' for e in built_urls)
+            with PROFILER.phase('site stylesheets', name):
+                write_site_output(os.path.join('css', f'{name}.css'), minify_css(value)['css'])
+    write_site_output('sitemap.txt', ''.join(e + '\n' for e in built_urls))
     if 'googleVerification' in website_specs:
-        with open(os.path.join(output_path, f'google{website_specs["googleVerification"]}.html'), 'w') as f:
-            f.write(f'google-site-verification: google{website_specs["googleVerification"]}.html')
+        write_site_output(
+            f'google{website_specs["googleVerification"]}.html',
+            f'google-site-verification: google{website_specs["googleVerification"]}.html'
+        )
     if 'aliases' in website_specs:
         for a, target_url in website_specs['aliases'].items():
             if target_url not in built_urls:
                 # TODO: Warn the inconsistency
                 continue
-            os.makedirs(os.path.join(output_path, a))
-            with open(os.path.join(output_path, a, 'index.html'), 'w') as f:
-                f.write(
-                    f'<html><head>' +
-                    '<meta http-equiv="refresh" content="0; url={target_url}" />' +
-                    '</head><body><p>' + 
-                    f'This page has been moved to <a href="{target_url}">here</a>.' +
-                    '</p></html>'
-                )
-        build_node_contents(website_specs['mainPage'], website_specs['mainPage']['basePath'], output_path, 'index')
-        build_node_contents(website_specs['404'], website_specs['404']['basePath'], output_path, '', '404')
-        if 'robots' in website_specs:
-            with open(os.path.join(output_path, 'robots.txt'), 'w') as f:
-                for user_agent, rules in website_specs['robots'].items():
-                    f.write(f'User-agent: {user_agent}\n')
-                    for name, value in rules.items():
-                        f.write(f'{name}: {value}\n')
-                    f.write('\n')
-                f.write(f'Sitemap: {base_url}/sitemap.txt')
+            os.makedirs(os.path.join(output_path, a), exist_ok=True)
+            write_site_output(
+                os.path.join(a, 'index.html'),
+                f'<html><head>' +
+                '<meta http-equiv="refresh" content="0; url={target_url}" />' +
+                '</head><body><p>' + 
+                f'This page has been moved to <a href="{target_url}">here</a>.' +
+                '</p></html>'
+            )
+    if 'robots' in website_specs:
+        robots = ''
+        for user_agent, rules in website_specs['robots'].items():
+            robots += f'User-agent: {user_agent}\n'
+            for name, value in rules.items():
+                robots += f'{name}: {value}\n'
+            robots += '\n'
+        robots += f'Sitemap: {base_url}/sitemap.txt'
+        write_site_output('robots.txt', robots)
+    manifest['entries']['site'] = {'outputs': sorted(site_outputs), 'digests': site_outputs}
+    if search_index:
+        with PROFILER.phase('search index'):
+            manifest['entries']['search'] = build_search_index(
+                output_path, manifest, previous_manifest.get('entries', {}).get('search')
+            )
+    if precompress:
+        with PROFILER.phase('precompress'):
+            manifest['entries']['precompressed'] = precompress_outputs(
+                output_path, manifest, previous_manifest.get('entries', {}).get('precompressed'),
+                precompress,
+                {'gzip': gzip_level, 'brotli': brotli_quality},
+                jobs
+            )
+    with PROFILER.phase('manifest'):
+        remove_stale_outputs(output_path, previous_manifest, manifest)
+        save_manifest(output_path, manifest)
+        delta = compute_delta(previous_manifest, manifest)
+        save_delta(output_path, delta)
+    return {
+        'site': site,
+        'tasks': tasks,
+        'manifest': manifest,
+        'delta': delta
+    }
+
+def add_build_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Number of worker processes rendering pages, 0 means one per CPU core'
+    )
+    parser.add_argument(
+        '--html-processor', choices=['stream', 'bs4'], default='stream',
+        help='Post-process rendered pages in a single streaming pass or through a BeautifulSoup tree'
+    )
+    parser.add_argument(
+        '--resource-mode', choices=SYNC_MODES, default='copy',
+        help='Copy resources, or hard link or reflink them when the output is on the same filesystem'
+    )
+    parser.add_argument(
+        '--resource-compare', choices=COMPARE_MODES, default='stat',
+        help='Consider a synced resource unchanged by its size and mtime, or by its contents'
+    )
+    parser.add_argument(
+        '--template-engine', choices=['v8', 'python', 'auto', 'check'],
+        help='Render templates with V8, natively in Python, natively when possible, or with both checking they agree '
+             '(default: `templateEngine` of the theme or V8)'
+    )
+    parser.add_argument(
+        '--extract-inline-assets', type=int, metavar='BYTES',
+        help='Move minified inline scripts and styles of at least this many bytes into shared files named after their contents'
+    )
+    parser.add_argument(
+        '--search-index', action='store_true',
+        help='Write a prefix-sharded search index of the pages and its loader, `/search/search.js`, for client-side search'
+    )
+    parser.add_argument(
+        '--image-widths', type=int, nargs='+', metavar='WIDTH',
+        help='Write WebP variants of `img` resources at these widths, without metadata, and describe them to templates '
+             '(needs the `Pillow` package, e.g. 480 960 1920)'
+    )
+    parser.add_argument('--image-quality', type=int, default=80, choices=range(1, 101), metavar='1-100', help='Quality of WebP image variants')
+    parser.add_argument(
+        '--precompress', choices=['gzip', 'brotli'], action='append',
+        help='Write compressed copies next to text outputs, may be repeated (brotli needs the `brotli` package)'
+    )
+    parser.add_argument('--gzip-level', type=int, default=9, choices=range(1, 10), metavar='1-9', help='Compression level of gzip files')
+    parser.add_argument('--brotli-quality', type=int, default=11, choices=range(0, 12), metavar='0-11', help='Compression quality of brotli files')
+    parser.add_argument('--interval', type=float, default=0.1, help='Seconds between checks for changed files when watching')
+    parser.add_argument('--profile', action='store_true', help='Print per-phase timings, counters and the slowest pages')
+    parser.add_argument('--profile-trace', metavar='TRACE_JSON', help='Write the measurements as a Chrome trace file')
+
+def get_build_options(args: argparse.Namespace) -> dict:
+    return {
+        'jobs': args.jobs or os.cpu_count(),
+        'html_processor': args.html_processor,
+        'resource_mode': args.resource_mode,
+        'resource_compare': args.resource_compare,
+        'template_engine': args.template_engine,
+        'inline_asset_threshold': args.extract_inline_assets,
+        'search_index': args.search_index,
+        'image_widths': args.image_widths,
+        'image_quality': args.image_quality,
+        'precompress': args.precompress,
+        'gzip_level': args.gzip_level,
+        'brotli_quality': args.brotli_quality
+    }
+
+def main() -> None:
+    if sys.argv[1:2] == ['serve']:
+        parser = argparse.ArgumentParser(prog='rasana serve', description='Build, watch and preview a website locally')
+        parser.add_argument('website_path', help='Path of the website sources containing `website.json`')
+        parser.add_argument('output_path', help='Path to write the generated website into')
+        parser.add_argument('--host', default='127.0.0.1', help='Address the preview server listens on')
+        parser.add_argument('--port', type=int, default=8000, help='Port the preview server listens on')
+        add_build_arguments(parser)
+        args = parser.parse_args(sys.argv[2:])
+        serve(
+            build, args.website_path, args.output_path,
+            host=args.host,
+            port=args.port,
+            interval=args.interval,
+            **get_build_options(args)
+        )
+        return
+    parser = argparse.ArgumentParser(prog='rasana', description='Static site generator')
+    parser.add_argument('website_path', help='Path of the website sources containing `website.json`')
+    parser.add_argument('output_path', help='Path to write the generated website into')
+    parser.add_argument('base_url', help='Base URL the website is served from')
+    parser.add_argument('--incremental', action='store_true', help='Only rebuild the pages whose inputs have changed')
+    parser.add_argument('--watch', action='store_true', help='Keep running and rebuild the pages affected by every change')
+    add_build_arguments(parser)
+    args = parser.parse_args()
+    PROFILER.enabled = args.profile or bool(args.profile_trace)
+    if args.image_widths and not is_image_processing_available():
+        print('The `Pillow` package is not installed, images will be copied as they are')
+    if args.precompress and 'brotli' in args.precompress and 'brotli' not in get_available_compressions(args.precompress):
+        print('The `brotli` package is not installed, only gzip files will be written')
+    if args.watch:
+        watch(
+            build, args.website_path, args.output_path, args.base_url,
+            interval=args.interval,
+            **get_build_options(args)
+        )
+        return
+    with PROFILER.phase('build'):
+        build(
+            args.website_path, args.output_path, args.base_url,
+            incremental=args.incremental,
+            **get_build_options(args)
+        )
+    if args.profile:
+        print(PROFILER.format_summary())
+        print()
+        print(JS_RUNTIME.format_stats())
+    if args.profile_trace:
+        PROFILER.write_trace(args.profile_trace)
 
-build("/home/behrooz/Temp/Raw", "/home/behrooz/Temp/Blog", "https://vedadian.com")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Optional
+
+THEME_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_theme')
+PRESETS = {
+    'small': {'pages': 50, 'depth': 2, 'fanout': 8},
+    'medium': {'pages': 2000, 'depth': 3, 'fanout': 16},
+    'large': {'pages': 20000, 'depth': 4, 'fanout': 16}
+}
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore '
+    'magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo '
+    'سلام دنیا این یک متن آزمایشی برای سنجش سرعت ساخت وب‌سایت است'
+).split()
+CODE_SNIPPETS = [
+    ('python', 'def fibonacci(n):\n    a, b = 0, 1\n    for _ in range(n):\n        a, b = b, a + b\n    return a\n'),
+    ('javascript', 'function debounce(f, ms) {\n  let t;\n  return (...a) => { clearTimeout(t); t = setTimeout(() => f(...a), ms); };\n}\n'),
+    ('c', '#include <stdio.h>\nint main(void) {\n    for (int i = 0; i < 10; ++i)\n        printf("%d\\n", i);\n    return 0;\n}\n')
+]
+
+def generate_markdown(rng: random.Random, paragraphs: int, code_blocks: int) -> str:
+    blocks = []
+    for i in range(paragraphs):
+        blocks.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))) + '.')
+        if i < code_blocks:
+            language, code = rng.choice(CODE_SNIPPETS)
+            blocks.append(f'```{language}\n{code}```')
+    for i in range(paragraphs, code_blocks):
+        language, code = rng.choice(CODE_SNIPPETS)
+        blocks.append(f'```{language}\n{code}```')
+    return '\n\n'.join(blocks) + '\n'
+
+def generate_theme(theme_path: str, inline_blocks: int) -> None:
+    shutil.copytree(THEME_PATH, theme_path)
+    with open(os.path.join(theme_path, 'default.ejs')) as f:
+        template = f.read()
+    template = template.replace(
+        '<!-- inline blocks -->',
+        '\n'.join(
+            f'<style>.block-{i} {{ padding: {i}px 0px {i}px 0px; color: #00{i % 10}{i % 10}00; }}</style>\n'
+            f'<script>var block{i} = (function () {{ var counter = {i}; return function () {{ counter += 1; return counter; }}; }})();</script>'
+            for i in range(inline_blocks)
+        )
+    )
+    with open(os.path.join(theme_path, 'default.ejs'), 'w') as f:
+        f.write(template)
+
+def generate_site(site_path: str, pages: int, depth: int, fanout: int, markdown_paragraphs: int = 8, code_blocks: int = 2, inline_blocks: int = 2, resource_files: int = 0, resource_kb: int = 16, seed: int = 0) -> int:
+    capacity = sum(fanout ** d for d in range(1, depth + 1))
+    if pages > capacity:
+        raise Exception(f'A tree with depth {depth} and fan-out {fanout} can only hold {capacity} pages')
+    rng = random.Random(seed)
+    os.makedirs(site_path)
+    generate_theme(os.path.join(site_path, 'themes', 'bench'), inline_blocks)
+    os.makedirs(os.path.join(site_path, 'main'))
+    with open(os.path.join(site_path, 'main', 'index.md'), 'w') as f:
+        f.write(generate_markdown(rng, markdown_paragraphs, code_blocks))
+    with open(os.path.join(site_path, 'website.json'), 'w') as f:
+        json.dump({
+            'theme': 'bench',
+            'title': 'Benchmark',
+            'contents': 'contents',
+            'mainPage': {'basePath': 'main', 'title': 'Home', 'markdowns': {'body': 'index.md'}},
+            '404': {'basePath': 'main', 'template': '404', 'title': 'Not found'}
+        }, f, ensure_ascii=False)
+    # Breadth first, so that every level is filled before the tree grows deeper
+    queue = [(os.path.join(site_path, 'contents'), 0)]
+    generated = 0
+    while queue and generated < pages:
+        parent_path, parent_depth = queue.pop(0)
+        if parent_depth >= depth:
+            continue
+        for i in range(fanout):
+            if generated >= pages:
+                break
+            node_path = os.path.join(parent_path, f'node-{i}')
+            os.makedirs(node_path)
+            node_specs = {
+                'title': f'Page {generated}',
+                'date': {'year': 1390 + generated % 13, 'month': 1 + generated % 12, 'day': 1 + generated % 29},
+                'markdowns': {'body': 'index.md'}
+            }
+            with open(os.path.join(node_path, 'index.md'), 'w') as f:
+                f.write(generate_markdown(rng, markdown_paragraphs, code_blocks))
+            if resource_files:
+                node_specs['resources'] = {'img': 'img'}
+                os.makedirs(os.path.join(node_path, 'img'))
+                for j in range(resource_files):
+                    with open(os.path.join(node_path, 'img', f'image-{j}.bin'), 'wb') as f:
+                        f.write(rng.randbytes(resource_kb * 1024))
+            with open(os.path.join(node_path, 'item.json'), 'w') as f:
+                json.dump(node_specs, f, ensure_ascii=False)
+            generated += 1
+            queue.append((node_path, parent_depth + 1))
+    return generated
+
+def run_build(site_path: str, output_path: str, incremental: bool, jobs: int) -> dict:
+    # Every run happens in a fresh interpreter, so that peak memory and in-memory caches do not leak between runs
+    result = subprocess.run(
+        [
+            sys.executable, '-m', 'rasana.benchmark', '--run-build', output_path,
+            '--jobs', str(jobs)
+        ] + (['--incremental'] if incremental else []),
+        cwd=site_path,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            os.environ.get('PYTHONPATH')
+        ]))),
+        stdout=subprocess.PIPE,
+        check=True
+    )
+    return json.loads(result.stdout)
+
+def run_build_in_process(output_path: str, incremental: bool, jobs: int) -> dict:
+    from .instrumentation import PROFILER
+    from .__main__ import build
+    PROFILER.enabled = True
+    start_time = time.perf_counter()
+    with PROFILER.phase('build'):
+        build('.', output_path, 'https://bench.local', incremental=incremental, jobs=jobs)
+    wall_time = time.perf_counter() - start_time
+    summary = PROFILER.get_summary()
+    counters = summary['counters']
+    return {
+        'wallSeconds': wall_time,
+        'pagesRendered': counters.get('pages rendered', 0),
+        'pagesPerSecond': counters.get('pages rendered', 0) / wall_time,
+        'phases': summary['phases'],
+        'counters': counters,
+        'slowestPages': summary['slowestPages'],
+        'peakRSS': summary['peakRSS']
+    }
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(parameters: dict, jobs: int = 1, work_path: Optional[str] = None, keep: bool = False) -> dict:
+    work_path = tempfile.mkdtemp(prefix='rasana-benchmark-', dir=work_path)
+    site_path = os.path.join(work_path, 'site')
+    output_path = os.path.join(work_path, 'output')
+    cache_path = os.path.join(work_path, 'cache')
+    previous_cache_path = os.environ.get('RASANA_CACHE_PATH')
+    os.environ['RASANA_CACHE_PATH'] = cache_path
+    try:
+        start_time = time.perf_counter()
+        pages = generate_site(site_path, **parameters)
+        generation_time = time.perf_counter() - start_time
+        runs = {}
+        runs['cold'] = run_build(site_path, output_path, False, jobs)
+        runs['warmCache'] = run_build(site_path, output_path, False, jobs)
+        runs['incrementalUnchanged'] = run_build(site_path, output_path, True, jobs)
+        with open(os.path.join(site_path, 'contents', 'node-0', 'index.md'), 'a') as f:
+            f.write('\nOne more line.\n')
+        runs['incrementalOneEdit'] = run_build(site_path, output_path, True, jobs)
+    finally:
+        if previous_cache_path is None:
+            del os.environ['RASANA_CACHE_PATH']
+        else:
+            os.environ['RASANA_CACHE_PATH'] = previous_cache_path
+        if not keep:
+            shutil.rmtree(work_path, ignore_errors=True)
+    return {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpuCount': os.cpu_count(),
+        'jobs': jobs,
+        'parameters': parameters,
+        'pages': pages,
+        'generationSeconds': generation_time,
+        'runs': runs
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='rasana.benchmark', description='Benchmark the build pipeline on synthetic websites')
+    parser.add_argument('--preset', choices=sorted(PRESETS), action='append', help='Site size preset, may be repeated (default: small)')
+    parser.add_argument('--pages', type=int, help='Number of content pages')
+    parser.add_argument('--depth', type=int, help='Maximum depth of the content tree')
+    parser.add_argument('--fanout', type=int, help='Maximum number of children per node')
+    parser.add_argument('--markdown-paragraphs', type=int, default=8, help='Paragraphs of markdown per page')
+    parser.add_argument('--code-blocks', type=int, default=2, help='Fenced code blocks per page')
+    parser.add_argument('--inline-blocks', type=int, default=2, help='Extra inline script/style pairs in the default template')
+    parser.add_argument('--resource-files', type=int, default=0, help='Resource files per page')
+    parser.add_argument('--resource-kb', type=int, default=16, help='Size of every resource file in kilobytes')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated contents')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes rendering pages')
+    parser.add_argument('--work-path', help='Directory to generate the websites in (default: system temp)')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated websites and outputs')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    parser.add_argument('--run-build', metavar='OUTPUT_PATH', help=argparse.SUPPRESS)
+    parser.add_argument('--incremental', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_build:
+        json.dump(run_build_in_process(args.run_build, args.incremental, args.jobs), sys.stdout)
+        return
+    results = []
+    for preset in (args.preset or ['small']):
+        parameters = dict(PRESETS[preset])
+        for name in ['pages', 'depth', 'fanout']:
+            if getattr(args, name) is not None:
+                parameters[name] = getattr(args, name)
+        parameters.update(
+            markdown_paragraphs=args.markdown_paragraphs,
+            code_blocks=args.code_blocks,
+            inline_blocks=args.inline_blocks,
+            resource_files=args.resource_files,
+            resource_kb=args.resource_kb,
+            seed=args.seed
+        )
+        result = benchmark(parameters, jobs=args.jobs, work_path=args.work_path, keep=args.keep)
+        result['preset'] = preset
+        results.append(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, ensure_ascii=False)
+    else:
+        json.dump(results, sys.stdout, indent=1, ensure_ascii=False)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
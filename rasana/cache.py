@@ -0,0 +1,196 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import json
+import shutil
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from .instrumentation import PROFILER
+
+HOME_DIRECTORY = os.path.expanduser("~")
+# An empty `RASANA_CACHE_PATH` disables the on-disk tier
+DEFAULT_CACHE_PATH = os.environ.get('RASANA_CACHE_PATH', os.path.join(HOME_DIRECTORY, '.rasana/cache'))
+# A single budget for everything under a cache root, whichever namespace wrote it
+MAX_CACHE_BYTES = 1024 * 1024 * 1024
+WRITTEN_BYTES_FILE = '.written-bytes'
+
+def get_cache_units(cache_path: str) -> list:
+    # Units are the files of the result caches and the directories holding an `info.json`, like image derivatives
+    units = []
+    for namespace in os.scandir(cache_path):
+        if not namespace.is_dir():
+            continue
+        for shard in os.scandir(namespace.path):
+            if not shard.is_dir():
+                continue
+            for e in os.scandir(shard.path):
+                try:
+                    if not e.is_dir():
+                        s = e.stat()
+                        units.append((s.st_mtime, s.st_size, e.path))
+                        continue
+                    size = sum(f.stat().st_size for f in os.scandir(e.path) if f.is_file())
+                    # Directories without an `info.json` yet are aged by their own modification time
+                    info_path = os.path.join(e.path, 'info.json')
+                    units.append((os.stat(info_path if os.path.exists(info_path) else e.path).st_mtime, size, e.path))
+                except OSError:
+                    continue
+    return units
+
+def trim_cache(cache_path: str, max_bytes: int = MAX_CACHE_BYTES) -> None:
+    if not os.path.isdir(cache_path):
+        return
+    units = get_cache_units(cache_path)
+    total_size = sum(size for _, size, _ in units)
+    if total_size <= max_bytes:
+        return
+    units.sort()
+    # Leave some headroom so that the next few writes do not trigger another scan
+    target_size = max_bytes * 9 // 10
+    for _, size, unit_path in units:
+        if total_size <= target_size:
+            break
+        try:
+            if os.path.isdir(unit_path):
+                shutil.rmtree(unit_path)
+            else:
+                os.remove(unit_path)
+        except OSError:
+            continue
+        total_size -= size
+        PROFILER.count('cache entries evicted')
+
+def record_cache_write(cache_path: str, size: int, max_bytes: int = MAX_CACHE_BYTES) -> None:
+    # The bytes written since the last scan are kept on disk, so that builds writing little still add up to a trim
+    counter_path = os.path.join(cache_path, WRITTEN_BYTES_FILE)
+    try:
+        with open(counter_path) as f:
+            written_bytes = int(f.read() or 0)
+    except FileNotFoundError:
+        # Caches left by versions without the counter may already be over the budget
+        written_bytes = max_bytes
+    except (OSError, ValueError):
+        written_bytes = 0
+    written_bytes += size
+    if written_bytes > max_bytes // 16:
+        trim_cache(cache_path, max_bytes)
+        written_bytes = 0
+    try:
+        temp_path = f'{counter_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(str(written_bytes))
+        os.replace(temp_path, counter_path)
+    except OSError:
+        pass
+
+class ResultCache:
+    def __init__(self, name: str, max_memory_entries: int = 4096, cache_path: Optional[str] = None) -> None:
+        cache_path = DEFAULT_CACHE_PATH if cache_path is None else cache_path
+        self.name = name
+        self.cache_path = cache_path or None
+        self.path = os.path.join(cache_path, name) if cache_path else None
+        self.max_memory_entries = max_memory_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode('utf8')).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f'{key}.json')
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            PROFILER.count(f'{self.name} cache hits')
+            return self.memory[key]
+        if self.path is not None:
+            entry_path = self.entry_path(key)
+            try:
+                with open(entry_path) as f:
+                    value = json.load(f)
+                # The modification time doubles as the last use time for eviction
+                os.utime(entry_path)
+            except (OSError, ValueError):
+                pass
+            else:
+                self.disk_hits += 1
+                PROFILER.count(f'{self.name} cache hits')
+                self.remember(key, value)
+                return value
+        self.misses += 1
+        PROFILER.count(f'{self.name} cache misses')
+        return default
+
+    def remember(self, key: str, value: Any) -> None:
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def put(self, key: str, value: Any) -> None:
+        self.remember(key, value)
+        if self.path is None:
+            return
+        entry_path = self.entry_path(key)
+        data = json.dumps(value, ensure_ascii=False).encode('utf8')
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            # Several build processes may share the cache, so entries are replaced atomically
+            temp_path = f'{entry_path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, entry_path)
+        except OSError:
+            return
+        record_cache_write(self.cache_path, len(data))
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        value = self.get(key, ResultCache)
+        if value is ResultCache:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear_memory(self) -> None:
+        self.memory.clear()
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'diskHits': self.disk_hits,
+            'misses': self.misses
+        }
+
+__all__ = [
+    'DEFAULT_CACHE_PATH',
+    'MAX_CACHE_BYTES',
+    'ResultCache',
+    'record_cache_write',
+    'trim_cache'
+]
@@ -0,0 +1,94 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import gzip
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from .incremental import hash_json
+from .instrumentation import PROFILER
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.html', '.css', '.js', '.mjs', '.json', '.txt', '.xml', '.svg', '.map', '.md'}
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'brotli': '.br'}
+
+def compress_file(task: tuple) -> int:
+    source_path, target_path, compression, level = task
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    if compression == 'gzip':
+        # No timestamp in the header, so the same input always gives the same bytes
+        data = gzip.compress(data, compresslevel=level, mtime=0)
+    else:
+        data = brotli.compress(data, quality=level)
+    temp_path = f'{target_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, target_path)
+    return len(data)
+
+def get_available_compressions(compressions: list) -> list:
+    # Brotli is optional, without the library only gzip files are written
+    return [c for c in dict.fromkeys(compressions) if c != 'brotli' or brotli is not None]
+
+def precompress_outputs(output_path: str, manifest: dict, previous_entry: dict, compressions: list, levels: dict, jobs: int = 1) -> dict:
+    compressions = get_available_compressions(compressions)
+    sources = {}
+    for entry in manifest['entries'].values():
+        for o in entry.get('outputs', []):
+            if os.path.splitext(o)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                sources[o] = entry.get('digests', {}).get(o)
+    outputs = []
+    digests = {}
+    tasks = []
+    previous_digests = (previous_entry or {}).get('digests', {})
+    for o, source_digest in sorted(sources.items()):
+        for compression in compressions:
+            target = o + COMPRESSION_EXTENSIONS[compression]
+            digest = hash_json([source_digest, compression, levels[compression]])
+            outputs.append(target)
+            digests[target] = digest
+            if source_digest is not None and previous_digests.get(target) == digest and\
+               os.path.isfile(os.path.join(output_path, target)):
+                PROFILER.count('compressed files skipped')
+                continue
+            tasks.append((os.path.join(output_path, o), os.path.join(output_path, target), compression, levels[compression]))
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks)), mp_context=get_context('spawn')) as executor:
+            sizes = list(executor.map(compress_file, tasks, chunksize=max(1, len(tasks) // (jobs * 8))))
+    else:
+        sizes = [compress_file(task) for task in tasks]
+    PROFILER.count('compressed files written', len(sizes))
+    PROFILER.count('compressed bytes written', sum(sizes))
+    return {
+        'outputs': outputs,
+        'digests': digests
+    }
+
+__all__ = [
+    'COMPRESSION_EXTENSIONS',
+    'get_available_compressions',
+    'precompress_outputs'
+]
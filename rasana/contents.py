@@ -0,0 +1,95 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import json
+import stat
+from typing import Optional
+from .cache import ResultCache
+from .instrumentation import PROFILER
+
+CONTENTS_INDEX_VERSION = 1
+
+def stat_signature(path: str) -> Optional[list]:
+    try:
+        s = os.stat(path)
+    except OSError:
+        return None
+    return [s.st_mtime_ns, s.st_size] if stat.S_ISREG(s.st_mode) else None
+
+def list_child_directories(path: str) -> list:
+    # The same entries, in the same order, as `glob(f'{path}/*/')`
+    with os.scandir(path) as entries:
+        return [e.name for e in entries if not e.name.startswith('.') and e.is_dir()]
+
+def scan_contents(contents_path: str) -> Optional[dict]:
+    index_key = ResultCache.key(CONTENTS_INDEX_VERSION, os.path.abspath(contents_path))
+    previous_index = scan_contents.__cache.get(index_key) or {}
+    index = {}
+    def scan_directory(path: str, relative_path: str, mtime: int, parent_specs: dict) -> Optional[dict]:
+        # Only directories whose mtime changed are listed again, and only changed `item.json` files are parsed again
+        previous_entry = previous_index.get(relative_path)
+        if previous_entry is not None and previous_entry['mtime'] == mtime:
+            children = previous_entry['children']
+        else:
+            children = list_child_directories(path)
+            PROFILER.count('content directories listed')
+        PROFILER.count('content directories')
+        entry = index[relative_path] = {'mtime': mtime, 'children': children, 'specs': {}}
+        items = {}
+        for item in children:
+            if 'resources' in parent_specs and item in parent_specs['resources']:
+                continue
+            child_path = os.path.join(path, item)
+            child_relative_path = f'{relative_path}/{item}' if relative_path else item
+            try:
+                child_mtime = os.stat(child_path).st_mtime_ns
+            except OSError:
+                continue
+            items[item] = {}
+            item_specs = {}
+            signature = stat_signature(os.path.join(child_path, 'item.json'))
+            if signature is not None:
+                previous_specs = (previous_entry or {}).get('specs', {}).get(item)
+                if previous_specs is not None and previous_specs[0] == signature:
+                    item_specs = previous_specs[1]
+                else:
+                    with open(os.path.join(child_path, 'item.json')) as f:
+                        item_specs = json.load(f)
+                    PROFILER.count('item.json files parsed')
+                entry['specs'][item] = [signature, item_specs]
+                items[item]['specs'] = item_specs
+            grandchildren = scan_directory(child_path, child_relative_path, child_mtime, item_specs)
+            if grandchildren is not None:
+                items[item]['children'] = grandchildren
+        return items or None
+    if not os.path.isdir(contents_path):
+        return None
+    items = scan_directory(contents_path, '', os.stat(contents_path).st_mtime_ns, {})
+    if index != previous_index:
+        scan_contents.__cache.put(index_key, index)
+    return items
+scan_contents.__cache = ResultCache('contents-index', max_memory_entries=16)
+
+__all__ = [
+    'scan_contents'
+]
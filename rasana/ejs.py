@@ -0,0 +1,957 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import re
+import json
+from typing import Any, Callable, Optional
+from . import ejs_runtime
+from .ejs_runtime import GLOBALS, INFINITY, SUPPORTED_METHODS, JsError, JsRegExp, convert_dates, copy_json, deep_freeze, from_code_units, normalize_number
+from .instrumentation import PROFILER
+
+EJS_TAG_RE = re.compile('<%[^%].*?%>')
+TEMPLATE_PARAMETERS = ['websiteSpecs', 'themeSpecs', 'items', 'nodeSpecs', 'baseURL', 'breadCrumb']
+
+class UnsupportedTemplate(Exception):
+    pass
+
+def parse_ejs_template(template: str) -> list:
+    # Splits a template into `('text', text)`, `('output', code)`, `('escaped', code)` and `('code', code)` parts
+    parts = []
+    remove_succeeding_ws = False
+    remove_succeeding_nl = False
+    i = 0
+    for m in EJS_TAG_RE.finditer(template):
+        code = m.group()
+        operation = 'code'
+        remove_preceding_ws = False
+        left_offset = 3
+        right_offset = -3
+        text = template[i:m.start()]
+        if remove_succeeding_nl:
+            text = text.lstrip('\n')
+        elif remove_succeeding_ws:
+            text = text.lstrip()
+        remove_succeeding_ws = False
+        remove_succeeding_nl = False
+        if code[2] == '=':
+            operation = 'output'
+        elif code[2] == '-':
+            operation = 'escaped'
+        elif code[2] == '#':
+            operation = 'comment'
+        elif code[2] == '_':
+            remove_preceding_ws = True
+        else:
+            left_offset = 2
+        if code[-3] == '-':
+            remove_succeeding_nl = True
+        elif code[-3] == '_':
+            remove_succeeding_ws = True
+        else:
+            right_offset = -2
+        if remove_preceding_ws:
+            text = text.rstrip()
+        parts.append(('text', text))
+        if operation != 'comment':
+            parts.append((operation, code[left_offset:right_offset]))
+        i = m.end()
+    if i < len(template):
+        parts.append(('text', template[i:]))
+    return parts
+
+def compile_ejs_to_js(template: str) -> str:
+    compiled_template = ''
+    for operation, code in parse_ejs_template(template):
+        if operation == 'text':
+            compiled_template += f'result+={json.dumps(code)};'
+        elif operation == 'output':
+            compiled_template += f'result+={code};'
+        elif operation == 'escaped':
+            compiled_template += f'result+=escapeForHtml({code});'
+        else:
+            compiled_template += f'{code};'
+    return compiled_template
+
+JS_TOKEN_RE = re.compile(r'''
+    (?P<space>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<name>[A-Za-z_$\u0080-\uffff][\w$\u0080-\uffff]*)
+  | (?P<punctuator>\.\.\.|===|!==|\?\?|\?\.(?!\d)|=>|==|!=|<=|>=|&&|\|\||\+\+|--|\+=|-=|\*=|/=|%=|[{}()\[\];,.?:+\-*/%<>!=`])
+''', re.X | re.S)
+JS_REGEXP_RE = re.compile(r'/((?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+)/([a-z]*)')
+JS_STRING_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v', '0': '\0', '\n': ''}
+JS_KEYWORDS = {
+    'if', 'else', 'for', 'while', 'do', 'break', 'continue', 'return', 'const', 'let', 'var', 'of', 'in',
+    'true', 'false', 'null', 'typeof', 'new', 'function', 'this', 'switch', 'case', 'try', 'catch', 'throw',
+    'class', 'instanceof', 'delete', 'void', 'yield', 'await', 'with', 'debugger', 'default', 'finally'
+}
+BINARY_PRECEDENCE = [
+    ['??'],
+    ['||'],
+    ['&&'],
+    ['==', '!=', '===', '!=='],
+    ['<', '>', '<=', '>=', 'in'],
+    ['+', '-'],
+    ['*', '/', '%']
+]
+BINARY_OPERATORS = {
+    '==': 'loose_equal({}, {})',
+    '!=': '(not loose_equal({}, {}))',
+    '===': 'strict_equal({}, {})',
+    '!==': '(not strict_equal({}, {}))',
+    '<': 'js_lt({}, {})',
+    '>': 'js_gt({}, {})',
+    '<=': 'js_le({}, {})',
+    '>=': 'js_ge({}, {})',
+    'in': 'js_in({}, {})',
+    '+': 'js_add({}, {})',
+    '-': 'js_sub({}, {})',
+    '*': 'js_mul({}, {})',
+    '/': 'js_div({}, {})',
+    '%': 'js_mod({}, {})'
+}
+ASSIGNMENT_OPERATORS = {'=': None, '+=': '+', '-=': '-', '*=': '*', '/=': '/', '%=': '%'}
+
+def unescape_js_string(literal: str) -> str:
+    def substitute(m: re.Match) -> str:
+        e = m.group(1)
+        if e[0] == 'u':
+            return chr(int(e[2:-1] if e[1] == '{' else e[1:], 16))
+        if e[0] == 'x':
+            return chr(int(e[1:], 16))
+        return JS_STRING_ESCAPES.get(e, e)
+    return re.sub(r'\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|.)', substitute, literal[1:-1], flags=re.S)
+
+def tokenize_js(code: str) -> list:
+    tokens = []
+    i = 0
+    while i < len(code):
+        if code[i] == '/' and not (tokens and (tokens[-1][0] in ('number', 'string', 'template') or\
+           (tokens[-1][0] == 'name' and tokens[-1][1] not in JS_KEYWORDS - {'this', 'true', 'false', 'null'}) or\
+           tokens[-1][1] in (')', ']', '}'))):
+            m = JS_REGEXP_RE.match(code, i)
+            if m is not None and not code.startswith(('//', '/*'), i):
+                tokens.append(('regexp', (m.group(1), m.group(2))))
+                i = m.end()
+                continue
+        if code[i] == '`':
+            parts, i = tokenize_template_literal(code, i + 1)
+            tokens.append(('template', parts))
+            continue
+        m = JS_TOKEN_RE.match(code, i)
+        if m is None:
+            raise UnsupportedTemplate(f'Unexpected character `{code[i]}`')
+        if m.lastgroup != 'space':
+            tokens.append((m.lastgroup, m.group()))
+        i = m.end()
+    return tokens
+
+def tokenize_template_literal(code: str, i: int) -> tuple:
+    parts = []
+    text = ''
+    while i < len(code):
+        c = code[i]
+        if c == '`':
+            parts.append(text)
+            return parts, i + 1
+        if c == '\\':
+            text += unescape_js_string('"' + code[i:i + 2] + '"')
+            i += 2
+        elif code.startswith('${', i):
+            parts.append(text)
+            text = ''
+            depth = 0
+            j = i + 2
+            while j < len(code):
+                if code[j] == '{':
+                    depth += 1
+                elif code[j] == '}':
+                    if depth == 0:
+                        break
+                    depth -= 1
+                elif code[j] in '\'"':
+                    m = JS_TOKEN_RE.match(code, j)
+                    if m is None or m.lastgroup != 'string':
+                        raise UnsupportedTemplate('Unterminated string literal')
+                    j = m.end()
+                    continue
+                elif code[j] == '`':
+                    raise UnsupportedTemplate('Nested template literals are not supported')
+                j += 1
+            parts.append(tokenize_js(code[i + 2:j]))
+            i = j + 1
+        else:
+            text += c
+            i += 1
+    raise UnsupportedTemplate('Unterminated template literal')
+
+class PythonTemplateCompiler:
+    # Translates the subset of JavaScript used by templates into a Python function,
+    # anything outside it raises `UnsupportedTemplate` so the template can stay on V8
+    def __init__(self) -> None:
+        self.tokens = []
+        self.position = 0
+        self.lines = []
+        self.indent = 1
+        self.scopes = [{name: f'p_{name}' for name in TEMPLATE_PARAMETERS}]
+        self.loops = []
+        self.loop_depth = 0
+        # `let` and `const` bindings made inside loops, which JavaScript creates anew for every iteration
+        self.per_iteration = set()
+        self.closures = []
+        self.captured = set()
+        self.assigned = set()
+        self.update_exempt = set()
+        self.constants = {}
+        self.temporaries = 0
+        self.variables = 0
+
+    def peek(self, offset: int = 0) -> tuple:
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return ('end', None)
+
+    def at(self, *values: str) -> bool:
+        kind, value = self.peek()
+        return kind in ('punctuator', 'name') and value in values
+
+    def take(self) -> tuple:
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, value: str) -> None:
+        kind, v = self.take()
+        if v != value or kind not in ('punctuator', 'name'):
+            raise UnsupportedTemplate(f'Expected `{value}` but found `{v}`')
+
+    def emit(self, line: str) -> None:
+        self.lines.append('    ' * self.indent + line)
+
+    def temporary(self) -> str:
+        self.temporaries += 1
+        return f't_{self.temporaries}'
+
+    def constant(self, value: Any) -> str:
+        name = f'c_{len(self.constants)}'
+        self.constants[name] = value
+        return name
+
+    def lookup(self, name: str) -> str:
+        for i in range(len(self.scopes) - 1, -1, -1):
+            if name in self.scopes[i]:
+                python_name = self.scopes[i][name]
+                for closure_scope, captures in self.closures:
+                    if i < closure_scope and python_name in self.per_iteration:
+                        captures.append(python_name)
+                return python_name
+        if name in GLOBALS:
+            return f'g_{name}'
+        if name == 'sharedContext':
+            return 'shared_context'
+        raise UnsupportedTemplate(f'Unknown identifier `{name}`')
+
+    def declare(self, name: str, kind: Optional[str] = None) -> str:
+        if name in JS_KEYWORDS:
+            raise UnsupportedTemplate(f'`{name}` cannot be declared')
+        self.variables += 1
+        # Every declaration gets its own name, so inner blocks never clobber outer variables
+        self.scopes[-1][name] = f'v_{self.variables}'
+        if kind in ('let', 'const') and self.loop_depth:
+            self.per_iteration.add(self.scopes[-1][name])
+        return self.scopes[-1][name]
+
+    def assign(self, python_name: str) -> None:
+        if python_name not in self.update_exempt:
+            self.assigned.add(python_name)
+
+    def compile(self, parts: list) -> str:
+        for operation, code in parts:
+            if operation == 'text':
+                if code:
+                    self.tokens.append(('emit', f'append({self.constant(code)})'))
+            elif operation in ('output', 'escaped'):
+                self.tokens.append((operation, tokenize_js(code)))
+            else:
+                self.tokens.extend(tokenize_js(code))
+                # Just like the V8 engine, every scriptlet is terminated
+                self.tokens.append(('punctuator', ';'))
+        while self.peek()[0] != 'end':
+            self.statement()
+        if self.captured & self.assigned:
+            # Closures hold the value their loop variables had when they were made, which is only right if it never changes
+            raise UnsupportedTemplate('Arrow functions cannot use loop variables that are assigned in the loop')
+        return '\n'.join(
+            ['def render_template(' + ', '.join(f'p_{name}' for name in TEMPLATE_PARAMETERS) + ', shared_context):'] +
+            ['    result = []', '    append = result.append'] +
+            self.lines +
+            ['    return "".join(result)']
+        )
+
+    def compile_output(self, tokens: list, escape: bool) -> str:
+        outer_tokens, outer_position = self.tokens, self.position
+        self.tokens = tokens
+        self.position = 0
+        expression = self.expression()
+        if self.peek()[0] != 'end':
+            raise UnsupportedTemplate(f'Unexpected `{self.peek()[1]}` in an output tag')
+        self.tokens, self.position = outer_tokens, outer_position
+        if escape:
+            return f'append(g_escapeForHtml({expression}))'
+        return f'append(js_str({expression}))'
+
+    def block(self) -> None:
+        self.expect('{')
+        self.scopes.append({})
+        start = len(self.lines)
+        while not self.at('}'):
+            if self.peek()[0] == 'end':
+                raise UnsupportedTemplate('Unterminated block')
+            self.statement()
+        self.take()
+        self.scopes.pop()
+        if len(self.lines) == start:
+            self.emit('pass')
+
+    def body(self) -> None:
+        self.indent += 1
+        start = len(self.lines)
+        if self.at('{'):
+            self.block()
+        else:
+            self.scopes.append({})
+            self.statement()
+            self.scopes.pop()
+        if len(self.lines) == start:
+            self.emit('pass')
+        self.indent -= 1
+
+    def statement(self) -> None:
+        kind, value = self.peek()
+        if kind == 'emit':
+            self.take()
+            self.emit(value)
+        elif kind in ('output', 'escaped'):
+            self.take()
+            self.emit(self.compile_output(value, kind == 'escaped'))
+        elif self.at(';'):
+            self.take()
+        elif self.at('{'):
+            self.emit('if True:')
+            self.indent += 1
+            self.block()
+            self.indent -= 1
+        elif self.at('if'):
+            self.if_statement()
+        elif self.at('for'):
+            self.for_statement()
+        elif self.at('while'):
+            self.take()
+            self.expect('(')
+            condition = self.expression()
+            self.expect(')')
+            self.emit(f'while truthy({condition}):')
+            self.loops.append(None)
+            self.loop_depth += 1
+            self.body()
+            self.loop_depth -= 1
+            self.loops.pop()
+        elif self.at('break', 'continue'):
+            _, keyword = self.take()
+            if not self.loops:
+                raise UnsupportedTemplate(f'`{keyword}` outside of a loop')
+            if keyword == 'continue' and self.loops[-1] is not None:
+                self.loops[-1]()
+            self.emit(keyword)
+            self.end_of_statement()
+        elif self.at('const', 'let', 'var'):
+            self.declaration()
+            self.end_of_statement()
+        else:
+            self.expression_statement()
+            self.end_of_statement()
+
+    def end_of_statement(self) -> None:
+        if self.at(';'):
+            self.take()
+        elif not (self.at('}') or self.peek()[0] in ('emit', 'output', 'escaped', 'end')):
+            raise UnsupportedTemplate(f'Unexpected `{self.peek()[1]}`')
+
+    def if_statement(self) -> None:
+        keyword = 'if'
+        while True:
+            self.expect('if')
+            self.expect('(')
+            condition = self.expression()
+            self.expect(')')
+            self.emit(f'{keyword} truthy({condition}):')
+            self.body()
+            if not self.at('else'):
+                return
+            self.take()
+            if not self.at('if'):
+                break
+            keyword = 'elif'
+        self.emit('else:')
+        self.body()
+
+    def for_statement(self) -> None:
+        self.expect('for')
+        self.expect('(')
+        self.scopes.append({})
+        self.loop_depth += 1
+        declared = self.at('const', 'let', 'var')
+        if declared and (self.peek(1)[0] == 'name' or self.peek(1)[1] in ('[', '{')) and\
+           (self.peek(2)[1] in ('of', 'in') or self.peek(1)[1] in ('[', '{')):
+            _, kind = self.take()
+            if self.peek()[1] in ('[', '{'):
+                pattern = self.binding_pattern()
+            else:
+                pattern = self.take()[1]
+            if not self.at('of', 'in'):
+                raise UnsupportedTemplate('Only `for...of` and `for...in` loops can destructure')
+            _, loop_kind = self.take()
+            iterable = self.expression()
+            self.expect(')')
+            iterator = 'iterate_of' if loop_kind == 'of' else 'iterate_in'
+            if isinstance(pattern, str):
+                self.emit(f'for {self.declare(pattern, kind)} in {iterator}({iterable}):')
+                self.loops.append(None)
+                self.body()
+            else:
+                item = self.temporary()
+                self.emit(f'for {item} in {iterator}({iterable}):')
+                self.indent += 1
+                self.destructure(pattern, item, kind)
+                self.indent -= 1
+                self.loops.append(None)
+                self.body()
+            self.loops.pop()
+        elif not declared and self.peek()[0] == 'name' and self.peek(1)[1] in ('of', 'in'):
+            raise UnsupportedTemplate('Loops must declare their variable')
+        else:
+            if self.at('const', 'let', 'var'):
+                self.declaration()
+            elif not self.at(';'):
+                self.expression_statement()
+            self.expect(';')
+            condition = 'True' if self.at(';') else f'truthy({self.expression()})'
+            self.expect(';')
+            update_start = self.position
+            depth = 0
+            while not (depth == 0 and self.at(')')):
+                if self.peek()[0] == 'end':
+                    raise UnsupportedTemplate('Unterminated `for` loop')
+                if self.at('(', '[', '{'):
+                    depth += 1
+                elif self.at(')', ']', '}'):
+                    depth -= 1
+                self.take()
+            update_tokens = self.tokens[update_start:self.position]
+            self.take()
+            header_names = set(self.scopes[-1].values())
+            def update() -> None:
+                outer_tokens, outer_position = self.tokens, self.position
+                self.tokens, self.position = update_tokens, 0
+                # The update runs on the copy of the variables made for the next iteration
+                outer_exempt, self.update_exempt = self.update_exempt, header_names
+                while self.peek()[0] != 'end':
+                    self.expression_statement()
+                    if self.at(','):
+                        self.take()
+                self.update_exempt = outer_exempt
+                self.tokens, self.position = outer_tokens, outer_position
+            self.emit(f'while {condition}:')
+            self.loops.append(update)
+            self.indent += 1
+            self.body_without_indent()
+            update()
+            self.indent -= 1
+            self.loops.pop()
+        self.loop_depth -= 1
+        self.scopes.pop()
+
+    def body_without_indent(self) -> None:
+        if self.at('{'):
+            self.block()
+        else:
+            self.scopes.append({})
+            self.statement()
+            self.scopes.pop()
+
+    def binding_pattern(self) -> tuple:
+        if self.at('['):
+            self.take()
+            names = []
+            while not self.at(']'):
+                if self.at(','):
+                    self.take()
+                    names.append(None)
+                    continue
+                kind, name = self.take()
+                if kind != 'name':
+                    raise UnsupportedTemplate('Only simple array patterns are supported')
+                names.append(name)
+                if self.at(','):
+                    self.take()
+            self.take()
+            return ('array', names)
+        self.expect('{')
+        names = []
+        while not self.at('}'):
+            kind, key = self.take()
+            if kind != 'name':
+                raise UnsupportedTemplate('Only simple object patterns are supported')
+            name = key
+            if self.at(':'):
+                self.take()
+                kind, name = self.take()
+                if kind != 'name':
+                    raise UnsupportedTemplate('Only simple object patterns are supported')
+            names.append((key, name))
+            if self.at(','):
+                self.take()
+        self.take()
+        return ('object', names)
+
+    def destructure(self, pattern: tuple, value: str, declaration_kind: Optional[str] = None) -> None:
+        kind, names = pattern
+        if kind == 'array':
+            for i, name in enumerate(names):
+                if name is not None:
+                    self.emit(f'{self.declare(name, declaration_kind)} = get({value}, {i})')
+        else:
+            for key, name in names:
+                self.emit(f'{self.declare(name, declaration_kind)} = get({value}, {key!r})')
+
+    def declaration(self) -> None:
+        _, declaration_kind = self.take()
+        while True:
+            if self.at('[', '{'):
+                pattern = self.binding_pattern()
+                self.expect('=')
+                value = self.temporary()
+                self.emit(f'{value} = {self.assignment_expression()}')
+                self.destructure(pattern, value, declaration_kind)
+            else:
+                kind, name = self.take()
+                if kind != 'name':
+                    raise UnsupportedTemplate(f'Unexpected `{name}` in a declaration')
+                value = 'UNDEFINED'
+                if self.at('='):
+                    self.take()
+                    value = self.assignment_expression()
+                # The value is evaluated before the name is bound, like `let x = x` would not
+                self.emit(f'{self.declare(name, declaration_kind)} = {value}')
+            if not self.at(','):
+                break
+            self.take()
+
+    def expression_statement(self) -> None:
+        start = self.position
+        if self.peek()[0] == 'name' and self.peek(1)[1] in ('++', '--') or self.at('++', '--'):
+            if self.at('++', '--'):
+                _, operator = self.take()
+                kind, name = self.take()
+            else:
+                kind, name = self.take()
+                _, operator = self.take()
+            target = self.lookup(name)
+            self.assign(target)
+            self.emit(f'{target} = {"js_add" if operator == "++" else "js_sub"}(to_number({target}), 1)')
+            return
+        target = self.assignment_target()
+        if target is not None and self.at(*ASSIGNMENT_OPERATORS):
+            _, operator = self.take()
+            value = self.assignment_expression()
+            if ASSIGNMENT_OPERATORS[operator] is not None:
+                value = BINARY_OPERATORS[ASSIGNMENT_OPERATORS[operator]].format(target[2], value)
+            if target[0] == 'name':
+                self.assign(target[1])
+                self.emit(f'{target[1]} = {value}')
+            else:
+                self.emit(f'set_({target[1]}, {target[3]}, {value})')
+            return
+        self.position = start
+        self.emit(self.expression())
+
+    def assignment_target(self) -> Optional[tuple]:
+        # Returns `('name', python_name, read)` or `('member', object, read, key)` for the left side of an assignment
+        start = self.position
+        kind, name = self.peek()
+        if kind != 'name' or name in JS_KEYWORDS:
+            return None
+        try:
+            self.take()
+            current = self.lookup(name)
+            target = ('name', current, current)
+            while self.at('.', '['):
+                if self.at('.'):
+                    self.take()
+                    kind, key = self.take()
+                    if kind != 'name':
+                        raise UnsupportedTemplate(f'Unexpected `{key}`')
+                    key = repr(key)
+                else:
+                    self.take()
+                    key = self.expression()
+                    self.expect(']')
+                target = ('member', current, f'get({current}, {key})', key)
+                current = target[2]
+        except UnsupportedTemplate:
+            self.position = start
+            return None
+        if not self.at(*ASSIGNMENT_OPERATORS):
+            self.position = start
+            return None
+        if target[0] == 'name' and not target[1].startswith(('p_', 'v_')):
+            raise UnsupportedTemplate(f'Cannot assign to `{name}`')
+        return target
+
+    def expression(self) -> str:
+        expression = self.assignment_expression()
+        if self.at(','):
+            raise UnsupportedTemplate('The comma operator is not supported')
+        return expression
+
+    def assignment_expression(self) -> str:
+        if self.is_arrow_function():
+            return self.arrow_function()
+        condition = self.binary_expression(0)
+        if self.at('?'):
+            self.take()
+            consequent = self.assignment_expression()
+            self.expect(':')
+            alternate = self.assignment_expression()
+            return f'({consequent} if truthy({condition}) else {alternate})'
+        if self.at(*ASSIGNMENT_OPERATORS):
+            raise UnsupportedTemplate('Assignments are only supported as statements')
+        return condition
+
+    def is_arrow_function(self) -> bool:
+        if self.peek()[0] == 'name' and self.peek(1)[1] == '=>':
+            return True
+        if not self.at('('):
+            return False
+        depth = 0
+        i = 0
+        while True:
+            kind, value = self.peek(i)
+            if kind == 'end':
+                return False
+            if kind == 'punctuator' and value in ('(', '[', '{'):
+                depth += 1
+            elif kind == 'punctuator' and value in (')', ']', '}'):
+                depth -= 1
+                if depth == 0:
+                    return self.peek(i + 1)[1] == '=>'
+            i += 1
+
+    def arrow_function(self) -> str:
+        parameters = []
+        if self.peek()[0] == 'name':
+            parameters.append(self.take()[1])
+        else:
+            self.expect('(')
+            while not self.at(')'):
+                kind, name = self.take()
+                if kind != 'name':
+                    raise UnsupportedTemplate('Only simple arrow function parameters are supported')
+                parameters.append(name)
+                if self.at(','):
+                    self.take()
+            self.take()
+        self.expect('=>')
+        self.scopes.append({})
+        names = [self.declare(p) for p in parameters]
+        captures = []
+        self.closures.append((len(self.scopes) - 1, captures))
+        if self.at('{'):
+            self.take()
+            if not self.at('return'):
+                raise UnsupportedTemplate('Arrow functions can only have an expression or a single `return` as their body')
+            self.take()
+            body = self.expression()
+            if self.at(';'):
+                self.take()
+            self.expect('}')
+        else:
+            body = self.assignment_expression()
+        self.closures.pop()
+        self.scopes.pop()
+        # Loop variables are bound when the function is made, as every iteration of a JavaScript loop has its own
+        captures = list(dict.fromkeys(captures))
+        self.captured.update(captures)
+        return '(lambda ' + ''.join(f'{n}=UNDEFINED, ' for n in names) + '*_' + ''.join(f', {n}={n}' for n in captures) + f': {body})'
+
+    def binary_expression(self, level: int) -> str:
+        if level == len(BINARY_PRECEDENCE):
+            return self.unary_expression()
+        left = self.binary_expression(level + 1)
+        while self.at(*BINARY_PRECEDENCE[level]):
+            _, operator = self.take()
+            right = self.binary_expression(level + 1)
+            t = self.temporary()
+            if operator == '&&':
+                left = f'({right} if truthy({t} := {left}) else {t})'
+            elif operator == '||':
+                left = f'({t} if truthy({t} := {left}) else {right})'
+            elif operator == '??':
+                left = f'({right} if is_nullish({t} := {left}) else {t})'
+            else:
+                left = BINARY_OPERATORS[operator].format(left, right)
+        return left
+
+    def unary_expression(self) -> str:
+        if self.at('!'):
+            self.take()
+            return f'(not truthy({self.unary_expression()}))'
+        if self.at('-'):
+            self.take()
+            return f'js_neg({self.unary_expression()})'
+        if self.at('+'):
+            self.take()
+            return f'to_number({self.unary_expression()})'
+        if self.at('typeof'):
+            self.take()
+            kind, name = self.peek()
+            if kind == 'name' and name not in JS_KEYWORDS and self.peek(1)[1] not in ('.', '[', '(', '?.'):
+                try:
+                    self.lookup(name)
+                except UnsupportedTemplate:
+                    # `typeof` is the only way to read an undeclared name without an error
+                    self.take()
+                    return "'undefined'"
+            return f'js_typeof({self.unary_expression()})'
+        if self.at('++', '--', 'delete', 'void', 'await'):
+            raise UnsupportedTemplate(f'`{self.peek()[1]}` is not supported in expressions')
+        return self.postfix_expression()
+
+    def arguments(self) -> list:
+        self.expect('(')
+        arguments = []
+        while not self.at(')'):
+            if self.at('...'):
+                self.take()
+                arguments.append(f'*to_list({self.assignment_expression()})')
+            else:
+                arguments.append(self.assignment_expression())
+            if not self.at(')'):
+                self.expect(',')
+        self.take()
+        return arguments
+
+    def postfix_expression(self) -> str:
+        if self.at('new'):
+            self.take()
+            kind, name = self.take()
+            if name != 'JalaliDate':
+                raise UnsupportedTemplate(f'`new {name}` is not supported')
+            expression = f'g_JalaliDate({", ".join(self.arguments())})'
+        else:
+            expression = self.primary_expression()
+        optional = None
+        while True:
+            if self.at('?.'):
+                self.take()
+                if optional is None:
+                    optional = (self.temporary(), expression)
+                    expression = optional[0]
+                else:
+                    t = self.temporary()
+                    expression = f'(UNDEFINED if is_nullish({t} := {expression}) else {t})'
+                if self.peek()[0] == 'name':
+                    self.tokens.insert(self.position, ('punctuator', '.'))
+                elif not self.at('[', '('):
+                    raise UnsupportedTemplate(f'Unexpected `{self.peek()[1]}` after `?.`')
+            if self.at('.'):
+                self.take()
+                kind, name = self.take()
+                if kind != 'name':
+                    raise UnsupportedTemplate(f'Unexpected `{name}` after `.`')
+                if self.at('('):
+                    if name not in SUPPORTED_METHODS:
+                        raise UnsupportedTemplate(f'The `{name}` method is not supported')
+                    expression = f'call_method({", ".join([expression, repr(name)] + self.arguments())})'
+                else:
+                    expression = f'get({expression}, {name!r})'
+            elif self.at('['):
+                self.take()
+                key = self.expression()
+                self.expect(']')
+                expression = f'get({expression}, {key})'
+            elif self.at('('):
+                expression = f'call({", ".join([expression] + self.arguments())})'
+            elif self.peek()[0] == 'template':
+                raise UnsupportedTemplate('Tagged template literals are not supported')
+            else:
+                break
+        if optional is not None:
+            t, base = optional
+            expression = f'(UNDEFINED if is_nullish({t} := {base}) else {expression})'
+        return expression
+
+    def primary_expression(self) -> str:
+        kind, value = self.take()
+        if kind == 'number':
+            n = normalize_number(int(value, 16) if value[:2].lower() == '0x' else float(value))
+            return 'INFINITY' if n == INFINITY else repr(n)
+        if kind == 'string':
+            return self.constant(unescape_js_string(value))
+        if kind == 'regexp':
+            try:
+                return self.constant(JsRegExp(*value))
+            except (re.error, ValueError):
+                raise UnsupportedTemplate(f'The regular expression `/{value[0]}/` is not supported')
+        if kind == 'template':
+            pieces = []
+            for i, part in enumerate(value):
+                if i % 2 == 0:
+                    if part:
+                        pieces.append(self.constant(part))
+                else:
+                    outer_tokens, outer_position = self.tokens, self.position
+                    self.tokens, self.position = part, 0
+                    pieces.append(f'js_str({self.expression()})')
+                    if self.peek()[0] != 'end':
+                        raise UnsupportedTemplate('Unexpected tokens in a template literal')
+                    self.tokens, self.position = outer_tokens, outer_position
+            return '"".join([' + ', '.join(pieces) + '])'
+        if kind == 'name':
+            if value == 'true':
+                return 'True'
+            if value == 'false':
+                return 'False'
+            if value == 'null':
+                return 'None'
+            if value in JS_KEYWORDS:
+                raise UnsupportedTemplate(f'`{value}` is not supported')
+            return self.lookup(value)
+        if value == '(':
+            expression = self.expression()
+            self.expect(')')
+            return f'({expression})'
+        if value == '[':
+            elements = []
+            while not self.at(']'):
+                if self.at('...'):
+                    self.take()
+                    elements.append(f'*to_list({self.assignment_expression()})')
+                else:
+                    elements.append(self.assignment_expression())
+                if not self.at(']'):
+                    self.expect(',')
+            self.take()
+            return '[' + ', '.join(elements) + ']'
+        if value == '{':
+            entries = []
+            while not self.at('}'):
+                if self.at('...'):
+                    self.take()
+                    t = self.temporary()
+                    entries.append(f'**({{}} if not isinstance({t} := {self.assignment_expression()}, dict) else {t})')
+                else:
+                    kind, key = self.take()
+                    if kind == 'name' and (self.at(',') or self.at('}')):
+                        entries.append(f'{key!r}: {self.lookup(key)}')
+                    else:
+                        if kind == 'string':
+                            key = repr(unescape_js_string(key))
+                        elif kind == 'number':
+                            key = repr(ejs_runtime.js_str(float(key) if '.' in key or 'e' in key.lower() else int(key, 0)))
+                        elif kind == 'name':
+                            key = repr(key)
+                        elif key == '[':
+                            key = f'property_key({self.expression()})'
+                            self.expect(']')
+                        else:
+                            raise UnsupportedTemplate(f'Unexpected `{key}` in an object literal')
+                        self.expect(':')
+                        entries.append(f'{key}: {self.assignment_expression()}')
+                if not self.at('}'):
+                    self.expect(',')
+            self.take()
+            return '{' + ', '.join(entries) + '}'
+        raise UnsupportedTemplate(f'Unexpected `{value}`')
+
+def compile_python_template(template: str) -> Callable:
+    compiler = PythonTemplateCompiler()
+    source = compiler.compile(parse_ejs_template(template))
+    namespace = {name: getattr(ejs_runtime, name) for name in dir(ejs_runtime) if not name.startswith('__')}
+    namespace.update({f'g_{name}': value for name, value in GLOBALS.items()})
+    namespace.update(compiler.constants)
+    try:
+        exec(compile(source, '<ejs template>', 'exec'), namespace)
+    except SyntaxError as e:
+        raise UnsupportedTemplate(f'Could not translate the template: {e}')
+    render_template = namespace['render_template']
+    def render(context: dict) -> str:
+        set_shared_context(context)
+        return render_page(context)
+    def get_shared_context(context: dict) -> dict:
+        shared_context = {}
+        for name in ['websiteSpecs', 'themeSpecs', 'items']:
+            shared_context[name] = copy_json(context.get(name))
+            convert_dates(shared_context[name])
+        return shared_context
+    def set_shared_context(context: dict) -> None:
+        # Every page sees the same objects, so none of them may change what the next page sees
+        render.__shared_context = {name: deep_freeze(value) for name, value in get_shared_context(context).items()}
+        render.__shared_source = {name: context.get(name) for name in ['websiteSpecs', 'themeSpecs', 'items']}
+    def render_with(shared_context: dict, context: dict) -> str:
+        node_specs = copy_json(context.get('nodeSpecs'))
+        convert_dates(node_specs)
+        with PROFILER.phase('template render'):
+            return from_code_units(render_template(
+                shared_context['websiteSpecs'],
+                shared_context['themeSpecs'],
+                shared_context['items'],
+                node_specs,
+                copy_json(context.get('baseURL')),
+                copy_json(context.get('breadCrumb')),
+                shared_context
+            ))
+    def render_page(context: dict) -> str:
+        try:
+            return render_with(render.__shared_context, context)
+        except JsError:
+            # Templates changing the specs get copies of them, as they did when every page received its own
+            PROFILER.count('pages with copied specs')
+            return render_with(get_shared_context(render.__shared_source), context)
+    def unload() -> None:
+        render.__shared_context = {}
+        render.__shared_source = {}
+    render.__shared_context = {}
+    render.__shared_source = {}
+    render.set_shared_context = set_shared_context
+    render.render_page = render_page
+    render.unload = unload
+    render.source = source
+    return render
+
+__all__ = [
+    'UnsupportedTemplate',
+    'parse_ejs_template',
+    'compile_ejs_to_js',
+    'compile_python_template'
+]
@@ -0,0 +1,162 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import sys
+import argparse
+from .ejs import UnsupportedTemplate
+from .js import compile_checked_template
+
+CONTEXT = {
+    'websiteSpecs': {
+        'title': 'وب‌سایت <آزمایشی> & "نمونه"',
+        'publishDate': {'year': 1402, 'month': 5, 'day': 31},
+        'menu': [{'title': 'خانه', 'url': '/'}, {'title': 'About', 'url': '/about'}, None],
+        'numbers': [3, 1.5, -2, 10, 0, 2.25e-7, 1e21, 123456789012]
+    },
+    'themeSpecs': {'templates': {'default': 'default.ejs'}, 'colors': {'main': '#fff'}},
+    'items': {
+        'children': {
+            '1402': {'specs': {'title': 'Year', 'date': {'year': 1402, 'month': 1, 'day': 1}}},
+            'blog': {
+                'specs': {'title': 'Blog', 'tags': ['a', 'b']},
+                'children': {
+                    'post-2': {'specs': {'title': 'Second', 'date': {'year': 1401, 'month': 12, 'day': 29}}},
+                    'post-1': {'specs': {'title': 'First', 'date': {'year': 1401, 'month': 2, 'day': 3}}}
+                }
+            },
+            '7': {},
+            'about': {'specs': {'title': 'About & more'}}
+        }
+    },
+    'nodeSpecs': {
+        'title': 'Hello <world>',
+        'date': {'year': '1399', 'month': 7, 'day': 15},
+        'variables': {'body': '<p>Body</p>'},
+        'flags': {'draft': False, 'count': 0, 'empty': '', 'list': [], 'object': {}},
+        'updateDate': [1, 2],
+        'big': 12345678901234567890
+    },
+    'baseURL': 'https://example.com',
+    'breadCrumb': ['blog', 'post-1']
+}
+
+# Every snippet covers a feature the Python engine translates, and must render exactly like V8 does
+SNIPPETS = [
+    '<%- nodeSpecs.title %>|<%= nodeSpecs.title %>|<%= nodeSpecs.variables.body %>',
+    '<%= nodeSpecs.missing %>|<%= null %>|<%= true %>|<%= [1, [2, null], undefined] %>|<%= {} %>',
+    '<%= websiteSpecs.numbers.join(" ") %>|<%= 1 / 3 %>|<%= 0.1 + 0.2 %>|<%= -0 %>|<%= 10 / 0 %>|<%= 0 / 0 %>',
+    '<%= 1 + "2" %>|<%= "3" - 1 %>|<%= "3" * "4" %>|<%= 7 % 3 %>|<%= -7 % 3 %>|<%= [] + {} %>|<%= true + 1 %>',
+    '<%= 1 == "1" %>|<%= 1 === "1" %>|<%= null == undefined %>|<%= null === undefined %>|<%= "a" < "b" %>|<%= 2 < 10 %>|<%= "2" < "10" %>',
+    '<% for (const k in items.children) { -%>\n<%= k %>:<%= (items.children[k].specs || {}).title %>\n<% } -%>',
+    '<% for (const [k, v] of Object.entries(items.children.blog.children)) { %><%= k %>=<%= v.specs.date.toShortFormJalali() %>;<% } %>',
+    '<% if (nodeSpecs.flags.draft) { %>draft<% } else if (nodeSpecs.flags.count) { %>count<% } else { %>none<% } %>',
+    '<%= !!nodeSpecs.flags.list %><%= !!nodeSpecs.flags.object %><%= !!nodeSpecs.flags.empty %><%= !!NaN %>',
+    '<%= nodeSpecs.date.toLongFormJalali() %>|<%= websiteSpecs.publishDate.toShortFormJalali() %>|<%= nodeSpecs.updateDate.year %>',
+    '<%= nodeSpecs.date.compare(websiteSpecs.publishDate) %>|<%= toFarsiDigits("Page 1234") %>|<%= monthNames[11] %>',
+    '<%= breadCrumb.map(e => e.toUpperCase()).join(" / ") %>|<%= breadCrumb.filter((e, i) => i > 0).length %>',
+    '<%= Object.keys(items.children).sort().reverse().join() %>|<%= Object.values(nodeSpecs.flags).length %>',
+    '<% const posts = Object.values(items.children.blog.children).sort((a, b) => a.specs.date.compare(b.specs.date)); -%>\n<% for (const p of posts) { %><%= p.specs.title %> <% } %>',
+    '<% let total = 0; for (let i = 0; i < websiteSpecs.numbers.length; i++) { if (i == 2) continue; total += websiteSpecs.numbers[i]; } %><%= total %>',
+    '<% let n = 0; while (n < 5) { n++; if (n > 3) break; } %><%= n %>',
+    '<%= `${baseURL}/${breadCrumb.join("/")}/` %>|<%= "a-b-c".split("-").length %>|<%= "x".padStart(3, "ab") %>',
+    '<%= nodeSpecs.title.replace(/[<>]/g, "") %>|<%= "a.b.c".replace(".", "-") %>|<%= "Hello".replace(/(l+)/, "[$1]") %>',
+    '<%= "abc".slice(-2) %>|<%= "abcdef".substring(4, 1) %>|<%= "  trim  ".trim() %>|<%= "AbC".toLowerCase() %>',
+    '<%= websiteSpecs.menu.filter(m => m).map(m => `<a href="${m.url}">${m.title}</a>`).join("") %>',
+    '<%= nodeSpecs.missing?.deep.deeper %>|<%= nodeSpecs.flags?.count %>|<%= nodeSpecs.missing ?? "fallback" %>|<%= nodeSpecs.flags.count ?? 5 %>',
+    '<%= typeof nodeSpecs %>|<%= typeof nodeSpecs.title %>|<%= typeof notDeclared %>|<%= typeof breadCrumb.map %>',
+    '<%= JSON.stringify(nodeSpecs.flags) %>|<%= JSON.stringify({b: [1, "x", null], a: undefined}, null, 2) %>',
+    '<%= Math.max(...websiteSpecs.numbers) %>|<%= Math.round(2.5) %>|<%= Math.round(-2.5) %>|<%= Math.floor(-1.5) %>',
+    '<%= (1234.5678).toFixed(2) %>|<%= (0.5).toFixed(0) %>|<%= (255).toString(16) %>|<%= parseInt("42px") %>|<%= parseFloat("3.14abc") %>',
+    '<%= encodeURIComponent("سلام دنیا/?") %>|<%= [3, 20, 100].sort() %>|<%= ["b", "a"].concat(["c"], "d").indexOf("c") %>',
+    '<%_ if (true) { _%>\n   trimmed   \n<%_ } _%>\n|<%# a comment %>|',
+    '<% const {title, date} = nodeSpecs; %><%= title %> <%= date.day %>',
+    '<%= nodeSpecs.title.length > 5 ? "long" : "short" %>|<%= breadCrumb.includes("blog") && "has blog" %>|<%= breadCrumb[5] || "none" %>',
+    '<% const o = {a: 1, "b": 2, [breadCrumb[0]]: 3, ...nodeSpecs.flags}; o.c = 4; o["d"] = 5; %><%= Object.keys(o).join() %>',
+    '<% const list = []; list.push(1, 2); list.unshift(0); %><%= list %>|<%= list.reduce((a, b) => a + b, 10) %>|<%= list.some(e => e > 1) %>',
+    '<%= escapeForHtml(nodeSpecs.title) %>|<%= String(12) + Number("5") %>|<%= Array.isArray(breadCrumb) %>|<%= isNaN("x") %>',
+    '<% websiteSpecs.title = "changed"; items.children.blog.specs.tags[0] = "z"; nodeSpecs.title = "own"; %><%= websiteSpecs.title %>|<%= items.children.blog.specs.tags %>|<%= nodeSpecs.title %>',
+    '<%= websiteSpecs.menu.slice().reverse().length %>|<%= [].concat(items.children.blog.specs.tags).reverse() %>|<%= [websiteSpecs.publishDate].sort().length %>',
+    '<%= nodeSpecs.big %>|<%= nodeSpecs.big - 1 %>|<%= 9007199254740991 + 2 %>|<%= 9007199254740993 %>|<%= 0x20000000000001 %>|<%= parseInt("123456789012345678901") %>|<%= 1e400 %>',
+    '<% const fs = []; for (let i = 0; i < 3; i++) { fs.push(() => i); } %><%= fs.map(f => f()) %>',
+    '<% const gs = []; for (const t of ["a", "b"]) { gs.push(() => t); } for (const k in {a: 1, b: 2}) { gs.push(() => k); } %><%= gs.map(g => g()) %>',
+    '<% websiteSpecs.count = 1; websiteSpecs.menu.reverse(); %><%= websiteSpecs.count %>|<%= websiteSpecs.menu %>',
+    '<% for (const k in items.children) { if (items.children[k].specs) { items.children[k].specs.url = "/" + k; } } items.children.blog.specs.tags.push("c"); %><%= items.children.blog.specs.url %>|<%= items.children.blog.specs.tags %>',
+    '<% websiteSpecs.numbers.sort(); Object.assign(themeSpecs.colors, {main: "#000"}); %><%= websiteSpecs.numbers %>|<%= themeSpecs.colors.main %>',
+    '<% const s = "\U0001f600a"; %><%= s.length %>|<%= s[2] %>|<%= s.slice(1).length %>|<%= s.substring(2) %>|<%= s.indexOf("a") %>|<%= s.padStart(5, "-") %>'
+]
+UNSUPPORTED_SNIPPETS = [
+    '<% function helper() { return 1; } %><%= helper() %>',
+    '<%= new Date(0).getFullYear() %>',
+    '<%= nodeSpecs.title.codePointAt(0) %>',
+    '<% result += "x" %>'
+]
+
+def check_snippet(template: str) -> None:
+    renderer = compile_checked_template(template)
+    renderer.set_shared_context(CONTEXT)
+    first = renderer.render_page(CONTEXT)
+    if renderer.render_page(CONTEXT) != first:
+        raise Exception('The second page rendered differently from the first one')
+
+def check_conformance(verbose: bool = False) -> list:
+    failures = []
+    for template in SNIPPETS:
+        try:
+            check_snippet(template)
+        except Exception as e:
+            failures.append((template, str(e)))
+        else:
+            if verbose:
+                print(f'ok {template!r}')
+    for template in UNSUPPORTED_SNIPPETS:
+        try:
+            check_snippet(template)
+        except UnsupportedTemplate:
+            if verbose:
+                print(f'ok unsupported {template!r}')
+        except Exception as e:
+            failures.append((template, f'Expected the Python engine to reject the template: {e}'))
+        else:
+            failures.append((template, 'Expected the Python engine to reject the template'))
+    return failures
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='rasana.ejs_conformance', description='Check that the Python and V8 template engines render alike')
+    parser.add_argument('templates', nargs='*', help='Template files to check against the built-in sample context instead of the built-in snippets')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print every checked template')
+    args = parser.parse_args()
+    if args.templates:
+        failures = []
+        for template_path in args.templates:
+            with open(template_path) as f:
+                try:
+                    check_snippet(f.read())
+                except Exception as e:
+                    failures.append((template_path, str(e)))
+    else:
+        failures = check_conformance(args.verbose)
+    for template, message in failures:
+        print(f'FAILED {template!r}\n    {message}')
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1122 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import re
+import math
+import json
+import random
+import decimal
+from functools import cmp_to_key
+from urllib.parse import quote, unquote
+from typing import Any, Callable, Optional
+
+# JavaScript values are mapped onto the JSON types of Python, `None` being `null`.
+# Everything here mirrors the semantics of the helpers in `compiled_ejs_template.js` and of V8,
+# so both template engines produce the very same output.
+
+class Undefined:
+    def __repr__(self) -> str:
+        return 'undefined'
+
+    def __bool__(self) -> bool:
+        return False
+
+UNDEFINED = Undefined()
+NAN = float('nan')
+INFINITY = float('inf')
+ARRAY_INDEX_RE = re.compile(r'^(0|[1-9][0-9]*)$')
+ASTRAL_RE = re.compile('[\U00010000-\U0010ffff]')
+SURROGATE_RE = re.compile('[\ud800-\udfff]')
+NUMBER_RE = re.compile(r'^[+-]?(Infinity|(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?)$')
+
+class JsError(Exception):
+    pass
+
+class JsObject:
+    # Objects whose properties are looked up through `properties` and `methods`
+    properties = ()
+    methods = {}
+
+    def get_property(self, key: str) -> Any:
+        if key in self.properties:
+            return getattr(self, key)
+        if key in self.methods:
+            return lambda *a: self.methods[key](self, *a)
+        return UNDEFINED
+
+    frozen = False
+
+    def set_property(self, key: str, value: Any) -> None:
+        if self.frozen:
+            reject_change(self)
+        if key not in self.properties:
+            raise JsError(f'Cannot set property {key} of {js_str(self)}')
+        setattr(self, key, value)
+
+def reject_change(self: Any, *_: Any) -> None:
+    raise JsError('Cannot change a frozen object')
+
+class FrozenDict(dict):
+    # What `Object.freeze` makes of an object, any change fails on it as in strict mode
+    __setitem__ = __delitem__ = update = pop = popitem = setdefault = clear = reject_change
+
+class FrozenList(list):
+    __setitem__ = __delitem__ = __iadd__ = append = extend = insert = pop = remove = reverse = sort = clear =\
+        reject_change
+
+def is_nullish(v: Any) -> bool:
+    return v is None or v is UNDEFINED
+
+def is_number(v: Any) -> bool:
+    return (isinstance(v, int) or isinstance(v, float)) and not isinstance(v, bool)
+
+def truthy(v: Any) -> bool:
+    if v is None or v is UNDEFINED or v is False:
+        return False
+    if v is True:
+        return True
+    if isinstance(v, str):
+        return v != ''
+    if is_number(v):
+        return v != 0 and v == v
+    return True
+
+def format_number(v: Any) -> str:
+    if isinstance(v, int):
+        return str(v)
+    if v != v:
+        return 'NaN'
+    if v in (INFINITY, -INFINITY):
+        return 'Infinity' if v > 0 else '-Infinity'
+    if v == 0:
+        return '0'
+    if v.is_integer() and abs(v) < 2 ** 53:
+        return str(int(v))
+    # Number::toString, starting from the shortest round-tripping digits
+    sign, digits, exponent = decimal.Decimal(repr(abs(v))).as_tuple()
+    digits = ''.join(map(str, digits))
+    stripped = digits.rstrip('0')
+    exponent += len(digits) - len(stripped)
+    digits = stripped
+    k = len(digits)
+    n = exponent + k
+    prefix = '-' if v < 0 else ''
+    if k <= n <= 21:
+        return prefix + digits + '0' * (n - k)
+    if 0 < n <= 21:
+        return prefix + digits[:n] + '.' + digits[n:]
+    if -6 < n <= 0:
+        return prefix + '0.' + '0' * -n + digits
+    mantissa = digits[0] + ('.' + digits[1:] if k > 1 else '')
+    return prefix + mantissa + 'e' + ('+' if n - 1 >= 0 else '-') + str(abs(n - 1))
+
+def js_str(v: Any) -> str:
+    if isinstance(v, str):
+        return v
+    if v is None:
+        return 'null'
+    if v is UNDEFINED:
+        return 'undefined'
+    if v is True:
+        return 'true'
+    if v is False:
+        return 'false'
+    if is_number(v):
+        return format_number(v)
+    if isinstance(v, list):
+        return ','.join('' if is_nullish(e) else js_str(e) for e in v)
+    if isinstance(v, JsRegExp):
+        return f'/{v.source}/{v.flags}'
+    if callable(v):
+        return 'function () { [native code] }'
+    return '[object Object]'
+
+def to_number(v: Any) -> Any:
+    if is_number(v):
+        return v
+    if v is None or v is False:
+        return 0
+    if v is True:
+        return 1
+    if v is UNDEFINED:
+        return NAN
+    if isinstance(v, str):
+        v = v.strip()
+        if v == '':
+            return 0
+        if re.match(r'^0[xX][0-9a-fA-F]+$', v):
+            return normalize_number(int(v, 16))
+        if NUMBER_RE.match(v):
+            n = float(v.replace('Infinity', 'inf'))
+            return int(n) if n.is_integer() and abs(n) < 2 ** 53 else n
+        return NAN
+    if isinstance(v, list):
+        return to_number(js_str(v))
+    return NAN
+
+def normalize_number(n: Any) -> Any:
+    if isinstance(n, float) and n.is_integer() and abs(n) < 2 ** 53:
+        return int(n)
+    # Integers are only exact up to 2^53 in V8, beyond that they round like any double
+    if isinstance(n, int) and not isinstance(n, bool) and abs(n) > 2 ** 53:
+        try:
+            return float(n)
+        except OverflowError:
+            return INFINITY if n > 0 else -INFINITY
+    return n
+
+def to_primitive(v: Any) -> Any:
+    if isinstance(v, (list, dict, JsObject)) or callable(v):
+        return js_str(v)
+    return v
+
+def js_add(a: Any, b: Any) -> Any:
+    if isinstance(a, str) and isinstance(b, str):
+        return concat_strings(a, b)
+    a = to_primitive(a)
+    b = to_primitive(b)
+    if isinstance(a, str) or isinstance(b, str):
+        return concat_strings(js_str(a), js_str(b))
+    return normalize_number(to_number(a) + to_number(b))
+
+def js_sub(a: Any, b: Any) -> Any:
+    return normalize_number(to_number(a) - to_number(b))
+
+def js_mul(a: Any, b: Any) -> Any:
+    a = to_number(a)
+    b = to_number(b)
+    try:
+        return normalize_number(a * b)
+    except OverflowError:
+        return INFINITY if (a > 0) == (b > 0) else -INFINITY
+
+def js_div(a: Any, b: Any) -> Any:
+    a = to_number(a)
+    b = to_number(b)
+    if b == 0:
+        if a == 0 or a != a:
+            return NAN
+        return INFINITY if (a > 0) == (math.copysign(1, b) > 0) else -INFINITY
+    return normalize_number(a / b)
+
+def js_mod(a: Any, b: Any) -> Any:
+    a = to_number(a)
+    b = to_number(b)
+    if b == 0 or a != a or b != b or a in (INFINITY, -INFINITY):
+        return NAN
+    return normalize_number(math.fmod(a, b))
+
+def js_neg(a: Any) -> Any:
+    return normalize_number(-to_number(a))
+
+def js_typeof(v: Any) -> str:
+    if v is UNDEFINED:
+        return 'undefined'
+    if isinstance(v, bool):
+        return 'boolean'
+    if is_number(v):
+        return 'number'
+    if isinstance(v, str):
+        return 'string'
+    if callable(v) and not isinstance(v, JsObject):
+        return 'function'
+    return 'object'
+
+def strict_equal(a: Any, b: Any) -> bool:
+    if is_number(a) and is_number(b):
+        return a == b
+    if isinstance(a, str) and isinstance(b, str):
+        return a == b
+    if isinstance(a, bool) and isinstance(b, bool):
+        return a == b
+    return a is b
+
+def loose_equal(a: Any, b: Any) -> bool:
+    if is_nullish(a) or is_nullish(b):
+        return is_nullish(a) and is_nullish(b)
+    if js_typeof(a) == js_typeof(b):
+        return strict_equal(a, b)
+    if isinstance(a, bool):
+        return loose_equal(int(a), b)
+    if isinstance(b, bool):
+        return loose_equal(a, int(b))
+    if is_number(a) and isinstance(b, str):
+        return a == to_number(b)
+    if isinstance(a, str) and is_number(b):
+        return to_number(a) == b
+    if isinstance(a, (list, dict, JsObject)) and not isinstance(b, (list, dict, JsObject)):
+        return loose_equal(to_primitive(a), b)
+    if isinstance(b, (list, dict, JsObject)) and not isinstance(a, (list, dict, JsObject)):
+        return loose_equal(a, to_primitive(b))
+    return False
+
+def compare(a: Any, b: Any) -> Optional[int]:
+    a = to_primitive(a)
+    b = to_primitive(b)
+    if isinstance(a, str) and isinstance(b, str):
+        # JavaScript compares strings by their UTF-16 code units
+        a = a.encode('utf-16-be')
+        b = b.encode('utf-16-be')
+    else:
+        a = to_number(a)
+        b = to_number(b)
+        if a != a or b != b:
+            return None
+    return (a > b) - (a < b)
+
+def js_lt(a: Any, b: Any) -> bool:
+    return compare(a, b) == -1
+
+def js_gt(a: Any, b: Any) -> bool:
+    return compare(a, b) == 1
+
+def js_le(a: Any, b: Any) -> bool:
+    return compare(a, b) in (-1, 0)
+
+def js_ge(a: Any, b: Any) -> bool:
+    return compare(a, b) in (0, 1)
+
+def property_key(key: Any) -> str:
+    return key if isinstance(key, str) else js_str(key)
+
+def array_index(key: Any) -> Optional[int]:
+    if is_number(key):
+        return int(key) if key == int(key) and key >= 0 else None
+    if isinstance(key, str) and ARRAY_INDEX_RE.match(key):
+        return int(key)
+    return None
+
+def js_keys(o: Any) -> list:
+    if isinstance(o, dict):
+        # Integer-like keys come first and in ascending order, as in every JavaScript object
+        indices = sorted((k for k in o if ARRAY_INDEX_RE.match(k) and int(k) < 2 ** 32 - 1), key=int)
+        return indices + [k for k in o if not (ARRAY_INDEX_RE.match(k) and int(k) < 2 ** 32 - 1)]
+    if isinstance(o, (list, str)):
+        return [str(i) for i in range(len(to_code_units(o) if isinstance(o, str) else o))]
+    if isinstance(o, JsObject):
+        return [k for k in o.properties]
+    return []
+
+def get(o: Any, key: Any) -> Any:
+    if isinstance(o, dict):
+        return o.get(property_key(key), UNDEFINED)
+    if isinstance(o, (list, str)):
+        i = array_index(key)
+        if isinstance(o, str) and (i is not None or key == 'length'):
+            o = to_code_units(o)
+        if i is not None:
+            return o[i] if i < len(o) else UNDEFINED
+        if key == 'length':
+            return len(o)
+        methods = STRING_METHODS if isinstance(o, str) else ARRAY_METHODS
+        if key in methods:
+            return lambda *a: methods[key](o, *a)
+        return UNDEFINED
+    if is_nullish(o):
+        raise JsError(f"Cannot read properties of {js_str(o)} (reading '{property_key(key)}')")
+    if isinstance(o, JsObject):
+        return o.get_property(property_key(key))
+    return UNDEFINED
+
+def get_optional(o: Any, key: Any) -> Any:
+    return UNDEFINED if is_nullish(o) else get(o, key)
+
+def set_(o: Any, key: Any, value: Any) -> Any:
+    if isinstance(o, (FrozenDict, FrozenList)):
+        reject_change(o)
+    if isinstance(o, dict):
+        o[property_key(key)] = value
+    elif isinstance(o, list):
+        i = array_index(key)
+        if i is None:
+            if key != 'length':
+                raise JsError(f'Cannot set property {property_key(key)} of an array')
+            del o[int(to_number(value)):]
+        else:
+            o.extend([UNDEFINED] * (i + 1 - len(o)))
+            o[i] = value
+    elif isinstance(o, JsObject):
+        o.set_property(property_key(key), value)
+    elif is_nullish(o):
+        raise JsError(f"Cannot set properties of {js_str(o)} (setting '{property_key(key)}')")
+    return value
+
+def js_in(key: Any, o: Any) -> bool:
+    if isinstance(o, dict):
+        return property_key(key) in o
+    if isinstance(o, list):
+        i = array_index(key)
+        return (i is not None and i < len(o)) or key == 'length'
+    if isinstance(o, JsObject):
+        return property_key(key) in o.properties or property_key(key) in o.methods
+    raise JsError(f"Cannot use 'in' operator to search for '{js_str(key)}' in {js_str(o)}")
+
+def call(f: Any, *a: Any) -> Any:
+    if not callable(f) or isinstance(f, JsObject):
+        raise JsError(f'{js_str(f)} is not a function')
+    return f(*a)
+
+def call_method(o: Any, name: str, *a: Any) -> Any:
+    if isinstance(o, str):
+        methods = STRING_METHODS
+    elif isinstance(o, list):
+        methods = ARRAY_METHODS
+    elif is_number(o):
+        methods = NUMBER_METHODS
+    elif isinstance(o, dict):
+        if name in o:
+            return call(o[name], *a)
+        methods = OBJECT_METHODS
+    elif isinstance(o, JsObject):
+        return call(o.get_property(name), *a)
+    elif is_nullish(o):
+        raise JsError(f"Cannot read properties of {js_str(o)} (reading '{name}')")
+    else:
+        methods = OBJECT_METHODS
+    if name not in methods:
+        raise JsError(f'{js_typeof(o)}.{name} is not a function')
+    return methods[name](o, *a)
+
+def iterate_of(o: Any) -> Any:
+    if isinstance(o, str):
+        return list(o)
+    if isinstance(o, list):
+        # Arrays are iterated live, like in JavaScript
+        return ListIterator(o)
+    raise JsError(f'{js_str(o)} is not iterable')
+
+class ListIterator:
+    def __init__(self, o: list) -> None:
+        self.o = o
+        self.i = 0
+
+    def __iter__(self) -> 'ListIterator':
+        return self
+
+    def __next__(self) -> Any:
+        if self.i >= len(self.o):
+            raise StopIteration
+        self.i += 1
+        return self.o[self.i - 1]
+
+def iterate_in(o: Any) -> list:
+    if is_nullish(o):
+        return []
+    return js_keys(o)
+
+def to_list(o: Any) -> list:
+    return list(iterate_of(o))
+
+def to_integer(v: Any, default: int = 0) -> int:
+    if v is UNDEFINED:
+        return default
+    n = to_number(v)
+    if n != n:
+        return 0
+    if n in (INFINITY, -INFINITY):
+        return 2 ** 53 if n > 0 else -2 ** 53
+    return int(n)
+
+# Strings of JavaScript are indexed by UTF-16 code units, so characters beyond the BMP count twice
+def to_surrogate_pair(m: re.Match) -> str:
+    c = ord(m.group(0)) - 0x10000
+    return chr(0xd800 + (c >> 10)) + chr(0xdc00 + (c & 0x3ff))
+
+def to_code_units(s: str) -> str:
+    return ASTRAL_RE.sub(to_surrogate_pair, s)
+
+def from_code_units(o: Any) -> Any:
+    if isinstance(o, list):
+        return [from_code_units(e) for e in o]
+    if isinstance(o, str) and SURROGATE_RE.search(o):
+        return o.encode('utf-16-le', 'surrogatepass').decode('utf-16-le', 'surrogatepass')
+    return o
+
+def concat_strings(a: str, b: str) -> str:
+    if a[-1:] and b[:1] and '\ud800' <= a[-1] <= '\udbff' and '\udc00' <= b[0] <= '\udfff':
+        return from_code_units(a + b)
+    return a + b
+
+def code_unit_method(method: Callable) -> Callable:
+    def call(s: str, *a: Any) -> Any:
+        if not ASTRAL_RE.search(s) and not any(isinstance(e, str) and ASTRAL_RE.search(e) for e in a):
+            return method(s, *a)
+        return from_code_units(method(to_code_units(s), *(to_code_units(e) if isinstance(e, str) else e for e in a)))
+    return call
+
+def relative_index(i: Any, length: int, default: int) -> int:
+    i = to_integer(i, default)
+    return max(0, length + i) if i < 0 else min(i, length)
+
+class JsRegExp(JsObject):
+    properties = ('source', 'flags', 'lastIndex')
+
+    def __init__(self, source: str, flags: str) -> None:
+        self.source = source
+        self.flags = flags
+        self.lastIndex = 0
+        self.is_global = 'g' in flags
+        self.pattern = re.compile(
+            translate_regexp(source, 'm' in flags),
+            (re.I if 'i' in flags else 0) | (re.M if 'm' in flags else 0) | (re.S if 's' in flags else 0)
+        )
+
+def translate_regexp(source: str, multiline: bool) -> str:
+    result = ''
+    in_class = False
+    i = 0
+    while i < len(source):
+        c = source[i]
+        if c == '\\' and i + 1 < len(source):
+            e = source[i + 1]
+            i += 2
+            if e == 'd':
+                result += '0-9' if in_class else '[0-9]'
+            elif e == 'D':
+                result += '[^0-9]' if not in_class else '\\D'
+            elif e == 'w':
+                result += 'A-Za-z0-9_' if in_class else '[A-Za-z0-9_]'
+            elif e == 'W':
+                result += '[^A-Za-z0-9_]' if not in_class else '\\W'
+            elif e == 'u' and source[i:i + 1] == '{':
+                end = source.index('}', i)
+                result += f'\\U{int(source[i + 1:end], 16):08x}'
+                i = end + 1
+            elif e == '/':
+                result += '/'
+            else:
+                result += '\\' + e
+            continue
+        if in_class:
+            if c == ']':
+                in_class = False
+            elif c == '[':
+                c = '\\['
+        elif c == '[':
+            in_class = True
+            if source[i + 1:i + 3] == '^]':
+                result += '[\\s\\S]'
+                i += 3
+                continue
+            if source[i + 1:i + 2] == ']':
+                result += '(?!)'
+                i += 2
+                in_class = False
+                continue
+        elif c == '$' and not multiline:
+            c = '(?!(?s:.))'
+        elif c == '(' and source[i + 1:i + 3] == '?<' and source[i + 3:i + 4] not in ('=', '!'):
+            c = '(?P'
+            i += 1
+            result += c + '<'
+            i += 2
+            continue
+        result += c
+        i += 1
+    return result
+
+def regexp_test(r: JsRegExp, s: Any = UNDEFINED, *_: Any) -> bool:
+    s = js_str(s)
+    if r.is_global:
+        m = r.pattern.search(s, r.lastIndex) if r.lastIndex <= len(s) else None
+        r.lastIndex = m.end() if m else 0
+        return m is not None
+    return r.pattern.search(s) is not None
+
+JsRegExp.methods = {
+    'test': regexp_test,
+    'toString': lambda r, *_: js_str(r)
+}
+
+def match_to_list(m: re.Match) -> list:
+    return [m.group(0)] + [UNDEFINED if g is None else g for g in m.groups()]
+
+def expand_replacement(replacement: str, m: re.Match, s: str) -> str:
+    def substitute(e: re.Match) -> str:
+        token = e.group(1)
+        if token == '$':
+            return '$'
+        if token == '&':
+            return m.group(0)
+        if token == '`':
+            return s[:m.start()]
+        if token == "'":
+            return s[m.end():]
+        if token[0] == '<':
+            return m.groupdict().get(token[1:-1]) or '' if m.re.groupindex else e.group(0)
+        n = int(token)
+        if 0 < n <= len(m.groups()):
+            return m.group(n) or ''
+        if len(token) == 2 and 0 < int(token[0]) <= len(m.groups()):
+            return (m.group(int(token[0])) or '') + token[1]
+        return e.group(0)
+    return re.sub(r"\$(\$|&|`|'|\d\d?|<[^>]*>)", substitute, replacement)
+
+def string_replace(s: str, pattern: Any = UNDEFINED, replacement: Any = UNDEFINED, *_: Any, replace_all: bool = False) -> str:
+    if isinstance(pattern, JsRegExp):
+        regexp = pattern.pattern
+        count = 0 if pattern.is_global else 1
+    else:
+        regexp = re.compile(re.escape(js_str(pattern)))
+        count = 0 if replace_all else 1
+    def substitute(m: re.Match) -> str:
+        if callable(replacement):
+            return js_str(replacement(*match_to_list(m), m.start(), s))
+        return expand_replacement(js_str(replacement), m, s)
+    return regexp.sub(substitute, s, count=count)
+
+def string_split(s: str, separator: Any = UNDEFINED, limit: Any = UNDEFINED, *_: Any) -> list:
+    if separator is UNDEFINED:
+        result = [s]
+    elif isinstance(separator, JsRegExp):
+        result = []
+        position = 0
+        for m in separator.pattern.finditer(s):
+            if m.end() == m.start() and (m.start() == 0 or m.start() >= len(s)):
+                continue
+            result.append(s[position:m.start()])
+            result.extend(UNDEFINED if g is None else g for g in m.groups())
+            position = m.end()
+        if s or not separator.pattern.match(s):
+            result.append(s[position:])
+    elif js_str(separator) == '':
+        result = list(s)
+    else:
+        result = s.split(js_str(separator))
+    if limit is not UNDEFINED:
+        result = result[:to_integer(limit)]
+    return result
+
+def string_match(s: str, pattern: Any = UNDEFINED, *_: Any) -> Any:
+    if not isinstance(pattern, JsRegExp):
+        pattern = JsRegExp(re.escape(js_str(pattern)) if pattern is not UNDEFINED else '', '')
+    if pattern.is_global:
+        matches = [m.group(0) for m in pattern.pattern.finditer(s)]
+        return matches or None
+    m = pattern.pattern.search(s)
+    return None if m is None else match_to_list(m)
+
+def string_index_of(s: str, search: Any = UNDEFINED, position: Any = UNDEFINED, *_: Any) -> int:
+    return s.find(js_str(search), min(max(to_integer(position), 0), len(s)))
+
+def string_last_index_of(s: str, search: Any = UNDEFINED, position: Any = UNDEFINED, *_: Any) -> int:
+    end = len(s) if position is UNDEFINED else min(max(to_integer(position), 0), len(s))
+    return s.rfind(js_str(search), 0, end + len(js_str(search)))
+
+def string_substring(s: str, start: Any = UNDEFINED, end: Any = UNDEFINED, *_: Any) -> str:
+    start = min(max(to_integer(start), 0), len(s))
+    end = len(s) if end is UNDEFINED else min(max(to_integer(end), 0), len(s))
+    return s[min(start, end):max(start, end)]
+
+def string_substr(s: str, start: Any = UNDEFINED, length: Any = UNDEFINED, *_: Any) -> str:
+    start = relative_index(start, len(s), 0)
+    length = len(s) - start if length is UNDEFINED else max(to_integer(length), 0)
+    return s[start:start + length]
+
+def string_pad(s: str, length: Any, filler: Any, at_start: bool) -> str:
+    length = to_integer(length)
+    filler = ' ' if filler is UNDEFINED else js_str(filler)
+    if length <= len(s) or filler == '':
+        return s
+    padding = (filler * (length // len(filler) + 1))[:length - len(s)]
+    return padding + s if at_start else s + padding
+
+def string_char_code_at(s: str, i: Any = UNDEFINED, *_: Any) -> Any:
+    units = s.encode('utf-16-be')
+    i = to_integer(i)
+    if not 0 <= i < len(units) // 2:
+        return NAN
+    return int.from_bytes(units[2 * i:2 * i + 2], 'big')
+
+def string_locale_compare(s: str, other: Any = UNDEFINED, *_: Any) -> int:
+    other = js_str(other)
+    return (s > other) - (s < other)
+
+STRING_METHODS = {
+    'replace': string_replace,
+    'replaceAll': lambda s, p=UNDEFINED, r=UNDEFINED, *_: string_replace(s, p, r, replace_all=True),
+    'split': code_unit_method(string_split),
+    'match': string_match,
+    'toLowerCase': lambda s, *_: s.lower(),
+    'toUpperCase': lambda s, *_: s.upper(),
+    'toLocaleLowerCase': lambda s, *_: s.lower(),
+    'toLocaleUpperCase': lambda s, *_: s.upper(),
+    'trim': lambda s, *_: s.strip(),
+    'trimStart': lambda s, *_: s.lstrip(),
+    'trimEnd': lambda s, *_: s.rstrip(),
+    'startsWith': code_unit_method(lambda s, p=UNDEFINED, i=UNDEFINED, *_: s.startswith(js_str(p), min(max(to_integer(i), 0), len(s)))),
+    'endsWith': code_unit_method(lambda s, p=UNDEFINED, i=UNDEFINED, *_: s[:len(s) if i is UNDEFINED else max(to_integer(i), 0)].endswith(js_str(p))),
+    'includes': code_unit_method(lambda s, p=UNDEFINED, i=UNDEFINED, *_: js_str(p) in s[max(to_integer(i), 0):]),
+    'indexOf': code_unit_method(string_index_of),
+    'lastIndexOf': code_unit_method(string_last_index_of),
+    'slice': code_unit_method(lambda s, b=UNDEFINED, e=UNDEFINED, *_: s[relative_index(b, len(s), 0):relative_index(e, len(s), len(s))]),
+    'substring': code_unit_method(string_substring),
+    'substr': code_unit_method(string_substr),
+    'charAt': code_unit_method(lambda s, i=UNDEFINED, *_: s[to_integer(i)] if 0 <= to_integer(i) < len(s) else ''),
+    'charCodeAt': string_char_code_at,
+    'padStart': code_unit_method(lambda s, l=UNDEFINED, f=UNDEFINED, *_: string_pad(s, l, f, True)),
+    'padEnd': code_unit_method(lambda s, l=UNDEFINED, f=UNDEFINED, *_: string_pad(s, l, f, False)),
+    'repeat': lambda s, n=UNDEFINED, *_: s * to_integer(n),
+    'concat': lambda s, *a: s + ''.join(js_str(e) for e in a),
+    'localeCompare': string_locale_compare,
+    'normalize': lambda s, *_: s,
+    'toString': lambda s, *_: s,
+    'valueOf': lambda s, *_: s
+}
+
+def array_join(o: list, separator: Any = UNDEFINED, *_: Any) -> str:
+    separator = ',' if separator is UNDEFINED else js_str(separator)
+    return separator.join('' if is_nullish(e) else js_str(e) for e in o)
+
+def array_sort(o: list, comparator: Any = UNDEFINED, *_: Any) -> list:
+    if len(o) < 2:
+        return o
+    # Like V8, `undefined` is always sorted last and never passed to the comparator
+    defined = [e for e in o if e is not UNDEFINED]
+    undefined = [e for e in o if e is UNDEFINED]
+    if comparator is UNDEFINED:
+        defined.sort(key=lambda e: js_str(e).encode('utf-16-be'))
+    else:
+        def compare_elements(a: Any, b: Any) -> int:
+            n = to_number(comparator(a, b))
+            return 0 if n != n else (n > 0) - (n < 0)
+        defined.sort(key=cmp_to_key(compare_elements))
+    o[:] = defined + undefined
+    return o
+
+def array_index_of(o: list, search: Any = UNDEFINED, start: Any = UNDEFINED, *_: Any) -> int:
+    for i in range(relative_index(start, len(o), 0), len(o)):
+        if strict_equal(o[i], search):
+            return i
+    return -1
+
+def array_includes(o: list, search: Any = UNDEFINED, *_: Any) -> bool:
+    return any(strict_equal(e, search) or (e != e and search != search) for e in o)
+
+def array_reduce(o: list, f: Any, *a: Any) -> Any:
+    i = 0
+    if a:
+        accumulator = a[0]
+    elif not o:
+        raise JsError('Reduce of empty array with no initial value')
+    else:
+        accumulator = o[0]
+        i = 1
+    for j in range(i, len(o)):
+        accumulator = f(accumulator, o[j], j, o)
+    return accumulator
+
+def array_find(o: list, f: Any, *_: Any) -> Any:
+    for i, e in enumerate(o):
+        if truthy(f(e, i, o)):
+            return e
+    return UNDEFINED
+
+def array_find_index(o: list, f: Any, *_: Any) -> int:
+    for i, e in enumerate(o):
+        if truthy(f(e, i, o)):
+            return i
+    return -1
+
+def array_for_each(o: list, f: Any, *_: Any) -> Undefined:
+    for i, e in enumerate(list(o)):
+        f(e, i, o)
+    return UNDEFINED
+
+def array_push(o: list, *a: Any) -> int:
+    o.extend(a)
+    return len(o)
+
+def array_unshift(o: list, *a: Any) -> int:
+    o[:0] = a
+    return len(o)
+
+def array_flat(o: list, depth: Any = UNDEFINED, *_: Any) -> list:
+    depth = 1 if depth is UNDEFINED else to_integer(depth)
+    result = []
+    for e in o:
+        if isinstance(e, list) and depth > 0:
+            result.extend(array_flat(e, depth - 1))
+        else:
+            result.append(e)
+    return result
+
+def array_concat(o: list, *a: Any) -> list:
+    result = list(o)
+    for e in a:
+        if isinstance(e, list):
+            result.extend(e)
+        else:
+            result.append(e)
+    return result
+
+def array_reverse(o: list, *_: Any) -> list:
+    if len(o) > 1:
+        o.reverse()
+    return o
+
+ARRAY_METHODS = {
+    'join': array_join,
+    'map': lambda o, f=UNDEFINED, *_: [call(f, e, i, o) for i, e in enumerate(o)],
+    'filter': lambda o, f=UNDEFINED, *_: [e for i, e in enumerate(o) if truthy(call(f, e, i, o))],
+    'forEach': array_for_each,
+    'find': array_find,
+    'findIndex': array_find_index,
+    'some': lambda o, f=UNDEFINED, *_: any(truthy(call(f, e, i, o)) for i, e in enumerate(o)),
+    'every': lambda o, f=UNDEFINED, *_: all(truthy(call(f, e, i, o)) for i, e in enumerate(o)),
+    'reduce': array_reduce,
+    'slice': lambda o, b=UNDEFINED, e=UNDEFINED, *_: o[relative_index(b, len(o), 0):relative_index(e, len(o), len(o))],
+    'concat': array_concat,
+    'indexOf': array_index_of,
+    'includes': array_includes,
+    'reverse': array_reverse,
+    'sort': array_sort,
+    'push': array_push,
+    'pop': lambda o, *_: o.pop() if o or isinstance(o, FrozenList) else UNDEFINED,
+    'shift': lambda o, *_: o.pop(0) if o or isinstance(o, FrozenList) else UNDEFINED,
+    'unshift': array_unshift,
+    'flat': array_flat,
+    'toString': lambda o, *_: js_str(o)
+}
+
+def number_to_string(n: Any, radix: Any = UNDEFINED, *_: Any) -> str:
+    radix = 10 if radix is UNDEFINED else to_integer(radix)
+    if radix == 10 or n != n or n in (INFINITY, -INFINITY) or n != int(n):
+        return js_str(n)
+    n = int(n)
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    m = abs(n)
+    while True:
+        m, r = divmod(m, radix)
+        result = digits[r] + result
+        if m == 0:
+            break
+    return ('-' if n < 0 else '') + result
+
+def number_to_fixed(n: Any, digits: Any = UNDEFINED, *_: Any) -> str:
+    digits = to_integer(digits)
+    if n != n:
+        return 'NaN'
+    if abs(n) >= 1e21:
+        return js_str(n)
+    # Ties round up, using the exact binary value of the number like V8
+    result = decimal.Decimal(abs(n)).quantize(decimal.Decimal(1).scaleb(-digits), rounding=decimal.ROUND_HALF_UP)
+    return ('-' if n < 0 and result != 0 else '') + f'{result:f}'
+
+NUMBER_METHODS = {
+    'toString': number_to_string,
+    'toFixed': number_to_fixed,
+    'valueOf': lambda n, *_: n
+}
+
+OBJECT_METHODS = {
+    'hasOwnProperty': lambda o, k=UNDEFINED, *_: isinstance(o, dict) and property_key(k) in o,
+    'toString': lambda o, *_: js_str(o),
+    'valueOf': lambda o, *_: o
+}
+
+SUPPORTED_METHODS = set(STRING_METHODS) | set(ARRAY_METHODS) | set(NUMBER_METHODS) | set(OBJECT_METHODS) | set(JsRegExp.methods)
+
+def stringify(v: Any, indent: str = '', current_indent: str = '') -> Any:
+    if isinstance(v, JsObject) and not isinstance(v, JalaliDate):
+        return '{}'
+    if isinstance(v, JalaliDate):
+        v = {'year': v.year, 'month': v.month, 'day': v.day}
+    if v is None or v is True or v is False:
+        return js_str(v)
+    if is_number(v):
+        return js_str(v) if v == v and v not in (INFINITY, -INFINITY) else 'null'
+    if isinstance(v, str):
+        return json.dumps(v, ensure_ascii=False)
+    if v is UNDEFINED or callable(v):
+        return UNDEFINED
+    inner_indent = current_indent + indent
+    if isinstance(v, list):
+        parts = [stringify(e, indent, inner_indent) for e in v]
+        parts = ['null' if p is UNDEFINED else p for p in parts]
+        if not parts:
+            return '[]'
+        if indent:
+            return '[\n' + inner_indent + (',\n' + inner_indent).join(parts) + '\n' + current_indent + ']'
+        return '[' + ','.join(parts) + ']'
+    parts = []
+    for k in js_keys(v):
+        p = stringify(v[k], indent, inner_indent)
+        if p is not UNDEFINED:
+            parts.append(json.dumps(k, ensure_ascii=False) + (': ' if indent else ':') + p)
+    if not parts:
+        return '{}'
+    if indent:
+        return '{\n' + inner_indent + (',\n' + inner_indent).join(parts) + '\n' + current_indent + '}'
+    return '{' + ','.join(parts) + '}'
+
+def json_stringify(v: Any = UNDEFINED, replacer: Any = UNDEFINED, space: Any = UNDEFINED, *_: Any) -> Any:
+    if not is_nullish(replacer):
+        raise JsError('Replacers of `JSON.stringify` are not supported')
+    indent = ' ' * min(to_integer(space), 10) if is_number(space) else js_str(space)[:10] if isinstance(space, str) else ''
+    return stringify(v, indent)
+
+def parse_int(s: Any = UNDEFINED, radix: Any = UNDEFINED, *_: Any) -> Any:
+    s = js_str(s).strip()
+    radix = to_integer(radix)
+    sign = -1 if s.startswith('-') else 1
+    s = s[1:] if s[:1] in ('-', '+') else s
+    if radix in (0, 16) and s[:2].lower() == '0x':
+        s = s[2:]
+        radix = 16
+    radix = radix or 10
+    if not 2 <= radix <= 36:
+        return NAN
+    digits = ''
+    for c in s:
+        if c.isascii() and c.isalnum() and int(c, 36) < radix:
+            digits += c
+        else:
+            break
+    return normalize_number(sign * int(digits, radix)) if digits else NAN
+
+def parse_float(s: Any = UNDEFINED, *_: Any) -> Any:
+    m = re.match(r'^[+-]?(Infinity|(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?)', js_str(s).strip())
+    return to_number(m.group(0)) if m else NAN
+
+def js_round(n: Any = UNDEFINED, *_: Any) -> Any:
+    n = to_number(n)
+    if n != n or n in (INFINITY, -INFINITY):
+        return n
+    return normalize_number(math.floor(n + 0.5))
+
+def js_min(*a: Any) -> Any:
+    a = [to_number(e) for e in a]
+    return NAN if any(e != e for e in a) else min(a, default=INFINITY)
+
+def js_max(*a: Any) -> Any:
+    a = [to_number(e) for e in a]
+    return NAN if any(e != e for e in a) else max(a, default=-INFINITY)
+
+def number_function(f: Callable) -> Callable:
+    def wrapped(n: Any = UNDEFINED, *_: Any) -> Any:
+        n = to_number(n)
+        if n != n or n in (INFINITY, -INFINITY):
+            return n
+        return normalize_number(f(n))
+    return wrapped
+
+class Namespace(JsObject):
+    def __init__(self, **members: Any) -> None:
+        self.members = members
+
+    def get_property(self, key: str) -> Any:
+        return self.members.get(key, UNDEFINED)
+
+def object_assign(target: Any = UNDEFINED, *sources: Any) -> Any:
+    for source in sources:
+        if isinstance(source, dict):
+            target.update(source)
+    return target
+
+MATH = Namespace(
+    PI=math.pi,
+    E=math.e,
+    floor=number_function(math.floor),
+    ceil=number_function(math.ceil),
+    trunc=number_function(math.trunc),
+    round=js_round,
+    abs=number_function(abs),
+    sign=number_function(lambda n: (n > 0) - (n < 0)),
+    sqrt=lambda n=UNDEFINED, *_: NAN if to_number(n) < 0 else normalize_number(math.sqrt(to_number(n))),
+    pow=lambda a=UNDEFINED, b=UNDEFINED, *_: normalize_number(math.pow(to_number(a), to_number(b))),
+    min=js_min,
+    max=js_max,
+    random=lambda *_: random.random()
+)
+OBJECT = Namespace(
+    keys=lambda o=UNDEFINED, *_: js_keys(o),
+    values=lambda o=UNDEFINED, *_: [get(o, k) for k in js_keys(o)],
+    entries=lambda o=UNDEFINED, *_: [[k, get(o, k)] for k in js_keys(o)],
+    assign=object_assign
+)
+ARRAY = Namespace(
+    isArray=lambda o=UNDEFINED, *_: isinstance(o, list),
+    of=lambda *a: list(a),
+    **{'from': lambda o=UNDEFINED, f=UNDEFINED, *_: [e if f is UNDEFINED else call(f, e, i) for i, e in enumerate(to_list(o) if isinstance(o, (list, str)) else [])]}
+)
+JSON = Namespace(stringify=json_stringify)
+SUPPORTED_METHODS |= set(MATH.members) | set(OBJECT.members) | set(ARRAY.members) | set(JSON.members)
+
+def js_string(v: Any = '', *_: Any) -> str:
+    return js_str(v)
+
+def js_number(v: Any = 0, *_: Any) -> Any:
+    return to_number(v)
+
+def js_boolean(v: Any = UNDEFINED, *_: Any) -> bool:
+    return truthy(v)
+
+def is_nan(v: Any = UNDEFINED, *_: Any) -> bool:
+    n = to_number(v)
+    return n != n
+
+def encode_uri_component(s: Any = UNDEFINED, *_: Any) -> str:
+    return quote(js_str(s), safe="-_.!~*'()")
+
+def encode_uri(s: Any = UNDEFINED, *_: Any) -> str:
+    return quote(js_str(s), safe=";,/?:@&=+$-_.!~*'()#")
+
+def decode_uri_component(s: Any = UNDEFINED, *_: Any) -> str:
+    return unquote(js_str(s), errors='strict')
+
+# The helpers of `compiled_ejs_template.js`
+
+HTML_SAFE_ALTERNATIVES = {
+    '&': '&amp;',
+    '"': '&quot;',
+    "'": '&apos;',
+    '<': '&lt;',
+    '>': '&gt;'
+}
+HTML_UNSAFE_RE = re.compile('[&"\'<>]')
+MONTH_NAMES = [
+    'فروردین', 'اردیبهشت', 'خرداد', 'تیر', 'مرداد', 'شهریور', 'مهر', 'آبان', 'آذر', 'دی', 'بهمن', 'اسفند'
+]
+ORDINALS = [
+    'یکم', 'دوم', 'سوم', 'چهارم', 'پنجم', 'ششم', 'هفتم', 'هشتم', 'نهم', 'دهم', 'یازدهم', 'دوازدهم',
+    'سیزدهم', 'چهاردهم', 'پانزدهم', 'شانزدهم', 'هفدهم', 'هجدهم', 'نوزدهم', 'بیستم', 'بیست و یکم', 'بیست و دوم',
+    'بیست و سوم', 'بیست و چهارم', 'بیست و پنجم', 'بیست و ششم', 'بیست و هفتم', 'بیست و هشتم',
+    'بیست و نهم', 'سی‌ام', 'سی و یکم'
+]
+FARSI_DIGITS = str.maketrans('0123456789', '۰۱۲۳۴۵۶۷۸۹')
+
+def escape_for_html(s: Any = UNDEFINED, *_: Any) -> str:
+    if not isinstance(s, str):
+        call_method(s, 'replace')
+    return HTML_UNSAFE_RE.sub(lambda m: HTML_SAFE_ALTERNATIVES[m.group()], s)
+
+def to_farsi_digits(text: Any = UNDEFINED, *_: Any) -> str:
+    if not isinstance(text, str):
+        call_method(text, 'replace')
+    return text.translate(FARSI_DIGITS)
+
+class JalaliDate(JsObject):
+    properties = ('year', 'month', 'day')
+
+    def __init__(self, date: Any = UNDEFINED, *_: Any) -> None:
+        self.year = get(date, 'year')
+        self.month = get(date, 'month')
+        self.day = get(date, 'day')
+
+    def to_short_form(self, *_: Any) -> str:
+        return to_farsi_digits(js_add(js_add(js_add(js_add(self.year, '/'), self.month), '/'), self.day))
+
+    def to_long_form(self, *_: Any) -> str:
+        return js_add(js_add(js_add(js_add(
+            get(ORDINALS, js_sub(self.day, 1)), ' '),
+            get(MONTH_NAMES, js_sub(self.month, 1))),
+            ' ماه '),
+            to_farsi_digits(js_str(self.year))
+        )
+
+    def compare(self, other: Any = UNDEFINED, *_: Any) -> int:
+        for name in self.properties:
+            if js_gt(getattr(self, name), get(other, name)):
+                return 1
+            elif js_lt(getattr(self, name), get(other, name)):
+                return -1
+        return 0
+
+JalaliDate.methods = {
+    'toShortFormJalali': JalaliDate.to_short_form,
+    'toLongFormJalali': JalaliDate.to_long_form,
+    'compare': JalaliDate.compare
+}
+SUPPORTED_METHODS |= set(JalaliDate.methods)
+
+def convert_dates(o: Any, *_: Any) -> Undefined:
+    for k in js_keys(o) if isinstance(o, (dict, list)) else []:
+        v = get(o, k)
+        if not isinstance(v, (dict, list, JsObject)):
+            continue
+        if k.lower().endswith('date'):
+            set_(o, k, JalaliDate(v))
+        else:
+            convert_dates(v)
+    return UNDEFINED
+
+def copy_json(o: Any) -> Any:
+    # Values cross into V8 as copies, so the templates can never change the specs of Python
+    if isinstance(o, dict):
+        return {k: copy_json(v) for k, v in o.items()}
+    if isinstance(o, (list, tuple)):
+        return [copy_json(v) for v in o]
+    return normalize_number(o)
+
+def deep_freeze(o: Any) -> Any:
+    if isinstance(o, dict):
+        return FrozenDict((k, deep_freeze(v)) for k, v in o.items())
+    if isinstance(o, list):
+        return FrozenList(deep_freeze(v) for v in o)
+    if isinstance(o, JsObject):
+        o.frozen = True
+    return o
+
+GLOBALS = {
+    'undefined': UNDEFINED,
+    'NaN': NAN,
+    'Infinity': INFINITY,
+    'Math': MATH,
+    'Object': OBJECT,
+    'Array': ARRAY,
+    'JSON': JSON,
+    'String': js_string,
+    'Number': js_number,
+    'Boolean': js_boolean,
+    'parseInt': parse_int,
+    'parseFloat': parse_float,
+    'isNaN': is_nan,
+    'encodeURIComponent': encode_uri_component,
+    'encodeURI': encode_uri,
+    'decodeURIComponent': decode_uri_component,
+    'escapeForHtml': escape_for_html,
+    'toFarsiDigits': to_farsi_digits,
+    'convertDates': convert_dates,
+    'HTML_SAFE_ALTERNATIVES': HTML_SAFE_ALTERNATIVES,
+    'monthNames': MONTH_NAMES,
+    'ordinals': ORDINALS,
+    'JalaliDate': JalaliDate
+}
+
+__all__ = [
+    'UNDEFINED',
+    'INFINITY',
+    'JsError',
+    'JsRegExp',
+    'JalaliDate',
+    'SUPPORTED_METHODS',
+    'GLOBALS',
+    'truthy',
+    'js_str',
+    'normalize_number',
+    'convert_dates',
+    'copy_json',
+    'deep_freeze',
+    'from_code_units'
+]
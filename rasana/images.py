@@ -0,0 +1,180 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import json
+import tempfile
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from .cache import DEFAULT_CACHE_PATH, ResultCache, record_cache_write
+from .incremental import hash_file, hash_json
+from .resources import plan_resources, sync_file
+from .instrumentation import PROFILER
+try:
+    from PIL import Image, ImageOps, __version__ as pillow_version
+except ImportError:
+    Image = None
+    pillow_version = None
+
+IMAGE_PIPELINE_VERSION = 1
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff', '.bmp'}
+# The derivatives are binary, so they live next to the result caches instead of in them, sharing their size budget
+DERIVATIVES_PATH = os.path.join(DEFAULT_CACHE_PATH or os.path.join(tempfile.gettempdir(), 'rasana'), 'image-derivatives')
+
+def is_image_processing_available() -> bool:
+    return Image is not None
+
+def plan_images(node: dict, base_path: str, node_output_path: str) -> list:
+    image_resources = {r: rtype for r, rtype in node.get('resources', {}).items() if rtype == 'img'}
+    return [
+        (src, dst) for src, dst in plan_resources({'resources': image_resources}, base_path, node_output_path)
+        if os.path.splitext(src)[1].lower() in IMAGE_EXTENSIONS and not os.path.islink(src)
+    ]
+
+def get_content_hash(file_path: str) -> str:
+    # Images are only read again when their size or mtime changes
+    s = os.stat(file_path)
+    key = ResultCache.key(os.path.abspath(file_path), s.st_size, s.st_mtime_ns)
+    return get_content_hash.__cache.get_or_compute(key, lambda: hash_file(file_path))
+get_content_hash.__cache = ResultCache('image-hashes')
+
+def get_variant_widths(width: int, widths: list) -> list:
+    # Images are never enlarged, the ones narrower than the widest variant are also kept at their own width
+    return sorted({w for w in widths if w < width} | ({width} if width <= max(widths) else set()))
+
+def load_derivatives(derivatives_path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(derivatives_path, 'info.json')) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not all(os.path.isfile(os.path.join(derivatives_path, v['file'])) for v in info['variants']):
+        return None
+    try:
+        # As for the result caches, the modification time of `info.json` is the last use time for eviction
+        os.utime(os.path.join(derivatives_path, 'info.json'))
+    except OSError:
+        pass
+    return info
+
+def process_image(task: tuple) -> dict:
+    source_path, derivatives_path, widths, quality = task
+    os.makedirs(derivatives_path, exist_ok=True)
+    try:
+        with Image.open(source_path) as image:
+            # The orientation is applied to the pixels, as the metadata carrying it is not written
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+            width, height = image.size
+            variants = []
+            for w in get_variant_widths(width, widths):
+                h = max(1, round(height * w / width))
+                variant = image if w == width else image.resize((w, h), Image.LANCZOS)
+                file_name = f'{w}.webp'
+                temp_path = os.path.join(derivatives_path, f'{file_name}.{os.getpid()}.tmp')
+                variant.save(temp_path, 'WEBP', quality=quality)
+                os.replace(temp_path, os.path.join(derivatives_path, file_name))
+                variants.append({'file': file_name, 'width': w, 'height': h, 'type': 'image/webp'})
+    except OSError as e:
+        raise Exception(f'Could not process the image `{source_path}`: {e}')
+    info = {'width': width, 'height': height, 'variants': variants}
+    temp_path = os.path.join(derivatives_path, f'info.json.{os.getpid()}.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(info, f)
+    os.replace(temp_path, os.path.join(derivatives_path, 'info.json'))
+    return info
+
+def prepare_images(sources: list, widths: list, quality: int, jobs: int = 1) -> dict:
+    if Image is None:
+        return {}
+    images = {}
+    tasks = []
+    for src in sorted({os.path.abspath(e) for e in sources}):
+        key = hash_json([IMAGE_PIPELINE_VERSION, pillow_version, get_content_hash(src), sorted(widths), quality])
+        derivatives_path = os.path.join(DERIVATIVES_PATH, key[:2], key)
+        info = load_derivatives(derivatives_path)
+        if info is None:
+            tasks.append((src, derivatives_path, widths, quality))
+        else:
+            images[src] = dict(info, path=derivatives_path)
+    PROFILER.count('images cached', len(images))
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks)), mp_context=get_context('spawn')) as executor:
+            infos = list(executor.map(process_image, tasks))
+    else:
+        infos = [process_image(task) for task in tasks]
+    for task, info in zip(tasks, infos):
+        images[task[0]] = dict(info, path=task[1])
+        written_bytes = sum(os.path.getsize(os.path.join(task[1], v['file'])) for v in info['variants'])
+        record_cache_write(os.path.dirname(DERIVATIVES_PATH), written_bytes)
+    PROFILER.count('images processed', len(tasks))
+    return images
+
+def get_variant_path(dst: str, variant: dict) -> str:
+    return f'{os.path.splitext(dst)[0]}-{variant["width"]}w.webp'
+
+def describe_images(images: dict, pairs: list, output_path: str, prefix: str = '') -> dict:
+    # Paths are relative to the page for the resources of nodes, and absolute for the ones of the site
+    def url_of(path: str) -> str:
+        return prefix + os.path.relpath(path, output_path).replace(os.sep, '/')
+    result = {}
+    for src, dst in pairs:
+        info = images.get(os.path.abspath(src))
+        if info is None:
+            continue
+        variants = [
+            {'src': url_of(get_variant_path(dst, v)), 'width': v['width'], 'height': v['height'], 'type': v['type']}
+            for v in info['variants']
+        ]
+        result[url_of(dst)[len(prefix):]] = {
+            'src': url_of(dst),
+            'width': info['width'],
+            'height': info['height'],
+            'variants': variants,
+            'srcset': ', '.join(f'{v["src"]} {v["width"]}w' for v in variants)
+        }
+    return result
+
+def sync_image_variants(images: dict, pairs: list, mode: str = 'copy', compare: str = 'stat') -> list:
+    variant_files = []
+    synced = []
+    for src, dst in pairs:
+        info = images.get(os.path.abspath(src))
+        if info is None:
+            continue
+        for v in info['variants']:
+            variant_path = get_variant_path(dst, v)
+            synced.append(sync_file(os.path.join(info['path'], v['file']), variant_path, mode=mode, compare=compare))
+            variant_files.append(variant_path)
+    PROFILER.count('image variants copied', sum(synced))
+    PROFILER.count('image variants skipped', len(synced) - sum(synced))
+    return variant_files
+
+__all__ = [
+    'is_image_processing_available',
+    'plan_images',
+    'prepare_images',
+    'describe_images',
+    'sync_image_variants'
+]
@@ -0,0 +1,118 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import json
+import hashlib
+from typing import Any, Iterable
+
+MANIFEST_FILE_NAME = '.rasana-manifest.json'
+MANIFEST_VERSION = 1
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+def hash_json(o: Any) -> str:
+    return hash_bytes(json.dumps(o, sort_keys=True, ensure_ascii=False).encode('utf8'))
+
+def hash_file(file_path: str) -> str:
+    if not os.path.isfile(file_path):
+        return ''
+    with open(file_path, 'rb') as f:
+        return hash_bytes(f.read())
+
+def hash_path_signature(path: str) -> str:
+    # Resources can be large, so they are tracked by size and mtime instead of contents
+    signature = []
+    if os.path.isfile(path):
+        s = os.stat(path)
+        signature.append(('', s.st_size, s.st_mtime_ns))
+    elif os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file_name in sorted(files):
+                file_path = os.path.join(root, file_name)
+                s = os.stat(file_path)
+                signature.append((os.path.relpath(file_path, path), s.st_size, s.st_mtime_ns))
+    return hash_json(signature)
+
+def load_manifest(output_path: str) -> dict:
+    manifest_path = os.path.join(output_path, MANIFEST_FILE_NAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except ValueError:
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+def save_manifest(output_path: str, manifest: dict) -> None:
+    manifest['version'] = MANIFEST_VERSION
+    os.makedirs(output_path, exist_ok=True)
+    manifest_path = os.path.join(output_path, MANIFEST_FILE_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def is_entry_up_to_date(output_path: str, entry: dict, key: str) -> bool:
+    if not entry or entry.get('key') != key:
+        return False
+    return all(os.path.exists(os.path.join(output_path, e)) for e in entry.get('outputs', []))
+
+def remove_stale_outputs(output_path: str, previous_manifest: dict, manifest: dict) -> list:
+    def outputs_of(m: dict) -> set:
+        return {o for entry in m.get('entries', {}).values() for o in entry.get('outputs', [])}
+    stale_outputs = sorted(outputs_of(previous_manifest) - outputs_of(manifest))
+    for o in stale_outputs:
+        file_path = os.path.join(output_path, o)
+        if os.path.isfile(file_path) or os.path.islink(file_path):
+            os.remove(file_path)
+        prune_empty_directories(output_path, os.path.dirname(file_path))
+    return stale_outputs
+
+def prune_empty_directories(output_path: str, path: str) -> None:
+    output_path = os.path.abspath(output_path)
+    path = os.path.abspath(path)
+    while path != output_path and path.startswith(output_path + os.sep):
+        if not os.path.isdir(path) or os.listdir(path):
+            break
+        os.rmdir(path)
+        path = os.path.dirname(path)
+
+def relative_outputs(output_path: str, file_paths: Iterable[str]) -> list:
+    return sorted({os.path.relpath(e, output_path) for e in file_paths})
+
+__all__ = [
+    'MANIFEST_FILE_NAME',
+    'hash_bytes',
+    'hash_json',
+    'hash_file',
+    'hash_path_signature',
+    'load_manifest',
+    'save_manifest',
+    'is_entry_up_to_date',
+    'remove_stale_outputs',
+    'relative_outputs'
+]
@@ -0,0 +1,160 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class Profiler:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.phases = {}
+        self.counters = {}
+        self.events = []
+
+    @contextmanager
+    def phase(self, name: str, label: Optional[str] = None) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        start_time = time.perf_counter_ns()
+        start_cpu_time = time.process_time_ns()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter_ns() - start_time
+            cpu_time = time.process_time_ns() - start_cpu_time
+            with self.lock:
+                phase = self.phases.setdefault(name, [0, 0, 0])
+                phase[0] += 1
+                phase[1] += wall_time
+                phase[2] += cpu_time
+                self.events.append([name, label, start_time // 1000, wall_time // 1000, os.getpid(), threading.get_ident()])
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def take(self) -> dict:
+        with self.lock:
+            data = {'phases': self.phases, 'counters': self.counters, 'events': self.events}
+            self.reset()
+        return data
+
+    def merge(self, data: dict) -> None:
+        with self.lock:
+            for name, (count, wall_time, cpu_time) in data['phases'].items():
+                phase = self.phases.setdefault(name, [0, 0, 0])
+                phase[0] += count
+                phase[1] += wall_time
+                phase[2] += cpu_time
+            for name, n in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            self.events.extend(data['events'])
+
+    def get_peak_rss(self) -> dict:
+        if resource is None:
+            return {}
+        # `ru_maxrss` is reported in kilobytes on Linux and in bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return {
+            'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+        }
+
+    def get_summary(self, slowest_pages_count: int = 10) -> dict:
+        pages = sorted(
+            ([e[1], e[3] / 1e6] for e in self.events if e[0] == 'page'),
+            key=lambda e: -e[1]
+        )
+        return {
+            'phases': {
+                name: {'count': count, 'wallSeconds': wall_time / 1e9, 'cpuSeconds': cpu_time / 1e9}
+                for name, (count, wall_time, cpu_time) in sorted(self.phases.items())
+            },
+            'counters': dict(sorted(self.counters.items())),
+            'slowestPages': pages[:slowest_pages_count],
+            'peakRSS': self.get_peak_rss()
+        }
+
+    def format_summary(self) -> str:
+        summary = self.get_summary()
+        lines = [f'{"phase":<24}{"count":>10}{"wall (s)":>12}{"cpu (s)":>12}{"avg (ms)":>12}']
+        for name, phase in summary['phases'].items():
+            lines.append(
+                f'{name:<24}{phase["count"]:>10}{phase["wallSeconds"]:>12.3f}{phase["cpuSeconds"]:>12.3f}'
+                f'{phase["wallSeconds"] * 1000 / phase["count"]:>12.2f}'
+            )
+        lines.append('')
+        for name, n in summary['counters'].items():
+            lines.append(f'{name:<46}{n:>12}')
+        if summary['slowestPages']:
+            lines.append('')
+            lines.append('slowest pages (ms)')
+            for page, wall_time in summary['slowestPages']:
+                lines.append(f'  {page:<44}{wall_time * 1000:>12.2f}')
+        if summary['peakRSS']:
+            lines.append('')
+            for name, rss in summary['peakRSS'].items():
+                lines.append(f'{"peak RSS (MiB), " + name:<46}{rss / 1048576:>12.1f}')
+        return '\n'.join(lines)
+
+    def write_trace(self, trace_path: str) -> None:
+        trace = {
+            'traceEvents': [
+                {
+                    'name': name,
+                    'cat': 'rasana',
+                    'ph': 'X',
+                    'ts': ts,
+                    'dur': dur,
+                    'pid': pid,
+                    'tid': tid,
+                    'args': {'label': label} if label is not None else {}
+                }
+                for name, label, ts, dur, pid, tid in self.events
+            ],
+            'displayTimeUnit': 'ms',
+            'rasanaSummary': self.get_summary()
+        }
+        with open(trace_path, 'w') as f:
+            json.dump(trace, f)
+
+PROFILER = Profiler()
+
+__all__ = [
+    'Profiler',
+    'PROFILER'
+]
@@ -21,13 +21,21 @@
 # =================================================================================
 
 import os
-import json
-import re
+import hashlib
 from typing import Any, Callable
-from py_mini_racer import MiniRacer
+from .cache import ResultCache
+from .ejs import UnsupportedTemplate, compile_ejs_to_js, compile_python_template
+from .js_runtime import JS_RUNTIME
+from .instrumentation import PROFILER
 
 def minify_css(*a: list, **b: dict) -> Any:
-    return minify_css.__context.call("csso.minify", *a, **b)
+    key = minify_css.__cache.key(JS_RUNTIME.get_bundle_version('csso'), a, b)
+    return minify_css.__cache.get_or_compute(
+        key,
+        lambda: JS_RUNTIME.call('minify css', f'{JS_RUNTIME.load_bundle("csso")}.minify', *a, **b)
+    )
+# Cached results are only valid for the very same minifier bundle
+minify_css.__cache = ResultCache('minify-css')
 
 def minify_js(*a: list, **b: dict) -> Any:
     o = {
@@ -44,83 +52,101 @@ def minify_js(*a: list, **b: dict) -> Any:
         }
     }
     o.update(b)
-    return minify_js.__context.call("minify", *a, o)
+    key = minify_js.__cache.key(JS_RUNTIME.get_bundle_version('uglify'), a, o)
+    return minify_js.__cache.get_or_compute(
+        key,
+        lambda: JS_RUNTIME.call('minify js', f'{JS_RUNTIME.load_bundle("uglify")}.minify', *a, o)
+    )
+minify_js.__cache = ResultCache('minify-js')
 
-minify_css.__context = MiniRacer()
-with open(os.path.join(os.path.dirname(__file__), './js/csso.min.js')) as f:
-    minify_css.__context.eval(f.read())
-minify_js.__context = MiniRacer()
-with open(os.path.join(os.path.dirname(__file__), './js/uglifyjs3.min.js')) as f:
-    minify_js.__context.eval(f.read())
+def get_minify_cache_stats() -> dict:
+    return {
+        'css': minify_css.__cache.stats(),
+        'js': minify_js.__cache.stats()
+    }
 
 def compile_ejs_template(template: str) -> Callable:
-    def render(context: dict) -> str:
-        return render.__context.call('render', context)
-    render.__context = MiniRacer()
-    def string_literal(text):
-        return json.dumps(text)
-    compiled_template = ''
-    remove_succeeding_ws = False
-    remove_succeeding_nl = False
-    i = 0
-    result = ''
-    for m in re.finditer('<%[^%].*?%>', template):
-        code = m.group()
-        operation = 0 # Add code to execution pipeline
-        remove_preceding_ws = False
-        escape_code_output = False
-        left_offset = 3
-        right_offset = -3
-        text = template[i:m.start()]
-        if remove_succeeding_nl:
-            text = text.lstrip('\n')
-        elif remove_succeeding_ws:
-            text = text.lstrip()
-        remove_succeeding_ws = False
-        remove_succeeding_nl = False
-        if code[2] == '=':
-            operation = 1
-        elif code[2] == '-':
-            operation = 1
-            escape_code_output = True
-        elif code[3] == '#':
-            operation = 2 # No operation
-        elif code[3] == '_':
-            remove_preceding_ws = True
-        else:
-            left_offset = 2
-        if code[-3] == '-':
-            remove_succeeding_nl = True
-        elif code[-3] == '_':
-            remove_succeeding_ws = True
-        else:
-            right_offset = -2
-        if remove_preceding_ws:
-            text = text.rstrip()
-        compiled_template += f'result+={string_literal(text)};'
-        if operation == 1:
-            if escape_code_output:
-                compiled_template += f'result+=escapeForHtml({code[left_offset:right_offset]});'
-            else:
-                compiled_template += f'result+={code[left_offset:right_offset]};'
-        elif operation == 2:
-            pass
-        else:
-            compiled_template += f'{code[left_offset:right_offset]};'
-        i = m.end()
-    if i < len(template):
-        compiled_template += f'result+={string_literal(template[i:])};'
-    render.__context.eval(
-        compile_ejs_template.__compiled_ejs_template.replace(
+    # Templates share one context, each one is a namespace holding its own helpers and shared context
+    template_id = hashlib.sha1(template.encode('utf8')).hexdigest()
+    template_object = JS_RUNTIME.load_template(
+        template_id,
+        '(function () {\n' + compile_ejs_template.__compiled_ejs_template.replace(
             '// body_of_rendered_ejs_function',
-            compiled_template
-        )
+            compile_ejs_to_js(template)
+        ) + '\nreturn {setSharedContext, renderPage, renderCopiedPage};\n})()'
     )
+    def render(context: dict) -> str:
+        set_shared_context(context)
+        return render_page(context)
+    def set_shared_context(context: dict) -> None:
+        JS_RUNTIME.call('template context', f'{template_object}.setSharedContext', context)
+    def render_page(context: dict) -> str:
+        html = JS_RUNTIME.call('template render', f'{template_object}.renderPage', context)
+        if html is None:
+            PROFILER.count('pages with copied specs')
+            html = JS_RUNTIME.call('template render', f'{template_object}.renderCopiedPage', context)
+        return html
+    def unload() -> None:
+        JS_RUNTIME.unload_template(template_id)
+    render.set_shared_context = set_shared_context
+    render.render_page = render_page
+    render.unload = unload
     return render
 with open(os.path.join(os.path.dirname(__file__), './js/compiled_ejs_template.js')) as f:
     compile_ejs_template.__compiled_ejs_template = f.read()
 
+def compile_checked_template(template: str) -> Callable:
+    # Renders with both engines and fails on the first page they disagree on
+    v8_renderer = compile_ejs_template(template)
+    python_renderer = compile_python_template(template)
+    def check(render_v8: Callable, render_python: Callable) -> str:
+        try:
+            expected = render_v8()
+        except Exception as e:
+            try:
+                render_python()
+            except Exception:
+                raise e
+            raise Exception(f'Only the V8 engine failed to render the template: {e}')
+        try:
+            actual = render_python()
+        except Exception as e:
+            raise Exception(f'Only the Python engine failed to render the template: {e}')
+        if actual != expected:
+            i = next((i for i, (a, b) in enumerate(zip(actual, expected)) if a != b), min(len(actual), len(expected)))
+            raise Exception(
+                f'The template engines disagree at offset {i}: '
+                f'V8 renders {expected[max(0, i - 40):i + 40]!r}, Python renders {actual[max(0, i - 40):i + 40]!r}'
+            )
+        return expected
+    def render(context: dict) -> str:
+        return check(lambda: v8_renderer(context), lambda: python_renderer(context))
+    def set_shared_context(context: dict) -> None:
+        v8_renderer.set_shared_context(context)
+        python_renderer.set_shared_context(context)
+    def render_page(context: dict) -> str:
+        return check(lambda: v8_renderer.render_page(context), lambda: python_renderer.render_page(context))
+    render.set_shared_context = set_shared_context
+    render.render_page = render_page
+    render.unload = v8_renderer.unload
+    return render
+
+def compile_template(template: str, engine: str = 'v8') -> Callable:
+    if engine == 'v8':
+        return compile_ejs_template(template)
+    if engine == 'check':
+        return compile_checked_template(template)
+    try:
+        return compile_python_template(template)
+    except UnsupportedTemplate as e:
+        if engine == 'python':
+            raise Exception(f'The template cannot be rendered by the Python engine: {e}')
+        # Templates using JavaScript beyond what the Python engine understands stay on V8
+        return compile_ejs_template(template)
+
 __all__ = [
     'minify_css',
-    'minify_js'
+    'minify_js',
+    'get_minify_cache_stats',
+    'compile_template'
 ]
@@ -59,12 +59,57 @@ function convertDates(o) {
             convertDates(o[k]);
     }
 }
-function render({websiteSpecs, themeSpecs, items, nodeSpecs, breadCrumb}) {
+function deepFreeze(o) {
+    if(o instanceof Object && !Object.isFrozen(o)) {
+        Object.freeze(o);
+        Object.values(o).forEach(deepFreeze);
+    }
+    return o;
+}
+function copyValue(o) {
+    if(!(o instanceof Object) || typeof o === 'function')
+        return o;
+    if(Array.isArray(o))
+        return o.map(copyValue);
+    const copy = Object.create(Object.getPrototypeOf(o));
+    for(const k of Object.keys(o))
+        copy[k] = copyValue(o[k]);
+    return copy;
+}
+var sharedContext = {};
+function setSharedContext({websiteSpecs, themeSpecs, items}) {
     convertDates(websiteSpecs);
     convertDates(themeSpecs);
-    convertDates(nodeSpecs);
     convertDates(items);
+    // Every page sees the same objects, so none of them may change what the next page sees
+    sharedContext = deepFreeze({websiteSpecs, themeSpecs, items});
+    // MiniRacer cannot convert `undefined` back to Python
+    return true;
+}
+// Returns `null` when the template fails on the shared objects, the page is then rendered by `renderCopiedPage`
+function renderPage({nodeSpecs, baseURL, breadCrumb}) {
+    if(renderSharedTemplate === null)
+        return null;
+    convertDates(nodeSpecs);
+    try {
+        return renderSharedTemplate({...sharedContext, nodeSpecs, baseURL, breadCrumb});
+    } catch(e) {
+        return null;
+    }
+}
+// Templates changing the specs get copies of them, as they did when every page received its own
+function renderCopiedPage({nodeSpecs, baseURL, breadCrumb}) {
+    convertDates(nodeSpecs);
+    return renderTemplate({...copyValue(sharedContext), nodeSpecs, baseURL, breadCrumb});
+}
+function renderTemplate({websiteSpecs, themeSpecs, items, nodeSpecs, baseURL, breadCrumb}) {
     let result='';
     // body_of_rendered_ejs_function
     return result;
-}
\ No newline at end of file
+}
+// In strict mode writing to a frozen object throws instead of being silently ignored
+var renderSharedTemplate = null;
+try {
+    renderSharedTemplate = eval('(function () { "use strict"; return ' + renderTemplate.toString() + '; })()');
+} catch(e) {
+}
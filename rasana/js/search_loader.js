@@ -0,0 +1,82 @@
+(function () {
+    // Mirrors `normalize_text` and `tokenize` of `rasana/search.py`, they must change together
+    const CHARACTER_MAP = {'\u064a': '\u06cc', '\u0649': '\u06cc', '\u0643': '\u06a9'};
+    const FOLDED_RE = /[\u064a\u0649\u0643\u0640\u0670\u064b-\u0652]/g;
+    const DIGIT_RE = /[\u06f0-\u06f9\u0660-\u0669]/g;
+    const WORD_RE = /[\p{L}\p{N}]+(?:\u200c[\p{L}\p{N}]+)*/gu;
+    const script = document.currentScript;
+    const baseURL = script ? script.src.replace(/[^\/]*$/, '') : '/search/';
+    let index = null;
+    const shards = {};
+    function fetchJSON(url) {
+        return fetch(url).then(response => {
+            if (!response.ok)
+                throw new Error(`Could not load \`${url}\``);
+            return response.json();
+        });
+    }
+    function normalizeText(text) {
+        return text.normalize('NFKC')
+            .replace(FOLDED_RE, c => CHARACTER_MAP[c] || '')
+            .replace(DIGIT_RE, c => String(c.charCodeAt(0) & 0xf))
+            .toLowerCase();
+    }
+    function tokenize(text) {
+        return (normalizeText(text).match(WORD_RE) || [])
+            .map(word => word.split('\u200c').join(''))
+            .filter(token => Array.from(token).length > 1);
+    }
+    function loadIndex() {
+        if (index === null)
+            index = fetchJSON(baseURL + 'index.json');
+        return index;
+    }
+    function getShardName(token, prefixLength) {
+        const prefix = Array.from(token).slice(0, prefixLength).join('');
+        return Array.from(new TextEncoder().encode(prefix), b => b.toString(16).padStart(2, '0')).join('');
+    }
+    function loadShard(meta, name) {
+        if (!(name in meta.shards))
+            return Promise.resolve({});
+        if (!(name in shards))
+            shards[name] = fetchJSON(`${baseURL}shards/${name}.json?v=${meta.shards[name]}`);
+        return shards[name];
+    }
+    // Every word of the query must appear in a result, the last one may be a prefix as it may still be typed
+    function search(query, limit = 20) {
+        const tokens = tokenize(query);
+        if (!tokens.length)
+            return Promise.resolve([]);
+        return loadIndex().then(meta => Promise.all(
+            tokens.map(token => loadShard(meta, getShardName(token, meta.prefixLength)))
+        ).then(loadedShards => {
+            let scores = null;
+            tokens.forEach((token, i) => {
+                const isPrefix = i === tokens.length - 1;
+                const tokenScores = {};
+                for (const term in loadedShards[i]) {
+                    if (term !== token && !(isPrefix && term.startsWith(token)))
+                        continue;
+                    const postings = loadedShards[i][term];
+                    const idf = Math.log(1 + meta.documentCount / (postings.length / 2));
+                    for (let j = 0; j < postings.length; j += 2)
+                        tokenScores[postings[j]] = (tokenScores[postings[j]] || 0) + postings[j + 1] * idf;
+                }
+                if (scores === null) {
+                    scores = tokenScores;
+                    return;
+                }
+                const merged = {};
+                for (const id in scores)
+                    if (id in tokenScores)
+                        merged[id] = scores[id] + tokenScores[id];
+                scores = merged;
+            });
+            return Object.keys(scores)
+                .sort((a, b) => scores[b] - scores[a])
+                .slice(0, limit)
+                .map(id => ({url: meta.documents[id][0], title: meta.documents[id][1], score: scores[id]}));
+        }));
+    }
+    window.rasanaSearch = {search, tokenize};
+})();
@@ -0,0 +1,144 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import time
+import json
+import hashlib
+import threading
+from typing import Any, Optional
+from .instrumentation import PROFILER
+
+BUNDLES_PATH = os.path.join(os.path.dirname(__file__), 'js')
+# Every bundle is evaluated inside a function, so its globals never collide with the other bundles or the templates
+BUNDLES = {
+    'csso': ('csso.min.js', 'csso'),
+    'uglify': ('uglifyjs3.min.js', '{minify}')
+}
+
+class JsRuntime:
+    # A single V8 context, started on first use, hosting the minifiers and every compiled template
+    def __init__(self) -> None:
+        self.context = None
+        self.lock = threading.RLock()
+        self.loaded = set()
+        # Templates with the same source share one namespace, which is deleted once none of them is in use
+        self.template_references = {}
+        self.startup_seconds = None
+        self.load_seconds = {}
+        self.versions = {}
+
+    def start(self) -> Any:
+        with self.lock:
+            if self.context is None:
+                with PROFILER.phase('js runtime startup'):
+                    start_time = time.perf_counter()
+                    # Importing the binding alone takes a noticeable time, so it waits for the first use too
+                    from py_mini_racer import MiniRacer
+                    self.context = MiniRacer()
+                    self.context.eval('var __rasana = {bundles: {}, templates: {}};')
+                    self.startup_seconds = time.perf_counter() - start_time
+            return self.context
+
+    def load(self, name: str, source: str, category: Optional[str] = None) -> None:
+        with self.lock:
+            if name in self.loaded:
+                return
+            context = self.start()
+            with PROFILER.phase('js runtime load', name):
+                start_time = time.perf_counter()
+                context.eval(source)
+                category = category or name
+                self.load_seconds[category] = self.load_seconds.get(category, 0) + time.perf_counter() - start_time
+            self.loaded.add(name)
+
+    def get_bundle_source(self, name: str) -> str:
+        with open(os.path.join(BUNDLES_PATH, BUNDLES[name][0])) as f:
+            return f.read()
+
+    def get_bundle_version(self, name: str) -> str:
+        if name not in self.versions:
+            self.versions[name] = hashlib.sha1(self.get_bundle_source(name).encode('utf8')).hexdigest()
+        return self.versions[name]
+
+    def load_bundle(self, name: str) -> str:
+        if name not in self.loaded:
+            file_name, exports = BUNDLES[name]
+            self.load(name, f'__rasana.bundles.{name} = (function () {{\n{self.get_bundle_source(name)}\n;return {exports};\n}})();')
+        return f'__rasana.bundles.{name}'
+
+    def load_template(self, template_id: str, source: str) -> str:
+        with self.lock:
+            self.load(f'template:{template_id}', f'__rasana.templates[{json.dumps(template_id)}] = {source};', 'templates')
+            self.template_references[template_id] = self.template_references.get(template_id, 0) + 1
+        return f'__rasana.templates[{json.dumps(template_id)}]'
+
+    def unload_template(self, template_id: str) -> None:
+        with self.lock:
+            references = self.template_references.get(template_id, 0) - 1
+            if references > 0:
+                self.template_references[template_id] = references
+                return
+            self.template_references.pop(template_id, None)
+            name = f'template:{template_id}'
+            if name in self.loaded:
+                self.context.eval(f'delete __rasana.templates[{json.dumps(template_id)}];')
+                self.loaded.discard(name)
+
+    def call(self, phase: str, function: str, *a: Any, **b: Any) -> Any:
+        with self.lock:
+            context = self.start()
+            PROFILER.count('v8 calls')
+            with PROFILER.phase(phase):
+                return context.call(function, *a, **b)
+
+    def stats(self) -> dict:
+        with self.lock:
+            if self.context is None:
+                return {'started': False}
+            return {
+                'started': True,
+                'startupSeconds': self.startup_seconds,
+                'loadSeconds': dict(self.load_seconds),
+                'bundles': sorted(n for n in self.loaded if n in BUNDLES),
+                'templates': sum(1 for n in self.loaded if n.startswith('template:')),
+                'heap': self.context.heap_stats()
+            }
+
+    def format_stats(self) -> str:
+        stats = self.stats()
+        if not stats['started']:
+            return 'JS runtime not started'
+        lines = [f'{"JS runtime startup (ms)":<46}{stats["startupSeconds"] * 1000:>12.2f}']
+        for name, load_time in sorted(stats['loadSeconds'].items()):
+            lines.append(f'{"JS runtime load (ms), " + name:<46}{load_time * 1000:>12.2f}')
+        lines.append(f'{"JS runtime templates":<46}{stats["templates"]:>12}')
+        lines.append(f'{"JS runtime heap used (MiB)":<46}{stats["heap"]["used_heap_size"] / 1048576:>12.1f}')
+        lines.append(f'{"JS runtime heap total (MiB)":<46}{stats["heap"]["total_heap_size"] / 1048576:>12.1f}')
+        return '\n'.join(lines)
+
+JS_RUNTIME = JsRuntime()
+
+__all__ = [
+    'JsRuntime',
+    'JS_RUNTIME'
+]
@@ -21,14 +21,22 @@
 # =================================================================================
 
 import re
-from typing import Any
-from pygments import highlight
+import hashlib
+from typing import Any, Optional
+from pygments import highlight, __version__ as pygments_version
+from pygments.lexer import Lexer
 from pygments.lexers import get_lexer_by_name
 from pygments.formatters import HtmlFormatter
+from pygments.util import ClassNotFound
 from commonmark import inlines
 from commonmark.node import Node
 from commonmark.inlines import InlineParser as OldInlineParser, text
 from commonmark import Parser as OldParser, HtmlRenderer as OldHtmlRenderer
+from .cache import ResultCache
+
+with open(__file__, 'rb') as f:
+    # Cached results are only valid for the very same renderer and highlighter
+    RENDERER_VERSION = [hashlib.sha1(f.read()).hexdigest(), pygments_version]
 
 reTexCode = re.compile(r'(\$\$?)(?:[^$]|\\\$)*\1')
 class InlineParser(OldInlineParser):
@@ -46,25 +54,55 @@ class Parser(OldParser):
         super().__init__(options=options)
         self.inline_parser = InlineParser(options=options)
 
+def get_lexer(language: str) -> Optional[Lexer]:
+    if language not in get_lexer.__lexers:
+        try:
+            get_lexer.__lexers[language] = get_lexer_by_name(language)
+        except ClassNotFound:
+            get_lexer.__lexers[language] = None
+    return get_lexer.__lexers[language]
+get_lexer.__lexers = {}
+
+def highlight_code(code: str, language: str) -> Optional[str]:
+    lexer = get_lexer(language) if language else None
+    if lexer is None:
+        return None
+    key = highlight_code.__cache.key(RENDERER_VERSION, language, code)
+    return highlight_code.__cache.get_or_compute(
+        key,
+        lambda: highlight(code, lexer, highlight_code.__formatter)
+    )
+highlight_code.__formatter = HtmlFormatter()
+highlight_code.__cache = ResultCache('highlight')
+
 class HtmlRenderer(OldHtmlRenderer):
     def code_block(self, node, entering):
+        info_words = node.info.split() if node.info else []
+        highlighted_code = highlight_code(node.literal, info_words[0] if info_words else '')
+        if highlighted_code is None:
+            # Unknown or missing languages are rendered as a plain block
+            return super().code_block(node, entering)
         self.cr()
-        self.lit(
-            highlight(
-                node.literal,
-                get_lexer_by_name(node.info),
-                HtmlFormatter()
-            )
-        )
+        self.lit(highlighted_code)
         self.cr()
 
 def render(markdown_file_path: str) -> str:
-    ast = None
     with open(markdown_file_path) as f:
-        ast = render.__parser.parse(f.read())
-    return render.__html.render(ast)
+        markdown = f.read()
+    key = render.__cache.key(RENDERER_VERSION, markdown)
+    return render.__cache.get_or_compute(
+        key,
+        lambda: render.__html.render(render.__parser.parse(markdown))
+    )
 render.__parser = Parser({})
 render.__html = HtmlRenderer({})
+render.__cache = ResultCache('markdown', max_memory_entries=256)
+
+def get_markdown_cache_stats() -> dict:
+    return {
+        'markdown': render.__cache.stats(),
+        'highlight': highlight_code.__cache.stats()
+    }
 
 def get_stylesheet() -> str:
     return HtmlFormatter().get_style_defs()
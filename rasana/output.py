@@ -0,0 +1,91 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import json
+from typing import Iterable
+from .incremental import hash_bytes
+from .instrumentation import PROFILER
+
+DELTA_FILE_NAME = '.rasana-delta.json'
+
+def has_contents(file_path: str, data: bytes) -> bool:
+    try:
+        if os.path.getsize(file_path) != len(data):
+            return False
+        with open(file_path, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+def write_output(file_path: str, data: bytes) -> str:
+    # Unchanged outputs keep their mtime, so deploys relying on it do not upload them again
+    if has_contents(file_path, data):
+        PROFILER.count('outputs unchanged')
+    else:
+        temp_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, file_path)
+        PROFILER.count('outputs written')
+        PROFILER.count('bytes written', len(data))
+    return hash_bytes(data)
+
+def get_output_signature(file_path: str) -> str:
+    # Copied files are recognized by their size and mtime, as their contents can be large
+    s = os.lstat(file_path)
+    return f'{s.st_size}:{s.st_mtime_ns}'
+
+def get_output_signatures(output_path: str, file_paths: Iterable[str]) -> dict:
+    return {os.path.relpath(e, output_path): get_output_signature(e) for e in file_paths}
+
+def compute_delta(previous_manifest: dict, manifest: dict) -> dict:
+    def digests_of(m: dict) -> dict:
+        digests = {}
+        for entry in m.get('entries', {}).values():
+            for o in entry.get('outputs', []):
+                digests[o] = entry.get('digests', {}).get(o)
+        return digests
+    previous_digests = digests_of(previous_manifest)
+    digests = digests_of(manifest)
+    return {
+        'added': sorted(digests.keys() - previous_digests.keys()),
+        'changed': sorted(
+            o for o in digests.keys() & previous_digests.keys()
+            if digests[o] is None or digests[o] != previous_digests[o]
+        ),
+        'removed': sorted(previous_digests.keys() - digests.keys())
+    }
+
+def save_delta(output_path: str, delta: dict) -> None:
+    delta_path = os.path.join(output_path, DELTA_FILE_NAME)
+    with open(delta_path + '.tmp', 'w') as f:
+        json.dump(delta, f, ensure_ascii=False, indent=1)
+    os.replace(delta_path + '.tmp', delta_path)
+
+__all__ = [
+    'DELTA_FILE_NAME',
+    'write_output',
+    'get_output_signatures',
+    'compute_delta',
+    'save_delta'
+]
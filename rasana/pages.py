@@ -0,0 +1,342 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import io
+import os
+import re
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from typing import Callable, Iterable, Optional
+from .markdown import render as render_markdown
+from .js import compile_template
+from .postprocess import postprocess_html_tree, postprocess_html_stream
+from .incremental import hash_bytes, hash_json, hash_file, hash_path_signature, is_entry_up_to_date, relative_outputs
+from .resources import sync_resources
+from .output import write_output, get_output_signatures
+from .search import get_search_document
+from .images import plan_images, describe_images, sync_image_variants
+from .instrumentation import PROFILER
+
+def get_file_contents(file_path: str) -> str:
+    with open(file_path) as f:
+        return f.read()
+
+def get_template_source(theme_specs: dict, template_name: str) -> str:
+    template_path = os.path.join(theme_specs['base_path'], theme_specs['templates'][template_name])
+    if template_path not in get_template_source.__sources:
+        get_template_source.__sources[template_path] = get_file_contents(template_path)
+    return get_template_source.__sources[template_path]
+get_template_source.__sources = {}
+
+def get_template_renderer(site: dict, template_name: str) -> Callable:
+    theme_specs = site['theme_specs']
+    template_path = os.path.join(theme_specs['base_path'], theme_specs['templates'][template_name])
+    engine = site.get('template_engine') or theme_specs.get('templateEngine', 'v8')
+    if get_template_renderer.__templates.get(template_path, (None, None))[0] != engine:
+        if template_path in get_template_renderer.__templates:
+            get_template_renderer.__templates[template_path][1].unload()
+        with PROFILER.phase('template compile', template_name):
+            get_template_renderer.__templates[template_path] = engine, compile_template(
+                get_template_source(theme_specs, template_name),
+                engine
+            )
+        get_template_renderer.__shared_keys.pop(template_path, None)
+    renderer = get_template_renderer.__templates[template_path][1]
+    # The site-wide globals are sent to the engine once per template instead of once per page
+    if get_template_renderer.__shared_keys.get(template_path) != site['shared_key']:
+        renderer.set_shared_context({
+            'websiteSpecs': site['website_specs'],
+            'themeSpecs': theme_specs,
+            'items': site['items']
+        })
+        get_template_renderer.__shared_keys[template_path] = site['shared_key']
+    return renderer
+get_template_renderer.__templates = {}
+get_template_renderer.__shared_keys = {}
+
+def forget_template(template_path: str) -> None:
+    template_path = os.path.abspath(template_path)
+    # The compiled templates are dropped from the JS runtime too, so editing a theme does not grow it
+    for k, (_, renderer) in get_template_renderer.__templates.items():
+        if os.path.abspath(k) == template_path:
+            renderer.unload()
+    for cache in [get_template_source.__sources, get_template_renderer.__templates, get_template_renderer.__shared_keys]:
+        for k in [k for k in cache if os.path.abspath(k) == template_path]:
+            del cache[k]
+
+def copy_resources(node: dict, base_path: str, node_output_path: str, mode: str = 'copy', compare: str = 'stat') -> list:
+    return sync_resources(node, base_path, node_output_path, mode=mode, compare=compare)
+
+def get_resources_key(node: dict, base_path: str) -> str:
+    return hash_json({
+        r: [rtype, hash_path_signature(os.path.join(base_path, r))]
+        for r, rtype in node.get('resources', {}).items()
+    })
+
+def get_inline_asset_href(site: dict, kind: str, contents: Optional[str]) -> Optional[str]:
+    # Blocks repeated by the templates are shared between pages by naming them after their contents
+    if not contents:
+        return None
+    data = contents.encode('utf8')
+    if len(data) < site['inline_asset_threshold']:
+        return None
+    return f'/{kind}/{hash_bytes(data)[:20]}.{kind}'
+
+def get_shared_assets(entries: Iterable) -> set:
+    counts = Counter(asset_path for entry in entries for asset_path in entry.get('inlineAssets', []))
+    return {asset_path for asset_path, count in counts.items() if count > 1}
+
+def has_shared_assets(shared_assets: set, entry: dict) -> bool:
+    # Pages must have extracted exactly the blocks that are shared now
+    return all((asset_path in shared_assets) == (asset_path in entry['digests']) for asset_path in entry.get('inlineAssets', []))
+
+def get_page_entry_id(site: dict, node_output_path: str, html_file_name: Optional[str] = 'index') -> str:
+    return os.path.relpath(os.path.join(node_output_path, f'{html_file_name}.html'), site['output_path'])
+
+def build_node_contents(site: dict, node: dict, base_path: str, node_output_path: str, relative_url: str, html_file_name: Optional[str] = 'index') -> tuple:
+    with PROFILER.phase('page', get_page_entry_id(site, node_output_path, html_file_name)):
+        return render_node_contents(site, node, base_path, node_output_path, relative_url, html_file_name)
+
+def get_page_entry(site: dict, node: dict, base_path: str, node_output_path: str, relative_url: str, html_file_name: Optional[str] = 'index') -> tuple:
+    # Returns the previous entry of the page as well, when it is still up to date
+    website_path = site['website_path']
+    output_path = site['output_path']
+    node = dict(node, template=node.get('template', 'default'))
+    entry_id = get_page_entry_id(site, node_output_path, html_file_name)
+    template_source = get_template_source(site['theme_specs'], node['template'])
+    with PROFILER.phase('check inputs'):
+        entry_key = hash_json({
+            'relativeURL': relative_url,
+            'nodeSpecs': node,
+            'template': hash_bytes(template_source.encode('utf8')),
+            'items': site['items_key'] if re.search(r'\bitems\b', template_source) else None,
+            'siteImages': site.get('site_images_key') if re.search(r'\bimages\b', template_source) else None,
+            'markdowns': {
+                var_name: hash_file(os.path.join(website_path, base_path, file_name))
+                for var_name, file_name in node.get('markdowns', {}).items()
+            },
+            'inlineStyles': hash_file(os.path.join(website_path, base_path, node['inlineStyles']))\
+                if 'inlineStyles' in node else None,
+            'resources': get_resources_key(node, base_path)
+        })
+    url = f'{site["base_url"]}/{relative_url}'
+    previous_entry = site['previous_entries'].get(entry_id)
+    return url, entry_id, entry_key, previous_entry if is_entry_up_to_date(output_path, previous_entry, entry_key) else None
+
+def render_node_contents(site: dict, node: dict, base_path: str, node_output_path: str, relative_url: str, html_file_name: Optional[str] = 'index') -> tuple:
+    # TODO: Warn the inconsistency if `relative_url` is not empty
+    website_path = site['website_path']
+    output_path = site['output_path']
+    base_url = site['base_url']
+    url, entry_id, entry_key, previous_entry = get_page_entry(site, node, base_path, node_output_path, relative_url, html_file_name)
+    if previous_entry is not None:
+        PROFILER.count('pages skipped')
+        return url, entry_id, previous_entry
+    # The specs are shared with `items`, so they must not be changed while rendering
+    node = dict(node)
+    if 'template' not in node:
+        node['template'] = 'default'
+    extra_stylesheets = []
+    if 'extraStylesheets' in node:
+        extra_stylesheets = list(node['extraStylesheets'])
+    PROFILER.count('pages rendered')
+    md_vars = {}
+    if 'markdowns' in node:
+        for var_name, file_name in node['markdowns'].items():
+            contents_markdown = os.path.join(website_path, base_path, file_name)
+            if os.path.isfile(contents_markdown):
+                with PROFILER.phase('markdown', contents_markdown):
+                    md_vars[var_name] = render_markdown(contents_markdown)
+            else:
+                # TODO: Warn the inconsistency
+                pass
+        node['variables'] = dict(node.get('variables', {}))
+        node['variables'].update(md_vars)
+        extra_stylesheets.append('markdown')
+    image_pairs = []
+    if site.get('image_widths'):
+        image_pairs = plan_images(node, base_path, node_output_path)
+        node['images'] = describe_images(site['images'], image_pairs, node_output_path)
+    html_renderer = get_template_renderer(site, node['template'])
+    html = html_renderer.render_page({
+        'baseURL': base_url,
+        'nodeSpecs': node,
+        'breadCrumb': [e for e in relative_url.split('/') if e]
+    })
+    inline_styles = None
+    if 'inlineStyles' in node:
+        inline_styles = get_file_contents(
+            os.path.join(
+                website_path, base_path,
+                node['inlineStyles']
+            )
+        )
+    inline_assets = []
+    find_asset = None
+    if site.get('inline_asset_threshold') is not None:
+        find_asset = lambda kind, contents: get_inline_asset_href(site, kind, contents)
+    with PROFILER.phase('postprocess'):
+        if site.get('html_processor') == 'bs4':
+            page = postprocess_html_tree(html, extra_stylesheets, inline_styles, find_asset, inline_assets)
+        else:
+            buffer = io.BytesIO()
+            postprocess_html_stream(html, extra_stylesheets, inline_styles, buffer, find_asset, inline_assets)
+            page = buffer.getvalue()
+        page_path = os.path.join(node_output_path, f'{html_file_name}.html')
+        page_digest = None
+        if inline_assets:
+            # Set aside until every page is rendered, `extract_shared_assets` writes the page then
+            with open(f'{page_path}.pending', 'wb') as f:
+                f.write(page)
+        else:
+            page_digest = write_output(page_path, page)
+    with PROFILER.phase('copy resources'):
+        resource_files = copy_resources(
+            node, base_path, node_output_path,
+            mode=site.get('resource_mode', 'copy'),
+            compare=site.get('resource_compare', 'stat')
+        )
+        resource_files += sync_image_variants(
+            site.get('images', {}), image_pairs,
+            mode=site.get('resource_mode', 'copy'),
+            compare=site.get('resource_compare', 'stat')
+        )
+    entry = {
+        'key': entry_key,
+        'outputs': [entry_id] + relative_outputs(output_path, resource_files),
+        'digests': dict(get_output_signatures(output_path, resource_files), **{entry_id: page_digest})
+    }
+    if find_asset is not None:
+        entry['inlineAssets'] = sorted({href[1:] for href, *_ in inline_assets})
+    if inline_assets:
+        entry['pendingAssets'] = inline_assets
+    if site.get('search_index') and html_file_name == 'index' and node.get('searchable', True):
+        with PROFILER.phase('search document'):
+            entry['search'] = get_search_document(
+                f'{base_url}/{os.path.dirname(entry_id)}', node, html, md_vars
+            )
+    return url, entry_id, entry
+
+def init_page_worker(site: dict, template_names: list) -> None:
+    build_page_in_worker.__site = site
+    PROFILER.enabled = site.get('profile', False)
+    # Warm up the template contexts before the first page arrives
+    for template_name in template_names:
+        get_template_renderer(site, template_name)
+
+def build_page_in_worker(task: tuple) -> tuple:
+    result = build_node_contents(build_page_in_worker.__site, *task)
+    # Measurements travel back with the results, so the parent can report the whole build
+    return result, PROFILER.take() if PROFILER.enabled else None
+build_page_in_worker.__site = None
+
+def build_pages(site: dict, tasks: list, jobs: int = 1) -> list:
+    if jobs <= 1 or len(tasks) <= 1:
+        return [build_node_contents(site, *task) for task in tasks]
+    # Up-to-date pages are found here, so unchanged sites never pay for starting the workers
+    results = []
+    for task in tasks:
+        url, entry_id, _, previous_entry = get_page_entry(site, *task)
+        if previous_entry is not None:
+            PROFILER.count('pages skipped')
+        results.append((url, entry_id, previous_entry) if previous_entry is not None else None)
+    stale = [i for i, result in enumerate(results) if result is None]
+    site = dict(site, previous_entries={})
+    for i, result in zip(stale, render_pages(site, [tasks[i] for i in stale], jobs)):
+        results[i] = result
+    return results
+
+def finish_page(site: dict, entry_id: str, entry: dict, shared_assets: set, asset_digests: dict) -> dict:
+    output_path = site['output_path']
+    entry = dict(entry)
+    page_path = os.path.join(output_path, entry_id)
+    with open(f'{page_path}.pending', 'rb') as f:
+        page = f.read()
+    os.remove(f'{page_path}.pending')
+    page_assets = {}
+    # Later blocks are replaced first, so the recorded offsets of the earlier ones stay valid
+    for href, start, contents_start, contents_end, end, extracted in reversed(entry.pop('pendingAssets')):
+        asset_path = href[1:]
+        if asset_path not in shared_assets:
+            # A block only one page has costs an extra request and saves nothing
+            continue
+        if asset_path not in asset_digests:
+            os.makedirs(os.path.join(output_path, os.path.dirname(asset_path)), exist_ok=True)
+            asset_digests[asset_path] = write_output(os.path.join(output_path, asset_path), page[contents_start:contents_end])
+            PROFILER.count('inline assets extracted')
+        page_assets[asset_path] = asset_digests[asset_path]
+        page = page[:start] + extracted.encode('utf8', 'xmlcharrefreplace') + page[end:]
+    entry['outputs'] = [entry_id] + sorted(page_assets) + entry['outputs'][1:]
+    entry['digests'] = dict(entry['digests'], **page_assets, **{entry_id: write_output(page_path, page)})
+    return entry
+
+def extract_shared_assets(site: dict, tasks: list, entries: dict, jobs: int = 1) -> None:
+    # Which blocks are shared is only known once every page is rendered, the rendered pages are then finished from
+    # what their post-processing recorded, without running their templates again
+    shared_assets = get_shared_assets(entries.values())
+    asset_digests = {}
+    with PROFILER.phase('inline assets'):
+        for entry_id, entry in list(entries.items()):
+            if 'pendingAssets' in entry:
+                entries[entry_id] = finish_page(site, entry_id, entry, shared_assets, asset_digests)
+    # Unchanged pages only have to change when a block of theirs became shared or stopped being shared
+    stale_tasks = [
+        task for task in tasks
+        if not has_shared_assets(shared_assets, entries[get_page_entry_id(site, task[2], *task[4:])])
+    ]
+    for _, entry_id, entry in render_pages(dict(site, previous_entries={}), stale_tasks, jobs):
+        entries[entry_id] = finish_page(site, entry_id, entry, shared_assets, asset_digests) if 'pendingAssets' in entry else entry
+
+def render_pages(site: dict, tasks: list, jobs: int) -> list:
+    if len(tasks) <= 1:
+        return [build_node_contents(site, *task) for task in tasks]
+    template_names = sorted({task[0].get('template', 'default') for task in tasks})
+    # V8 isolates do not survive a fork, so every worker starts fresh and owns its contexts
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(tasks)),
+        mp_context=get_context('spawn'),
+        initializer=init_page_worker,
+        initargs=(site, template_names)
+    ) as executor:
+        results = []
+        for result, measurements in executor.map(
+            build_page_in_worker,
+            tasks,
+            chunksize=max(1, len(tasks) // (jobs * 8))
+        ):
+            if measurements is not None:
+                PROFILER.merge(measurements)
+            results.append(result)
+        return results
+
+__all__ = [
+    'get_file_contents',
+    'get_template_source',
+    'get_template_renderer',
+    'forget_template',
+    'copy_resources',
+    'get_resources_key',
+    'build_node_contents',
+    'build_pages',
+    'extract_shared_assets'
+]
@@ -0,0 +1,318 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import re
+import copy
+from typing import BinaryIO, Callable, Optional
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup as bs4
+from bs4.builder import HTMLParserTreeBuilder
+from bs4.dammit import EntitySubstitution, UnicodeDammit
+from bs4.formatter import HTMLFormatter
+from .js import minify_css, minify_js
+
+OUTPUT_ENCODING = 'utf8'
+HTML5_FORMATTER = HTMLFormatter.REGISTRY['html5']
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+HTML_BUILDER = HTMLParserTreeBuilder()
+VOID_ELEMENTS = HTML_BUILDER.empty_element_tags
+PRESERVE_WHITESPACE_TAGS = HTML_BUILDER.preserve_whitespace_tags
+CDATA_LIST_ATTRIBUTES = HTML_BUILDER.cdata_list_attributes
+CDATA_CONTAINING_TAGS = {'script', 'style'}
+BLOCK_MARKER = '\ufdd0'
+BLOCK_MARKER_RE = re.compile(f'{BLOCK_MARKER}([0-9]+){BLOCK_MARKER}'.encode(OUTPUT_ENCODING))
+CHARSET_RE = re.compile(r"((^|;)\s*charset=)([^;]*)", re.M)
+NONWHITESPACE_RE = re.compile(r"\S+")
+DECIMAL_REFERENCE_RE = re.compile("^([0-9]+)(.*)")
+HEX_REFERENCE_RE = re.compile("^([0-9a-f]+)(.*)")
+
+def should_minify(tag_type: Optional[str]) -> bool:
+    return not tag_type or tag_type.lower() == 'javascript'
+
+def get_stylesheet_href(stylesheet: str) -> str:
+    return f'./css/{stylesheet[2:]}.css' if stylesheet.startswith('./') else f'/css/{stylesheet}.css'
+
+def get_extracted_stylesheet_attributes(attrs: dict, href: str) -> dict:
+    return dict(attrs, rel=['stylesheet'], href=href)
+
+def postprocess_html_tree(html: str, extra_stylesheets: list, inline_styles: Optional[str], find_asset: Optional[Callable] = None, inline_assets: Optional[list] = None) -> bytes:
+    html = bs4(html, features="html.parser")
+    # Blocks that may become assets are serialized on their own and put back in place of a marker
+    blocks = []
+    for s in html.find_all('script'):
+        if should_minify(s.get('type')):
+            s.string = minify_js(s.string)['code']
+            href = find_asset('js', s.string) if find_asset is not None else None
+            if href is not None:
+                extracted = copy.copy(s)
+                extracted.clear()
+                extracted['src'] = href
+                blocks.append((s, href, extracted))
+    for s in html.find_all('style'):
+        if should_minify(s.get('type')):
+            s.string = minify_css(s.string)['css']
+            href = find_asset('css', s.string) if find_asset is not None else None
+            if href is not None:
+                blocks.append((s, href, html.new_tag('link', attrs=get_extracted_stylesheet_attributes(s.attrs, href))))
+    serialized_blocks = []
+    for i, (s, href, extracted) in enumerate(blocks):
+        serialized_blocks.append((
+            s.encode(OUTPUT_ENCODING, formatter='html5'),
+            s.string.encode(OUTPUT_ENCODING),
+            href,
+            extracted.decode(formatter='html5')
+        ))
+        s.replace_with(f'{BLOCK_MARKER}{i}{BLOCK_MARKER}')
+    for s in extra_stylesheets:
+        new_stylesheet_node = html.new_tag('link')
+        new_stylesheet_node['rel'] = 'stylesheet'
+        new_stylesheet_node['href'] = get_stylesheet_href(s)
+        html.find('head').append(new_stylesheet_node)
+    if inline_styles is not None:
+        new_stylesheet_node = html.new_tag('style')
+        new_stylesheet_node.string = inline_styles
+        html.find('head').append(new_stylesheet_node)
+    page = html.encode(encoding=OUTPUT_ENCODING, formatter='html5')
+    if not blocks:
+        return page
+    parts = BLOCK_MARKER_RE.split(page)
+    page = bytearray(parts[0])
+    for i, text in zip(parts[1::2], parts[2::2]):
+        block, contents, href, extracted = serialized_blocks[int(i)]
+        start = len(page)
+        page += block
+        contents_end = len(page) - len(block) + block.rindex(b'</')
+        inline_assets.append([href, start, contents_end - len(contents), contents_end, len(page), extracted])
+        page += text
+    return bytes(page)
+
+class StreamingPostProcessor(HTMLParser):
+    # Mirrors how `BeautifulSoup` builds its tree with `html.parser` and serializes it with the `html5` formatter,
+    # keeping only the stack of open elements instead of the whole tree
+    def __init__(self, output: BinaryIO, extra_stylesheets: list, inline_styles: Optional[str], find_asset: Optional[Callable] = None, inline_assets: Optional[list] = None) -> None:
+        super().__init__(convert_charrefs=False)
+        self.output = output
+        self.find_asset = find_asset
+        self.inline_assets = inline_assets
+        self.extra_stylesheets = extra_stylesheets
+        self.inline_styles = inline_styles
+        self.pending_head_additions = bool(extra_stylesheets) or inline_styles is not None
+        self.head_seen = False
+        self.stack = []
+        self.open_tag_counter = {}
+        self.current_data = []
+        self.already_closed_empty_element = []
+
+    def write(self, text: str) -> None:
+        self.output.write(text.encode(OUTPUT_ENCODING, 'xmlcharrefreplace'))
+
+    def end_data(self) -> Optional[str]:
+        if not self.current_data:
+            return None
+        data = ''.join(self.current_data)
+        self.current_data = []
+        if not any(e['name'] in PRESERVE_WHITESPACE_TAGS for e in self.stack):
+            if all(c in ASCII_SPACES for c in data):
+                data = '\n' if '\n' in data else ' '
+        return data
+
+    def flush_text(self) -> None:
+        data = self.end_data()
+        if data is None:
+            return
+        if self.stack and self.stack[-1]['name'] in CDATA_CONTAINING_TAGS:
+            self.stack[-1]['strings'].append(data)
+        else:
+            self.write(HTML5_FORMATTER.substitute(data))
+
+    def flush_special(self, prefix: str, suffix: str) -> None:
+        data = self.end_data()
+        self.write(prefix + (data or '') + suffix)
+
+    def format_start_tag(self, name: str, attrs: dict) -> str:
+        result = '<' + name
+        for key, value in sorted(attrs.items()):
+            if isinstance(value, list):
+                value = ' '.join(value)
+            elif value == '':
+                result += ' ' + key
+                continue
+            result += ' ' + key + '=' + HTML5_FORMATTER.quoted_attribute_value(HTML5_FORMATTER.attribute_value(value))
+        return result + '>'
+
+    def normalize_attributes(self, name: str, attrs: list) -> dict:
+        result = {}
+        for key, value in attrs:
+            result[key] = '' if value is None else value
+        list_attributes = set(CDATA_LIST_ATTRIBUTES.get('*', [])) | set(CDATA_LIST_ATTRIBUTES.get(name, []))
+        for key in result:
+            if key in list_attributes:
+                result[key] = NONWHITESPACE_RE.findall(result[key])
+        if name == 'meta':
+            if 'charset' in result:
+                result['charset'] = OUTPUT_ENCODING
+            elif 'content' in result and result.get('http-equiv', '').lower() == 'content-type':
+                result['content'] = CHARSET_RE.sub(lambda m: m.group(1) + OUTPUT_ENCODING, result['content'])
+        return result
+
+    def push_tag(self, name: str, attrs: dict) -> None:
+        self.stack.append({'name': name, 'attrs': attrs, 'strings': []})
+        self.open_tag_counter[name] = self.open_tag_counter.get(name, 0) + 1
+        if name not in CDATA_CONTAINING_TAGS:
+            self.write(self.format_start_tag(name, attrs))
+
+    def pop_tag(self) -> None:
+        e = self.stack.pop()
+        name = e['name']
+        self.open_tag_counter[name] -= 1
+        if name in CDATA_CONTAINING_TAGS:
+            # The element is only written once it is closed, so its contents can be minified as a whole
+            attrs = e['attrs']
+            strings = e['strings']
+            if should_minify(attrs.get('type')):
+                string = strings[0] if len(strings) == 1 else None
+                strings = [minify_js(string)['code'] if name == 'script' else minify_css(string)['css']]
+                href = self.find_asset('js' if name == 'script' else 'css', strings[0]) if self.find_asset is not None else None
+                if href is not None:
+                    # The block stays inline, where it is is recorded so it can be swapped for a link to the asset
+                    if name == 'style':
+                        extracted = self.format_start_tag('link', get_extracted_stylesheet_attributes(attrs, href))
+                    else:
+                        extracted = self.format_start_tag(name, dict(attrs, src=href)) + f'</{name}>'
+                    start = self.output.tell()
+                    self.write(self.format_start_tag(name, attrs))
+                    contents_start = self.output.tell()
+                    self.write(strings[0])
+                    contents_end = self.output.tell()
+                    self.write(f'</{name}>')
+                    self.inline_assets.append([href, start, contents_start, contents_end, self.output.tell(), extracted])
+                    return
+            self.write(self.format_start_tag(name, attrs))
+            self.write(''.join(strings))
+        if name == 'head' and e.get('first_head') and self.pending_head_additions:
+            for s in self.extra_stylesheets:
+                self.write(self.format_start_tag('link', {'rel': ['stylesheet'], 'href': get_stylesheet_href(s)}))
+            if self.inline_styles is not None:
+                self.write('<style>' + self.inline_styles + '</style>')
+            self.pending_head_additions = False
+        if name not in VOID_ELEMENTS:
+            self.write(f'</{name}>')
+
+    def pop_to_tag(self, name: str) -> None:
+        while self.stack and self.open_tag_counter.get(name):
+            popped_name = self.stack[-1]['name']
+            self.pop_tag()
+            if popped_name == name:
+                break
+
+    def handle_startendtag(self, tag: str, attrs: list) -> None:
+        self.handle_starttag(tag, attrs, handle_empty_element=False)
+        self.handle_endtag(tag, check_already_closed=False)
+
+    def handle_starttag(self, tag: str, attrs: list, handle_empty_element: bool = True) -> None:
+        self.flush_text()
+        self.push_tag(tag, self.normalize_attributes(tag, attrs))
+        if tag == 'head' and not self.head_seen:
+            self.head_seen = True
+            self.stack[-1]['first_head'] = True
+        if tag in VOID_ELEMENTS and handle_empty_element:
+            self.handle_endtag(tag, check_already_closed=False)
+            self.already_closed_empty_element.append(tag)
+
+    def handle_endtag(self, tag: str, check_already_closed: bool = True) -> None:
+        if check_already_closed and tag in self.already_closed_empty_element:
+            self.already_closed_empty_element.remove(tag)
+        else:
+            self.flush_text()
+            self.pop_to_tag(tag)
+
+    def handle_data(self, data: str) -> None:
+        self.current_data.append(data)
+
+    def handle_charref(self, name: str) -> None:
+        base = 10
+        reference_re = DECIMAL_REFERENCE_RE
+        if name.startswith('x') or name.startswith('X'):
+            name = name[1:]
+            base = 16
+            reference_re = HEX_REFERENCE_RE
+        real_name = None
+        extra_data = ''
+        try:
+            real_name = int(name, base)
+        except ValueError:
+            m = reference_re.search(name)
+            if m is not None:
+                real_name = int(m.groups()[0], base)
+                extra_data = m.groups()[1]
+        if real_name is None:
+            self.handle_data('')
+            self.handle_data(name)
+        else:
+            self.handle_data(UnicodeDammit.numeric_character_reference(real_name)[0])
+            self.handle_data(extra_data)
+
+    def handle_entityref(self, name: str) -> None:
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.handle_data(character if character is not None else f'&{name}')
+
+    def handle_comment(self, data: str) -> None:
+        self.flush_text()
+        self.handle_data(data)
+        self.flush_special('<!--', '-->')
+
+    def handle_decl(self, decl: str) -> None:
+        self.flush_text()
+        self.handle_data(decl[len('DOCTYPE '):])
+        self.flush_special('<!DOCTYPE ', '>\n')
+
+    def unknown_decl(self, data: str) -> None:
+        self.flush_text()
+        if data.upper().startswith('CDATA['):
+            self.handle_data(data[len('CDATA['):])
+            self.flush_special('<![CDATA[', ']]>')
+        else:
+            self.handle_data(data)
+            self.flush_special('<?', '?>')
+
+    def handle_pi(self, data: str) -> None:
+        self.flush_text()
+        self.handle_data(data)
+        self.flush_special('<?', '>')
+
+    def close(self) -> None:
+        super().close()
+        self.flush_text()
+        while self.stack:
+            self.pop_tag()
+        if self.pending_head_additions:
+            raise Exception('No `head` element found to add the stylesheets to')
+
+def postprocess_html_stream(html: str, extra_stylesheets: list, inline_styles: Optional[str], output: BinaryIO, find_asset: Optional[Callable] = None, inline_assets: Optional[list] = None) -> None:
+    processor = StreamingPostProcessor(output, extra_stylesheets, inline_styles, find_asset, inline_assets)
+    processor.feed(html)
+    processor.close()
+
+__all__ = [
+    'postprocess_html_tree',
+    'postprocess_html_stream'
+]
@@ -0,0 +1,131 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from .incremental import hash_file
+from .instrumentation import PROFILER
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SYNC_MODES = ['copy', 'hardlink', 'reflink']
+COMPARE_MODES = ['stat', 'hash']
+FICLONE = 0x40049409
+
+def is_up_to_date(src: str, dst: str, compare: str) -> bool:
+    try:
+        dst_stat = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+    src_stat = os.lstat(src)
+    if os.path.islink(src):
+        return os.path.islink(dst) and os.readlink(src) == os.readlink(dst)
+    if os.path.islink(dst) or src_stat.st_size != dst_stat.st_size:
+        return False
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        return True
+    if compare == 'hash':
+        return hash_file(src) == hash_file(dst)
+    return src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+def reflink_file(src: str, dst: str) -> None:
+    if fcntl is None:
+        raise OSError('Reflinks are not supported on this platform')
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+def sync_file(src: str, dst: str, mode: str = 'copy', compare: str = 'stat') -> bool:
+    if is_up_to_date(src, dst, compare):
+        return False
+    # Never write through the old file, it may be a hard link to a source
+    tmp = f'{dst}.rasana-tmp'
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), tmp)
+    else:
+        try:
+            if mode == 'hardlink':
+                os.link(src, tmp)
+            elif mode == 'reflink':
+                reflink_file(src, tmp)
+            else:
+                shutil.copy2(src, tmp)
+        except OSError:
+            # Linking only works within a filesystem, so fall back to copying
+            if mode == 'copy':
+                raise
+            shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+    return True
+
+def plan_resources(node: dict, base_path: str, node_output_path: str) -> list:
+    pairs = []
+    for r, rtype in node.get('resources', {}).items():
+        src = os.path.join(base_path, r)
+        if os.path.isdir(src):
+            dst = os.path.join(node_output_path, (rtype or r))
+            for root, dirs, files in os.walk(src):
+                dirs.sort()
+                for name in sorted(files) + sorted(d for d in dirs if os.path.islink(os.path.join(root, d))):
+                    file_path = os.path.join(root, name)
+                    pairs.append((file_path, os.path.join(dst, os.path.relpath(file_path, src))))
+        elif os.path.isfile(src):
+            if rtype not in ['css', 'font', 'img', 'js']:
+                # TODO: Warn the inconsistency
+                pass
+            else:
+                pairs.append((src, os.path.join(node_output_path, rtype, r)))
+    return pairs
+
+def sync_resources(node: dict, base_path: str, node_output_path: str, mode: str = 'copy', compare: str = 'stat', threads: Optional[int] = None) -> list:
+    pairs = plan_resources(node, base_path, node_output_path)
+    for d in sorted({os.path.dirname(dst) for _, dst in pairs}):
+        os.makedirs(d, exist_ok=True)
+    def sync_pair(pair: tuple) -> bool:
+        return sync_file(*pair, mode=mode, compare=compare)
+    if len(pairs) > 1 and threads != 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            synced = list(executor.map(sync_pair, pairs))
+    else:
+        synced = [sync_pair(pair) for pair in pairs]
+    PROFILER.count('resource files copied', sum(synced))
+    PROFILER.count('resource files skipped', len(synced) - sum(synced))
+    return [dst for _, dst in pairs]
+
+__all__ = [
+    'SYNC_MODES',
+    'COMPARE_MODES',
+    'sync_file',
+    'plan_resources',
+    'sync_resources'
+]
@@ -0,0 +1,197 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import re
+import json
+import unicodedata
+from html.parser import HTMLParser
+from typing import Optional
+from .incremental import hash_json, is_entry_up_to_date
+from .output import write_output
+from .instrumentation import PROFILER
+
+SEARCH_PATH = 'search'
+SEARCH_INDEX_VERSION = 1
+SHARD_PREFIX_LENGTH = 2
+TITLE_WEIGHT = 5
+LOADER_PATH = os.path.join(os.path.dirname(__file__), 'js', 'search_loader.js')
+ZWNJ = '\u200c'
+# Arabic letter forms are folded into the Persian ones, and every digit into ASCII, so queries typed
+# with either keyboard find the same words
+SEARCH_CHARACTER_MAP = str.maketrans({
+    '\u064a': '\u06cc', '\u0649': '\u06cc', '\u0643': '\u06a9', '\u0640': None, '\u0670': None,
+    **{chr(c): None for c in range(0x064b, 0x0653)},
+    **{chr(0x06f0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)}
+})
+WORD_RE = re.compile('[^\\W_]+(?:\u200c[^\\W_]+)*')
+IGNORED_TAGS = {'script', 'style', 'noscript', 'template'}
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize('NFKC', text).translate(SEARCH_CHARACTER_MAP).lower()
+
+def tokenize(text: str) -> list:
+    # Words written with a ZWNJ are indexed both joined and by their parts, e.g. `کتاب‌ها` as `کتابها`,
+    # `کتاب` and `ها`, as they are typed either way
+    tokens = []
+    for word in WORD_RE.findall(normalize_text(text)):
+        parts = word.split(ZWNJ)
+        tokens.append(''.join(parts))
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return [t for t in tokens if len(t) > 1]
+
+class TextExtractor(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.ignored_depth = 0
+        self.main_depth = 0
+        self.texts = []
+        self.main_texts = []
+        self.title = []
+        self.in_title = False
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag in IGNORED_TAGS:
+            self.ignored_depth += 1
+        elif tag == 'main':
+            self.main_depth += 1
+        elif tag == 'title':
+            self.in_title = True
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in IGNORED_TAGS:
+            self.ignored_depth = max(0, self.ignored_depth - 1)
+        elif tag == 'main':
+            self.main_depth = max(0, self.main_depth - 1)
+        elif tag == 'title':
+            self.in_title = False
+
+    def handle_data(self, data: str) -> None:
+        if self.ignored_depth:
+            return
+        if self.in_title:
+            self.title.append(data)
+            return
+        self.texts.append(data)
+        if self.main_depth:
+            self.main_texts.append(data)
+
+def extract_text(html: str) -> tuple:
+    extractor = TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    # The `main` element, when there is one, leaves the navigation repeated on every page out
+    texts = extractor.main_texts or extractor.texts
+    return ''.join(extractor.title).strip(), ' '.join(texts)
+
+def get_search_document(url: str, node: dict, html: str, markdowns: dict) -> dict:
+    page_title, page_text = extract_text(html)
+    title = node['title'] if isinstance(node.get('title'), str) else page_title
+    if markdowns:
+        # Markdown variables hold the contents of the page without the surrounding theme
+        page_text = ' '.join(extract_text(e)[1] for e in markdowns.values())
+    terms = {}
+    for t in tokenize(title):
+        terms[t] = terms.get(t, 0) + TITLE_WEIGHT
+    for t in tokenize(page_text):
+        terms[t] = terms.get(t, 0) + 1
+    return {
+        'url': url,
+        'title': title,
+        'terms': terms
+    }
+
+def get_shard_name(term: str) -> str:
+    return term[:SHARD_PREFIX_LENGTH].encode('utf8').hex()
+
+def assign_document_ids(previous_ids: dict, entry_ids: list) -> dict:
+    # Pages keep their ids between builds, so a changed page only changes the shards of its own terms
+    ids = {e: previous_ids[e] for e in entry_ids if e in previous_ids}
+    if len(ids) * 2 < max(ids.values(), default=-1) + 1:
+        ids = {}
+    next_id = max(ids.values(), default=-1) + 1
+    for e in entry_ids:
+        if e not in ids:
+            ids[e] = next_id
+            next_id += 1
+    return ids
+
+def build_search_index(output_path: str, manifest: dict, previous_entry: Optional[dict]) -> dict:
+    documents = {
+        entry_id: entry['search']
+        for entry_id, entry in sorted(manifest['entries'].items())
+        if 'search' in entry
+    }
+    with open(LOADER_PATH) as f:
+        loader = f.read()
+    entry_key = hash_json([SEARCH_INDEX_VERSION, documents, loader])
+    if is_entry_up_to_date(output_path, previous_entry, entry_key):
+        PROFILER.count('search index skipped')
+        return previous_entry
+    ids = assign_document_ids((previous_entry or {}).get('ids', {}), list(documents))
+    document_list = [None] * (max(ids.values(), default=-1) + 1)
+    shards = {}
+    for entry_id, document in documents.items():
+        document_id = ids[entry_id]
+        document_list[document_id] = [document['url'], document['title']]
+        for term, weight in document['terms'].items():
+            shards.setdefault(get_shard_name(term), {}).setdefault(term, []).extend([document_id, weight])
+    os.makedirs(os.path.join(output_path, SEARCH_PATH, 'shards'), exist_ok=True)
+    digests = {}
+    def write_search_output(relative_path: str, contents: str) -> str:
+        digests[relative_path] = write_output(os.path.join(output_path, relative_path), contents.encode('utf8'))
+        return digests[relative_path]
+    shard_versions = {}
+    for name, postings in sorted(shards.items()):
+        for term in postings:
+            # Postings are flat `[id, weight, id, weight, ...]` lists sorted by id
+            pairs = sorted(zip(postings[term][::2], postings[term][1::2]))
+            postings[term] = [e for pair in pairs for e in pair]
+        digest = write_search_output(f'{SEARCH_PATH}/shards/{name}.json', to_compact_json(postings))
+        shard_versions[name] = digest[:8]
+    write_search_output(f'{SEARCH_PATH}/index.json', to_compact_json({
+        'version': SEARCH_INDEX_VERSION,
+        'prefixLength': SHARD_PREFIX_LENGTH,
+        'documentCount': len(documents),
+        'documents': document_list,
+        'shards': shard_versions
+    }))
+    write_search_output(f'{SEARCH_PATH}/search.js', loader)
+    PROFILER.count('search shards', len(shards))
+    return {
+        'key': entry_key,
+        'ids': ids,
+        'outputs': sorted(digests),
+        'digests': digests
+    }
+
+def to_compact_json(o: object) -> str:
+    return json.dumps(o, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+
+__all__ = [
+    'normalize_text',
+    'tokenize',
+    'get_search_document',
+    'build_search_index'
+]
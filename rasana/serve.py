@@ -0,0 +1,345 @@
+# =================================================================================
+#  Copyright (c) 2023 Behrooz Vedadian
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+ 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# =================================================================================
+
+import os
+import time
+import threading
+import traceback
+from functools import partial
+from typing import Callable, Optional
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from .incremental import save_manifest, remove_stale_outputs
+from .js import minify_css
+from .pages import get_file_contents, build_node_contents, forget_template, extract_shared_assets
+from .output import write_output, compute_delta, save_delta
+from .search import build_search_index
+from .images import plan_images, prepare_images
+from .compress import precompress_outputs
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+LIVE_RELOAD_PATH = '/__rasana/events'
+# Files in resource trees are all checked this often, the edits keeping their directory as it is show up then
+RESOURCE_RESCAN_SECONDS = 5
+LIVE_RELOAD_SCRIPT = (
+    '<script>'
+    f'new EventSource("{LIVE_RELOAD_PATH}").onmessage=function(){{location.reload()}};'
+    '</script>'
+)
+
+def take_snapshot(roots: list, ignored_paths: list, resource_paths: set = frozenset(), previous: Optional[tuple] = None, check_resources: bool = False) -> tuple:
+    # Directories are only listed again when their mtime changes, and the files of resource trees, which hold most
+    # of them, are only checked then too or when `check_resources` is set. The rest is checked on every call, as
+    # editors may write files in place.
+    files = {}
+    directories = {}
+    previous_files, previous_directories = previous or ({}, {})
+    def scan(path: str, in_resources: bool) -> None:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        known = previous_directories.get(path)
+        if known is not None and known[0] == mtime:
+            directories[path] = known
+            for child, is_dir in known[1]:
+                if is_dir:
+                    files[child] = None
+                    scan(child, in_resources or child in resource_paths)
+                elif in_resources and not check_resources:
+                    if child in previous_files:
+                        files[child] = previous_files[child]
+                else:
+                    try:
+                        s = os.stat(child, follow_symlinks=False)
+                    except OSError:
+                        continue
+                    files[child] = (s.st_mtime_ns, s.st_size)
+            return
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return
+        children = []
+        for e in entries:
+            child = os.path.abspath(e.path)
+            if e.name.startswith('.') or child in ignored_paths:
+                continue
+            try:
+                is_dir = e.is_dir(follow_symlinks=False)
+                s = None if is_dir else e.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            files[child] = None if is_dir else (s.st_mtime_ns, s.st_size)
+            children.append((child, is_dir))
+            if is_dir:
+                scan(child, in_resources or child in resource_paths)
+        directories[path] = (mtime, children)
+    for root in roots:
+        scan(os.path.abspath(root), False)
+    return files, directories
+
+def get_changed_paths(old_snapshot: tuple, new_snapshot: tuple) -> set:
+    old_files, new_files = old_snapshot[0], new_snapshot[0]
+    changed_paths = {p for p, v in new_files.items() if old_files.get(p, False) != v}
+    changed_paths.update(p for p in old_files if p not in new_files)
+    return changed_paths
+
+class ChangeCollector:
+    # Receives the events of `watchdog`, which tells about changes instead of being asked for them
+    def __init__(self, roots: list, ignored_paths: list) -> None:
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.ignored_paths = ignored_paths
+        self.changed_paths = set()
+        self.changed = threading.Condition()
+        self.observer = Observer()
+        for root in self.roots:
+            self.observer.schedule(self, root, recursive=True)
+        self.observer.start()
+
+    def is_ignored(self, path: str) -> bool:
+        if any(path == p or path.startswith(p + os.sep) for p in self.ignored_paths):
+            return True
+        root = next((r for r in self.roots if path.startswith(r + os.sep)), None)
+        return root is None or any(part.startswith('.') for part in os.path.relpath(path, root).split(os.sep))
+
+    def dispatch(self, event: object) -> None:
+        # Reading files and touching directories change nothing the build depends on
+        if event.event_type not in ('created', 'deleted', 'modified', 'moved') or\
+           (event.is_directory and event.event_type == 'modified'):
+            return
+        paths = [os.path.abspath(os.fsdecode(event.src_path))]
+        if getattr(event, 'dest_path', None):
+            paths.append(os.path.abspath(os.fsdecode(event.dest_path)))
+        paths = [p for p in paths if not self.is_ignored(p)]
+        if paths:
+            with self.changed:
+                self.changed_paths.update(paths)
+                self.changed.notify_all()
+
+    def take(self, interval: float) -> set:
+        with self.changed:
+            self.changed.wait_for(lambda: self.changed_paths)
+        # Editors write a file in several steps, they are gathered into a single rebuild
+        time.sleep(interval)
+        with self.changed:
+            changed_paths, self.changed_paths = self.changed_paths, set()
+        return changed_paths
+
+def build_dependency_graph(state: dict) -> dict:
+    site = state['site']
+    theme_specs = site['theme_specs']
+    graph = {}
+    def depend(path: str, target: object) -> None:
+        graph.setdefault(os.path.abspath(path), set()).add(target)
+    for i, task in enumerate(state['tasks']):
+        node, base_path = task[0], task[1]
+        template_name = node.get('template', 'default')
+        depend(os.path.join(theme_specs['base_path'], theme_specs['templates'][template_name]), i)
+        for file_name in node.get('markdowns', {}).values():
+            depend(os.path.join(site['website_path'], base_path, file_name), i)
+        if 'inlineStyles' in node:
+            depend(os.path.join(site['website_path'], base_path, node['inlineStyles']), i)
+        for r in node.get('resources', {}):
+            depend(os.path.join(base_path, r), i)
+    # Pages only link to the additional stylesheets, so an edit rewrites the stylesheet alone
+    for name, file_name in site['website_specs'].get('additionalStylesheets', {}).items():
+        depend(os.path.join(site['website_path'], 'additional_stylesheets', file_name), ('stylesheet', name))
+    return graph
+
+def get_resource_paths(state: dict) -> set:
+    return {
+        os.path.abspath(os.path.join(task[1], r))
+        for task in state['tasks'] for r in task[0].get('resources', {})
+        if os.path.isdir(os.path.join(task[1], r))
+    }
+
+def rebuild_stylesheet(state: dict, name: str) -> None:
+    site = state['site']
+    file_name = site['website_specs']['additionalStylesheets'][name]
+    contents = get_file_contents(os.path.join(site['website_path'], 'additional_stylesheets', file_name))
+    relative_path = os.path.join('css', f'{name}.css')
+    digest = write_output(os.path.join(site['output_path'], relative_path), minify_css(contents)['css'].encode('utf8'))
+    site_entry = state['manifest']['entries']['site']
+    # Entries are shared with the previous manifest, so they are replaced instead of changed
+    state['manifest']['entries']['site'] = dict(site_entry, digests=dict(site_entry['digests'], **{relative_path: digest}))
+
+def get_affected_tasks(graph: dict, changed_paths: set) -> Optional[set]:
+    affected_tasks = set()
+    for changed_path in changed_paths:
+        dependents = graph.get(changed_path)
+        if dependents is None:
+            # Resources are registered by their top level file or directory
+            parent_path = os.path.dirname(changed_path)
+            while dependents is None and parent_path != os.path.dirname(parent_path):
+                dependents = graph.get(parent_path)
+                parent_path = os.path.dirname(parent_path)
+        if dependents is None:
+            # Anything outside the graph may change the structure of the site
+            return None
+        affected_tasks.update(dependents)
+    return affected_tasks
+
+def watch(build_site: Callable, website_path: str, output_path: str, base_url: str, on_rebuild: Optional[Callable] = None, interval: float = 0.1, **build_options: dict) -> None:
+    state = build_site(website_path, output_path, base_url, incremental=True, **build_options)
+    build_options['jobs'] = 1 # Keep rebuilds in this process so the V8 contexts stay warm
+    graph = build_dependency_graph(state)
+    roots = [website_path, state['site']['theme_specs']['base_path']]
+    ignored_paths = [os.path.abspath(output_path)]
+    if Observer is not None:
+        collector = ChangeCollector(roots, ignored_paths)
+        print(f'Watching `{website_path}` for changes')
+    else:
+        resource_paths = get_resource_paths(state)
+        snapshot = take_snapshot(roots, ignored_paths, resource_paths)
+        rescan_time = time.perf_counter()
+        print(f'Watching `{website_path}` for changes by polling, install `watchdog` to be notified of them instead')
+    while True:
+        if Observer is not None:
+            changed_paths = collector.take(interval)
+        else:
+            time.sleep(interval)
+            rescan = time.perf_counter() - rescan_time >= RESOURCE_RESCAN_SECONDS
+            if rescan:
+                rescan_time = time.perf_counter()
+            new_snapshot = take_snapshot(roots, ignored_paths, resource_paths, snapshot, rescan)
+            changed_paths = get_changed_paths(snapshot, new_snapshot)
+            snapshot = new_snapshot
+        if not changed_paths:
+            continue
+        start_time = time.perf_counter()
+        for changed_path in changed_paths:
+            forget_template(changed_path)
+        try:
+            affected_tasks = get_affected_tasks(graph, changed_paths)
+            if affected_tasks is None:
+                state = build_site(website_path, output_path, base_url, incremental=True, **build_options)
+                graph = build_dependency_graph(state)
+                if Observer is None:
+                    resource_paths = get_resource_paths(state)
+                rebuilt = 'the site'
+            else:
+                page_tasks = sorted(t for t in affected_tasks if isinstance(t, int))
+                stylesheets = sorted(t[1] for t in affected_tasks if isinstance(t, tuple))
+                site = dict(state['site'], previous_entries={})
+                if site['image_widths']:
+                    site['images'] = dict(site['images'], **prepare_images(
+                        [src for i in page_tasks for src, _ in plan_images(*state['tasks'][i][:3])],
+                        site['image_widths'], site['image_quality']
+                    ))
+                    state['site']['images'] = site['images']
+                previous_manifest = {'entries': dict(state['manifest']['entries'])}
+                for i in page_tasks:
+                    _, entry_id, entry = build_node_contents(site, *state['tasks'][i])
+                    state['manifest']['entries'][entry_id] = entry
+                if site.get('inline_asset_threshold') is not None:
+                    extract_shared_assets(site, state['tasks'], state['manifest']['entries'])
+                for name in stylesheets:
+                    rebuild_stylesheet(state, name)
+                if site.get('search_index'):
+                    state['manifest']['entries']['search'] = build_search_index(
+                        output_path, state['manifest'], previous_manifest['entries'].get('search')
+                    )
+                if build_options.get('precompress'):
+                    state['manifest']['entries']['precompressed'] = precompress_outputs(
+                        output_path, state['manifest'], previous_manifest['entries'].get('precompressed'),
+                        build_options['precompress'],
+                        {'gzip': build_options.get('gzip_level', 9), 'brotli': build_options.get('brotli_quality', 11)}
+                    )
+                remove_stale_outputs(output_path, previous_manifest, state['manifest'])
+                save_manifest(output_path, state['manifest'])
+                save_delta(output_path, compute_delta(previous_manifest, state['manifest']))
+                rebuilt = f'{len(page_tasks)} page(s) and {len(stylesheets)} stylesheet(s)'
+        except Exception:
+            traceback.print_exc()
+            continue
+        print(f'Rebuilt {rebuilt} in {(time.perf_counter() - start_time) * 1000:.0f}ms')
+        if on_rebuild is not None:
+            on_rebuild()
+
+def serve(build_site: Callable, website_path: str, output_path: str, host: str = '127.0.0.1', port: int = 8000, **watch_options: dict) -> None:
+    version = [0]
+    version_changed = threading.Condition()
+    def on_rebuild() -> None:
+        with version_changed:
+            version[0] += 1
+            version_changed.notify_all()
+    class PreviewRequestHandler(SimpleHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path == LIVE_RELOAD_PATH:
+                self.send_live_reload_events()
+                return
+            file_path = self.translate_path(self.path)
+            if os.path.isdir(file_path):
+                file_path = os.path.join(file_path, 'index.html')
+            if not file_path.endswith('.html') or not os.path.isfile(file_path):
+                super().do_GET()
+                return
+            with open(file_path, 'rb') as f:
+                html = f.read()
+            i = html.rfind(b'</body>')
+            i = len(html) if i < 0 else i
+            html = html[:i] + LIVE_RELOAD_SCRIPT.encode('utf8') + html[i:]
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(html)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(html)
+        def send_live_reload_events(self) -> None:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            seen_version = version[0]
+            try:
+                while True:
+                    with version_changed:
+                        version_changed.wait_for(lambda: version[0] != seen_version, timeout=15)
+                    if version[0] != seen_version:
+                        seen_version = version[0]
+                        self.wfile.write(b'data: reload\n\n')
+                    else:
+                        self.wfile.write(b': keep-alive\n\n')
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        def log_message(self, format: str, *args: list) -> None:
+            pass
+    os.makedirs(output_path, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), partial(PreviewRequestHandler, directory=output_path))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Serving `{output_path}` on http://{host}:{port}/')
+    try:
+        watch(build_site, website_path, output_path, f'http://{host}:{port}', on_rebuild=on_rebuild, **watch_options)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+__all__ = [
+    'watch',
+    'serve'
+]